@@ -1,7 +1,7 @@
 
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import Organization, Payment, BalanceLog
+from .models import Organization, Payment, BalanceLog, DailyTurnover
 
 # Общий CSS стиль для админки
 admin.site.site_header = "Администрирование платежной системы"
@@ -129,4 +129,16 @@ class BalanceLogAdmin(admin.ModelAdmin):
     class Media:
         css = {
             'all': ('css/admin/admin.css',)
-        }
\ No newline at end of file
+        }
+
+@admin.register(DailyTurnover)
+class DailyTurnoverAdmin(admin.ModelAdmin):
+    list_display = ('organization', 'day', 'operation_type', 'count', 'amount')
+    list_filter = ('operation_type', 'day')
+    search_fields = ('organization__inn',)
+    date_hierarchy = 'day'
+    # Агрегаты поддерживаются автоматически - редактировать их вручную нельзя
+    readonly_fields = ('organization', 'day', 'operation_type', 'count', 'amount')
+
+    def has_add_permission(self, request):
+        return False
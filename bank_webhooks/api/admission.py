@@ -0,0 +1,276 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# Классы запросов: критичные (вебхуки банка) и сбрасываемые первыми (опрос баланса)
+CRITICAL = 'critical'
+SHEDDABLE = 'sheddable'
+
+# Настройки по умолчанию, переопределяются через settings.ADMISSION_CONTROL
+DEFAULTS = {
+    'ENABLED': True,
+    # Соответствие имени URL классу запроса; остальные URL не ограничиваются
+    'ROUTES': {
+        'bank-webhook': CRITICAL,
+        'ledger-postings': CRITICAL,
+        'organization-balance': SHEDDABLE,
+    },
+    # Границы адаптивного лимита одновременных запросов (на процесс)
+    'INITIAL_LIMIT': 32,
+    'MIN_LIMIT': 4,
+    'MAX_LIMIT': 256,
+    # Доля лимита, доступная сбрасываемым запросам
+    'SHEDDABLE_SHARE': 0.5,
+    # Во сколько раз текущее время в БД может превышать базовое до снижения лимита
+    'LATENCY_TOLERANCE': 2.0,
+    # Время в БД на запрос, ниже которого деградация не фиксируется (секунды)
+    'MIN_DB_LATENCY': 0.01,
+    # Абсолютный потолок времени в БД на один HTTP-запрос (секунды)
+    'MAX_DB_LATENCY': 0.5,
+    # Коэффициент мультипликативного снижения лимита при деградации
+    'BACKOFF': 0.9,
+    # Лимит снижается не чаще одного раза за этот интервал (секунды)
+    'BACKOFF_INTERVAL': 1.0,
+    # Токен-бакеты на источник для сбрасываемых запросов: базовая скорость
+    # (запросов в секунду) и емкость
+    'SOURCE_RATE': 50.0,
+    'SOURCE_BURST': 100.0,
+    # Отдельные бакеты критичных запросов (банк - один источник); None - без
+    # ограничения на источник, критичные ограничены только общим лимитом
+    'CRITICAL_SOURCE_RATE': None,
+    'CRITICAL_SOURCE_BURST': None,
+    'MAX_SOURCES': 10000,
+    # Заголовок META с адресом клиента (например, HTTP_X_FORWARDED_FOR за прокси)
+    'SOURCE_HEADER': 'REMOTE_ADDR',
+    # Базовое значение Retry-After (секунды)
+    'RETRY_AFTER': 1,
+}
+
+
+class Ewma:
+    """
+    Экспоненциально взвешенное скользящее среднее.
+
+    Пока замеров меньше 1 / alpha, считается обычным средним, чтобы
+    медленная оценка не зависела от первого замера.
+    """
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.samples = 0
+        self.value = None
+
+    def update(self, sample):
+        self.samples += 1
+        if self.value is None:
+            self.value = sample
+        else:
+            self.value += max(self.alpha, 1 / self.samples) * (sample - self.value)
+        return self.value
+
+
+class TokenBucket:
+    """
+    Токен-бакет одного источника запросов.
+    """
+    def __init__(self, capacity, now):
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, rate, capacity, now):
+        """
+        Пытается забрать один токен.
+
+        Returns:
+            float: 0, если токен получен, иначе время ожидания следующего токена
+        """
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class Decision:
+    """
+    Результат проверки допуска запроса.
+    """
+    def __init__(self, admitted, reason=None, retry_after=0):
+        self.admitted = admitted
+        self.reason = reason  # Причина отказа: 'overload' или 'rate_limit'
+        self.retry_after = retry_after  # Рекомендуемая пауза перед повтором (секунды)
+
+
+class AdmissionController:
+    """
+    Адаптивный контроль допуска запросов.
+
+    Отслеживает число одновременных запросов и суммарное время в БД на
+    один HTTP-запрос. Лимит одновременных запросов растет аддитивно, пока
+    это время близко к базовому (медленное скользящее среднее), и снижается
+    мультипликативно при его росте (AIMD) - не чаще раза за BACKOFF_INTERVAL.
+    Сбрасываемые запросы допускаются только в пределах доли лимита,
+    поэтому при перегрузке отсекаются раньше вебхуков. Токен-бакеты
+    на источник не дают одному клиенту занять всю емкость; критичные
+    запросы по умолчанию ими не ограничиваются, а если задан
+    CRITICAL_SOURCE_RATE - проходят через свои бакеты с постоянной скоростью.
+
+    Состояние хранится в памяти процесса: каждый воркер адаптируется сам.
+    """
+    def __init__(self, config=None, clock=time.monotonic):
+        self.config = {**DEFAULTS, **(config or {})}
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.limit = float(self.config['INITIAL_LIMIT'])
+        self.in_flight = {CRITICAL: 0, SHEDDABLE: 0}
+        # Быстрая оценка текущего времени в БД и медленная оценка базового
+        self.latency = Ewma(alpha=0.2)
+        self.baseline = Ewma(alpha=0.01)
+        self.backed_off_at = None
+        self.buckets = OrderedDict()
+        self.counters = {
+            'admitted': {CRITICAL: 0, SHEDDABLE: 0},
+            'shed_overload': {CRITICAL: 0, SHEDDABLE: 0},
+            'shed_rate_limit': {CRITICAL: 0, SHEDDABLE: 0},
+        }
+
+    def classify(self, url_name):
+        """Возвращает класс запроса по имени URL или None, если он не ограничивается"""
+        return self.config['ROUTES'].get(url_name)
+
+    def source_rate(self):
+        """Скорость пополнения бакетов снижается вместе с лимитом ниже начального"""
+        return self.config['SOURCE_RATE'] * min(1.0, self.limit / self.config['INITIAL_LIMIT'])
+
+    def degraded(self):
+        """Признак деградации БД по текущему времени в БД на запрос"""
+        if self.latency.value is None or self.latency.value < self.config['MIN_DB_LATENCY']:
+            return False
+        if self.latency.value > self.config['MAX_DB_LATENCY']:
+            return True
+        return self.latency.value > self.baseline.value * self.config['LATENCY_TOLERANCE']
+
+    def capacity(self, request_class):
+        """Допустимое число одновременных запросов данного класса"""
+        if request_class == SHEDDABLE:
+            # Сбрасываемые запросы делят долю лимита, при деградации - еще меньше
+            share = self.config['SHEDDABLE_SHARE'] * (0.5 if self.degraded() else 1)
+            return max(1.0, self.limit * share)
+        return self.limit
+
+    def try_acquire(self, request_class, source):
+        """
+        Проверяет, можно ли принять запрос, и резервирует для него слот.
+
+        Args:
+            request_class: CRITICAL или SHEDDABLE
+            source: Идентификатор клиента для токен-бакета
+
+        Returns:
+            Decision: Решение о допуске
+        """
+        now = self.clock()
+        with self.lock:
+            total = sum(self.in_flight.values())
+            used = total if request_class == CRITICAL else self.in_flight[SHEDDABLE]
+            if total >= self.limit or used >= self.capacity(request_class):
+                self.counters['shed_overload'][request_class] += 1
+                overload = (total + 1) / self.limit
+                return Decision(False, 'overload', self._retry_after(overload))
+
+            if request_class == CRITICAL:
+                wait = 0.0
+                if self.config['CRITICAL_SOURCE_RATE'] is not None:
+                    burst = self.config['CRITICAL_SOURCE_BURST'] or self.config['CRITICAL_SOURCE_RATE']
+                    wait = self._bucket((CRITICAL, source), now, burst).take(
+                        self.config['CRITICAL_SOURCE_RATE'], burst, now
+                    )
+            else:
+                wait = self._bucket(source, now, self.config['SOURCE_BURST']).take(
+                    self.source_rate(), self.config['SOURCE_BURST'], now
+                )
+            if wait:
+                self.counters['shed_rate_limit'][request_class] += 1
+                return Decision(False, 'rate_limit', self._retry_after(wait))
+
+            self.in_flight[request_class] += 1
+            self.counters['admitted'][request_class] += 1
+            return Decision(True)
+
+    def release(self, request_class):
+        """Освобождает слот и пересчитывает лимит по последней оценке задержки"""
+        now = self.clock()
+        with self.lock:
+            self.in_flight[request_class] -= 1
+            if self.latency.value is None:
+                return
+            if self.degraded():
+                # Одна деградация - одно снижение, а не по разу на каждый завершенный запрос
+                if self.backed_off_at is None or now - self.backed_off_at >= self.config['BACKOFF_INTERVAL']:
+                    self.limit = max(self.config['MIN_LIMIT'], self.limit * self.config['BACKOFF'])
+                    self.backed_off_at = now
+            elif sum(self.in_flight.values()) + 1 >= self.limit * 0.8:
+                # Лимит растет только когда он действительно используется
+                self.limit = min(self.config['MAX_LIMIT'], self.limit + 1 / self.limit)
+
+    def observe_db_latency(self, seconds):
+        """Учитывает суммарное время в БД одного HTTP-запроса"""
+        with self.lock:
+            self.latency.update(seconds)
+            self.baseline.update(seconds)
+
+    def snapshot(self):
+        """Текущие пороги и счетчики для метрик"""
+        with self.lock:
+            return {
+                'limit': round(self.limit, 2),
+                'sheddable_capacity': round(self.capacity(SHEDDABLE), 2),
+                'in_flight': dict(self.in_flight),
+                'db_latency': self.latency.value,
+                'db_latency_baseline': self.baseline.value,
+                'degraded': self.degraded(),
+                'source_rate': round(self.source_rate(), 2),
+                'sources': len(self.buckets),
+                'counters': {name: dict(values) for name, values in self.counters.items()},
+            }
+
+    def _bucket(self, source, now, capacity):
+        bucket = self.buckets.get(source)
+        if bucket is None:
+            bucket = self.buckets[source] = TokenBucket(capacity, now)
+            # Ограничиваем память: вытесняем давно не обращавшиеся источники
+            if len(self.buckets) > self.config['MAX_SOURCES']:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(source)
+        return bucket
+
+    def _retry_after(self, factor):
+        return max(1, math.ceil(self.config['RETRY_AFTER'] * factor))
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    """Возвращает контроллер допуска процесса, создавая его по настройкам"""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController(getattr(settings, 'ADMISSION_CONTROL', None))
+    return _controller
+
+
+@receiver(setting_changed)
+def reset_controller(setting=None, **kwargs):
+    """Сбрасывает контроллер при изменении настроек (например, в тестах)"""
+    global _controller
+    if setting in (None, 'ADMISSION_CONTROL'):
+        _controller = None
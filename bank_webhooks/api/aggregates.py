@@ -0,0 +1,254 @@
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count, F, Min, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .archive_state import archive_horizon
+from .db import immediate_atomic, retry_on_busy
+from .models import BalanceLog, DailyTurnover
+
+
+def record_turnover(organization_id, day, operation_type, amount, count=1):
+    """
+    Инкрементально обновляет суточный агрегат оборотов (upsert).
+
+    Должна вызываться внутри той же транзакции, что и запись в BalanceLog,
+    чтобы агрегат и история не расходились.
+
+    Args:
+        organization_id: ИНН организации
+        day: Календарный день операции
+        operation_type: Тип операции (BalanceLog.OperationType)
+        amount: Сумма операции (или сумма пачки операций)
+        count: Количество операций (для пакетной загрузки)
+    """
+    lookup = {
+        'organization_id': organization_id,
+        'day': day,
+        'operation_type': operation_type,
+    }
+    increment = {
+        'count': F('count') + count,
+        'amount': F('amount') + amount,
+    }
+
+    # Быстрый путь: строка за день уже есть, атомарно увеличиваем счетчики
+    if DailyTurnover.objects.filter(**lookup).update(**increment):
+        return
+
+    try:
+        # Savepoint нужен, чтобы ошибка уникальности не ломала внешнюю транзакцию
+        with transaction.atomic():
+            DailyTurnover.objects.create(count=count, amount=amount, **lookup)
+    except IntegrityError:
+        # Параллельный запрос успел создать строку - повторяем обновление
+        DailyTurnover.objects.filter(**lookup).update(**increment)
+
+
+def record_balance_log(balance_log):
+    """
+    Учитывает запись BalanceLog в суточных агрегатах.
+
+    Args:
+        balance_log: Сохраненная запись BalanceLog
+    """
+    record_turnover(
+        organization_id=balance_log.organization_id,
+        day=timezone.localdate(balance_log.created_at),
+        operation_type=balance_log.operation_type,
+        amount=balance_log.amount,
+    )
+
+
+def _day_bounds(day):
+    """Возвращает границы дня [начало, начало следующего дня) в текущей таймзоне"""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def _aggregate_days(date_from, date_to):
+    """Собирает агрегаты за дни [date_from, date_to] из BalanceLog (один GROUP BY)"""
+    start, _ = _day_bounds(date_from)
+    _, end = _day_bounds(date_to)
+    rows = (
+        BalanceLog.objects
+        .filter(created_at__gte=start, created_at__lt=end)
+        .annotate(day=TruncDate('created_at'))
+        .values('organization_id', 'day', 'operation_type')
+        .annotate(total_count=Count('id'), total_amount=Sum('amount'))
+        .order_by()
+    )
+    return [
+        DailyTurnover(
+            organization_id=row['organization_id'],
+            day=row['day'],
+            operation_type=row['operation_type'],
+            count=row['total_count'],
+            amount=row['total_amount'],
+        )
+        for row in rows
+    ]
+
+
+def _rebuild_chunk(date_from, date_to):
+    """
+    Пересчитывает агрегаты за отрезок дней [date_from, date_to] из BalanceLog.
+
+    Прошлые дни (до вчерашнего, без него) вебхуки и проводки уже не
+    меняют: их история агрегируется без блокировок, а в короткой
+    транзакции записи строки агрегатов только заменяются. Вчерашний и
+    текущий день (запись, начатая до полуночи, может зафиксироваться после
+    нее) пересчитываются целиком в одной транзакции под блокировкой строк
+    (SELECT ... FOR UPDATE, на SQLite - BEGIN IMMEDIATE): параллельный
+    record_turnover либо успел зафиксироваться до блокировки и попадает
+    в пересчет, либо ждет ее снятия - приращения не теряются, а ждет он
+    не дольше агрегации двух дней.
+
+    Returns:
+        int: Количество созданных строк агрегатов
+    """
+    created = 0
+    hot_from = timezone.localdate() - timedelta(days=1)
+    if date_from < hot_from:
+        cold_to = min(date_to, hot_from - timedelta(days=1))
+        # Чтение без транзакции тоже может упереться в блокировку SQLite - повторяем
+        aggregates = retry_on_busy(_aggregate_days)(date_from, cold_to)
+        created += _replace_days(date_from, cold_to, aggregates)
+    if date_to >= hot_from:
+        created += _rebuild_locked(max(date_from, hot_from), date_to)
+    return created
+
+
+@retry_on_busy
+def _replace_days(date_from, date_to, aggregates):
+    """Заменяет агрегаты за дни [date_from, date_to] готовыми строками"""
+    with immediate_atomic():
+        DailyTurnover.objects.filter(day__gte=date_from, day__lte=date_to).delete()
+        DailyTurnover.objects.bulk_create(aggregates, batch_size=1000)
+    return len(aggregates)
+
+
+@retry_on_busy
+def _rebuild_locked(date_from, date_to):
+    """Пересчитывает агрегаты за дни [date_from, date_to] под блокировкой их строк"""
+    with immediate_atomic():
+        chunk = DailyTurnover.objects.filter(day__gte=date_from, day__lte=date_to)
+        list(chunk.select_for_update().values_list('pk', flat=True))
+        aggregates = _aggregate_days(date_from, date_to)
+        chunk.delete()
+        DailyTurnover.objects.bulk_create(aggregates, batch_size=1000)
+    return len(aggregates)
+
+
+def _rebuild_chunk_in_thread(chunk):
+    """Обертка для пула потоков: каждый поток закрывает свое соединение с БД"""
+    try:
+        return _rebuild_chunk(*chunk)
+    finally:
+        connections.close_all()
+
+
+def rebuild_daily_turnover(date_from=None, date_to=None, chunk_days=31, workers=4):
+    """
+    Пересчитывает суточные агрегаты из истории BalanceLog.
+
+    Период разбивается на непересекающиеся отрезки по chunk_days дней,
+    которые обрабатываются параллельно: каждый отрезок удаляет и заново
+    создает свои строки агрегатов в отдельной транзакции.
+
+    Дни раньше горизонта архива не пересчитываются и не удаляются: их
+    записи BalanceLog могли быть удалены из БД после выгрузки в архив,
+    а агрегаты остаются единственным источником оборотов за эти дни.
+
+    Args:
+        date_from: Первый день пересчета (по умолчанию - самая ранняя запись;
+            не раньше горизонта архива)
+        date_to: Последний день пересчета (по умолчанию - самая поздняя запись)
+        chunk_days: Размер отрезка в днях
+        workers: Количество параллельных потоков
+
+    Returns:
+        int: Количество созданных строк агрегатов
+    """
+    horizon = archive_horizon()
+    # Первый день, история которого целиком в БД (обычно горизонт - полночь
+    # начала месяца; если сменили TIME_ZONE, неполный день тоже пропускается)
+    first_day = None
+    if horizon is not None:
+        first_day = timezone.localdate(horizon)
+        if timezone.localtime(horizon).time() != time.min:
+            first_day += timedelta(days=1)
+    if date_from is not None and first_day is not None:
+        date_from = max(date_from, first_day)
+
+    if date_from is None or date_to is None:
+        logs = BalanceLog.objects.all()
+        if first_day is not None:
+            logs = logs.filter(created_at__gte=horizon)
+        bounds = logs.aggregate(first=Min('created_at'), last=Max('created_at'))
+        stale = DailyTurnover.objects.all()
+        if first_day is not None:
+            stale = stale.filter(day__gte=first_day)
+        if bounds['first'] is None:
+            # Истории в БД нет - достаточно очистить агрегаты (кроме архивных дней)
+            stale.delete()
+            return 0
+        if date_from is None:
+            date_from = timezone.localdate(bounds['first'])
+            # Агрегаты раньше начала истории устарели
+            stale.filter(day__lt=date_from).delete()
+        if date_to is None:
+            date_to = timezone.localdate(bounds['last'])
+            stale.filter(day__gt=date_to).delete()
+
+    chunks = []
+    chunk_start = date_from
+    while chunk_start <= date_to:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), date_to)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end + timedelta(days=1)
+
+    if workers <= 1:
+        return sum(_rebuild_chunk(start, end) for start, end in chunks)
+
+    # Импорт отложен: пул потоков нужен только команде пересчета, не вебхуку
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(_rebuild_chunk_in_thread, chunks))
+
+
+def turnover_totals(organization_id, date_from, date_to, operation_type=None):
+    """
+    Возвращает обороты организации за период по суточным агрегатам.
+
+    Args:
+        organization_id: ИНН организации
+        date_from: Первый день периода (включительно)
+        date_to: Последний день периода (включительно)
+        operation_type: Необязательный фильтр по типу операции
+
+    Returns:
+        dict: Итоги по типам операций и разбивка по дням
+    """
+    queryset = DailyTurnover.objects.filter(
+        organization_id=organization_id,
+        day__gte=date_from,
+        day__lte=date_to,
+    )
+    if operation_type:
+        queryset = queryset.filter(operation_type=operation_type)
+
+    totals = [
+        {'operation_type': row['operation_type'], 'count': row['total_count'], 'amount': row['total_amount']}
+        for row in (
+            queryset
+            .values('operation_type')
+            .annotate(total_count=Sum('count'), total_amount=Sum('amount'))
+            .order_by('operation_type')
+        )
+    ]
+    days = queryset.values('day', 'operation_type', 'count', 'amount').order_by('day', 'operation_type')
+    return {'totals': totals, 'days': list(days)}
@@ -0,0 +1,278 @@
+"""
+Векторизованная аналитика платежей.
+
+Платежи читаются из БД порциями через values_list (без создания
+экземпляров модели) и превращаются в колонки NumPy: сумма - int64 в
+копейках, дата документа - datetime64, ИНН плательщика - int64-код.
+Агрегаты считаются группировками np.bincount / np.unique и
+накапливаются между порциями, поэтому память зависит от размера порции
+и числа плательщиков, но не от числа платежей.
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.db.models import BigIntegerField, F
+from django.db.models.functions import Cast, Round
+from django.utils import timezone
+
+from .models import Payment
+
+# Границы корзин гистограммы по плательщику (в копейках): ряд 1-2-5
+# от 1 рубля до 10 млрд рублей
+HISTOGRAM_EDGES = np.array(
+    [mantissa * 10 ** power for power in range(2, 12) for mantissa in (1, 2, 5)] + [10 ** 12],
+    dtype=np.int64,
+)
+
+# Логарифмические корзины для перцентилей сумм платежей: относительная
+# погрешность перцентиля не больше PERCENTILE_ACCURACY
+PERCENTILE_ACCURACY = 0.01
+_LOG_GAMMA = np.log1p(2 * PERCENTILE_ACCURACY)
+
+PERCENTILES = (50, 90, 95, 99)
+
+# Код ИНН, который не состоит из цифр (например, заведен до проверки формата)
+INVALID_INN = -1
+
+
+def encode_inn(inns):
+    """
+    Кодирует ИНН в int64 без потери ведущих нулей: значение * 100 + длина.
+    ИНН, содержащие не только цифры, получают код INVALID_INN.
+
+    Args:
+        inns: Последовательность строк ИНН
+
+    Returns:
+        np.ndarray: Коды int64
+    """
+    values = np.asarray(inns, dtype='U12')
+    codes = np.full(values.shape, INVALID_INN, dtype=np.int64)
+    # Только ASCII-цифры: после удаления цифр 0-9 строка должна стать пустой
+    # (isdigit пропустил бы и другие цифры Unicode)
+    lengths = np.char.str_len(values)
+    valid = (lengths > 0) & (np.char.str_len(np.char.strip(values, '0123456789')) == 0)
+    codes[valid] = values[valid].astype(np.int64) * 100 + lengths[valid]
+    return codes
+
+
+def decode_inn(code):
+    """Восстанавливает строку ИНН из кода encode_inn (None для INVALID_INN)"""
+    code = int(code)
+    if code == INVALID_INN:
+        return None
+    return str(code // 100).zfill(code % 100)
+
+
+def from_minor_units(amount_minor):
+    """Переводит сумму в копейках в Decimal в рублях с двумя знаками"""
+    return Decimal(int(amount_minor)).scaleb(-2)
+
+
+def _start_of_day(day):
+    """Начало дня в текущей временной зоне (для фильтра по индексу без __date)"""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def iter_payment_columns(chunk_size=50000, date_from=None, date_to=None):
+    """
+    Читает платежи порциями по первичному ключу (keyset pagination).
+
+    Сумма переводится в копейки на стороне БД, поэтому в Python не
+    создаются объекты Decimal. Round нужен для SQLite, где DECIMAL
+    хранится как REAL и 0.29 * 100 = 28.999...
+
+    Args:
+        chunk_size: Размер порции
+        date_from: Первый день периода по дате документа (включительно)
+        date_to: Последний день периода по дате документа (включительно)
+
+    Yields:
+        tuple: (inn_codes int64, amounts int64, dates datetime64[us] в UTC)
+    """
+    queryset = Payment.objects.annotate(
+        amount_minor=Cast(Round(F('amount') * 100), BigIntegerField())
+    ).order_by('pk')
+    if date_from is not None:
+        queryset = queryset.filter(document_date__gte=_start_of_day(date_from))
+    if date_to is not None:
+        queryset = queryset.filter(document_date__lt=_start_of_day(date_to + timedelta(days=1)))
+
+    last_pk = 0
+    while True:
+        rows = list(
+            queryset.filter(pk__gt=last_pk).values_list('pk', 'payer_inn', 'amount_minor', 'document_date')[:chunk_size]
+        )
+        if not rows:
+            return
+        last_pk = rows[-1][0]
+        _, inns, amounts, dates = zip(*rows)
+        del rows
+        # datetime64 не хранит зону: берем время UTC в микросекундах от эпохи
+        timestamps = np.fromiter((value.timestamp() for value in dates), dtype=np.float64, count=len(dates))
+        yield (
+            encode_inn(inns),
+            np.fromiter(amounts, dtype=np.int64, count=len(amounts)),
+            np.round(timestamps * 1_000_000).astype(np.int64).astype('datetime64[us]'),
+        )
+
+
+class PaymentAnalytics:
+    """
+    Накопитель агрегатов по порциям колонок платежей.
+    """
+    def __init__(self):
+        self.payments = 0
+        self.total = 0
+        # Плательщики: код ИНН -> индекс в массивах агрегатов
+        self.payer_index = {}
+        self.payer_codes = np.zeros(0, dtype=np.int64)
+        self.payer_counts = np.zeros(0, dtype=np.int64)
+        self.payer_sums = np.zeros(0, dtype=np.int64)
+        self.payer_histograms = np.zeros((0, len(HISTOGRAM_EDGES) + 1), dtype=np.int64)
+        # Логарифмическая гистограмма сумм для перцентилей
+        self.amount_bins = np.zeros(0, dtype=np.int64)
+        # Помесячный оборот: месяц (datetime64[M] как int) -> количество и сумма
+        self.months = {}
+
+    def add(self, inn_codes, amounts, dates):
+        """Учитывает порцию колонок"""
+        if not len(amounts):
+            return
+        self.payments += len(amounts)
+        self.total += int(amounts.sum())
+
+        # Группировка по плательщику: индексы в глобальных массивах
+        chunk_codes, inverse = np.unique(inn_codes, return_inverse=True)
+        payer_rows = self._payer_rows(chunk_codes)[inverse]
+        size = len(self.payer_codes)
+        self.payer_counts += np.bincount(payer_rows, minlength=size)
+        # np.add.at, а не bincount(weights=...): суммы остаются точными в int64
+        np.add.at(self.payer_sums, payer_rows, amounts)
+        buckets = np.searchsorted(HISTOGRAM_EDGES, amounts, side='right')
+        np.add.at(self.payer_histograms, (payer_rows, buckets), 1)
+
+        # Логарифмические корзины сумм (суммы платежей всегда положительны)
+        log_bins = np.ceil(np.log(np.maximum(amounts, 1)) / _LOG_GAMMA).astype(np.int64)
+        counts = np.bincount(log_bins)
+        if len(counts) > len(self.amount_bins):
+            self.amount_bins = np.pad(self.amount_bins, (0, len(counts) - len(self.amount_bins)))
+        self.amount_bins[:len(counts)] += counts
+
+        # Помесячная группировка по datetime64
+        months, month_inverse = np.unique(dates.astype('datetime64[M]'), return_inverse=True)
+        month_counts = np.bincount(month_inverse)
+        month_sums = np.zeros(len(months), dtype=np.int64)
+        np.add.at(month_sums, month_inverse, amounts)
+        for month, count, amount in zip(months.astype(np.int64), month_counts, month_sums):
+            stats = self.months.setdefault(int(month), [0, 0])
+            stats[0] += int(count)
+            stats[1] += int(amount)
+
+    def _payer_rows(self, codes):
+        """Возвращает индексы плательщиков, расширяя массивы для новых"""
+        rows = np.empty(len(codes), dtype=np.int64)
+        new_codes = []
+        for position, code in enumerate(codes.tolist()):
+            row = self.payer_index.get(code)
+            if row is None:
+                row = self.payer_index[code] = len(self.payer_index)
+                new_codes.append(code)
+            rows[position] = row
+        if new_codes:
+            grow = len(new_codes)
+            self.payer_codes = np.concatenate([self.payer_codes, np.array(new_codes, dtype=np.int64)])
+            self.payer_counts = np.pad(self.payer_counts, (0, grow))
+            self.payer_sums = np.pad(self.payer_sums, (0, grow))
+            self.payer_histograms = np.pad(self.payer_histograms, ((0, grow), (0, 0)))
+        return rows
+
+    def amount_percentiles(self):
+        """Перцентили сумм платежей по логарифмическим корзинам"""
+        if not self.payments:
+            return {}
+        cumulative = np.cumsum(self.amount_bins)
+        result = {}
+        for percentile in PERCENTILES:
+            rank = np.ceil(self.payments * percentile / 100)
+            index = int(np.searchsorted(cumulative, rank))
+            # Середина корзины (gamma^(i-1), gamma^i] в копейках
+            value = 2 * np.exp(index * _LOG_GAMMA) / (1 + np.exp(_LOG_GAMMA))
+            result[f"p{percentile}"] = from_minor_units(round(value))
+        return result
+
+    def result(self, top=20):
+        """
+        Итоговые агрегаты.
+
+        Args:
+            top: Сколько крупнейших плательщиков вернуть с гистограммами
+
+        Returns:
+            dict: Итоги, перцентили, концентрация плательщиков и помесячный оборот
+        """
+        payers = len(self.payer_codes)
+        concentration = {'payers': payers, 'hhi': 0.0, 'top_10_share': 0.0}
+        payer_percentiles = {}
+        top_payers = []
+        if payers and self.total:
+            shares = self.payer_sums / self.total
+            order = np.argsort(self.payer_sums)[::-1]
+            concentration.update({
+                # Индекс Херфиндаля-Хиршмана: сумма квадратов долей
+                'hhi': float(np.square(shares).sum()),
+                'top_10_share': float(shares[order[:10]].sum()),
+            })
+            payer_percentiles = {
+                f"p{percentile}": from_minor_units(round(value))
+                for percentile, value in zip(PERCENTILES, np.percentile(self.payer_sums, PERCENTILES))
+            }
+            top_payers = [
+                {
+                    'inn': decode_inn(self.payer_codes[row]),
+                    'count': int(self.payer_counts[row]),
+                    'amount': from_minor_units(self.payer_sums[row]),
+                    'share': float(shares[row]),
+                    'histogram': self.payer_histograms[row].tolist(),
+                }
+                for row in order[:top]
+            ]
+
+        return {
+            'payments': self.payments,
+            'total': from_minor_units(self.total),
+            'amount_percentiles': self.amount_percentiles(),
+            'payer_turnover_percentiles': payer_percentiles,
+            'concentration': concentration,
+            # Границы корзин гистограмм плательщиков (в рублях); корзина i - [edges[i-1], edges[i])
+            'histogram_edges': [from_minor_units(edge) for edge in HISTOGRAM_EDGES],
+            'top_payers': top_payers,
+            'monthly': [
+                {
+                    'month': str(np.datetime64(month, 'M')),
+                    'count': count,
+                    'amount': from_minor_units(amount),
+                }
+                for month, (count, amount) in sorted(self.months.items())
+            ],
+        }
+
+
+def payment_analytics(date_from=None, date_to=None, chunk_size=50000, top=20):
+    """
+    Считает аналитику по всей таблице платежей (или за период).
+
+    Args:
+        date_from: Первый день периода по дате документа (включительно)
+        date_to: Последний день периода по дате документа (включительно)
+        chunk_size: Размер порции чтения из БД
+        top: Сколько крупнейших плательщиков вернуть
+
+    Returns:
+        dict: См. PaymentAnalytics.result
+    """
+    analytics = PaymentAnalytics()
+    for columns in iter_payment_columns(chunk_size, date_from, date_to):
+        analytics.add(*columns)
+    return analytics.result(top=top)
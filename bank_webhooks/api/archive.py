@@ -0,0 +1,804 @@
+"""
+Колоночный архив холодной истории платежей и изменений баланса.
+
+Старые строки Payment и BalanceLog выгружаются помесячными сегментами
+(по created_at) в каталог ARCHIVE_DIR:
+
+    archive.json                        - горизонт архива: все строки
+                                          с created_at раньше него лежат в архиве
+    payments/2023-01/segment.json       - манифест: число строк, колонки,
+                                          типы, длины и CRC32 файлов
+    payments/2023-01/amount.bin         - колонка фиксированной ширины
+    payments/2023-01/document_number.offsets.bin + .heap.bin
+                                        - строковая колонка: смещения и байты UTF-8
+    payments/2023-01/operation_id.index.bin + .rows.bin
+                                        - отсортированные operation_id и номера строк
+    payments/2023-01/inn.codes.bin + inn.offsets.bin
+                                        - индекс ИНН: строки одного ИНН идут подряд
+    balance_logs/2023-01/...
+
+Строки сегмента отсортированы по (ИНН, created_at, id), поэтому история
+организации - непрерывный срез колонок. Колонки читаются через np.memmap:
+срезы - это представления отображенных в память файлов без копирования,
+а страницы подгружаются ОС только при обращении.
+"""
+import json
+import os
+import shutil
+import threading
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from functools import cached_property
+
+import numpy as np
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import Sum
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .archive_state import HorizonFile
+from .analytics import INVALID_INN, decode_inn, encode_inn, from_minor_units
+from .models import ArchivedKey, BalanceLog, Organization, Payment
+
+FORMAT_VERSION = 1
+
+PAYMENTS = 'payments'
+BALANCE_LOGS = 'balance_logs'
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# Типы колонок фиксированной ширины: dtype на диске
+FIXED_DTYPES = {
+    'int': '<i8',
+    'nullable_int': '<i8',  # NULL хранится как -1
+    'uuid': 'S16',
+    'money': '<i8',  # Копейки
+    'inn': '<i8',  # Код ИНН из analytics.encode_inn
+    'datetime': '<i8',  # Микросекунды от эпохи в UTC
+    'choice': '|u1',  # Номер значения в списке choices из манифеста
+}
+
+# Строковые типы хранятся как смещения (<i8) и куча байтов UTF-8
+TEXT_KINDS = ('text', 'nullable_text', 'json')
+
+# Схема таблиц: модель, колонки (поле, тип), поле ИНН, выбор значений
+TABLES = {
+    PAYMENTS: {
+        'model': Payment,
+        'columns': (
+            ('id', 'int'),
+            ('operation_id', 'uuid'),
+            ('amount', 'money'),
+            ('payer_inn', 'inn'),
+            ('document_number', 'text'),
+            ('document_date', 'datetime'),
+            ('created_at', 'datetime'),
+        ),
+        'inn': 'payer_inn',
+    },
+    BALANCE_LOGS: {
+        'model': BalanceLog,
+        'columns': (
+            ('id', 'int'),
+            ('organization_id', 'inn'),
+            ('amount', 'money'),
+            ('operation_type', 'choice'),
+            ('payment_id', 'nullable_int'),
+            ('created_at', 'datetime'),
+            # Пустых ключей идемпотентности не бывает (PostingSerializer), поэтому '' - это NULL
+            ('idempotency_key', 'nullable_text'),
+            ('metadata', 'json'),
+        ),
+        'inn': 'organization_id',
+        'choices': {'operation_type': list(BalanceLog.OperationType.values)},
+    },
+}
+
+
+class ArchiveError(Exception):
+    """Ошибка записи или чтения архива"""
+
+
+def to_microseconds(value):
+    """Переводит datetime с зоной в микросекунды от эпохи (точно, без float)"""
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_microseconds(value):
+    """Восстанавливает datetime в UTC из микросекунд от эпохи"""
+    return EPOCH + timedelta(microseconds=int(value))
+
+
+def month_start(day):
+    """Начало месяца в текущей временной зоне"""
+    return timezone.make_aware(datetime(day.year, day.month, 1))
+
+
+def next_month(moment):
+    """Начало следующего месяца"""
+    return month_start((moment.replace(day=28) + timedelta(days=4)).date())
+
+
+def _encode_fixed(kind, values, choices=None):
+    """Кодирует значения поля в массив фиксированной ширины"""
+    if kind == 'inn':
+        codes = encode_inn(values) if values else np.zeros(0, dtype=np.int64)
+        if (codes == INVALID_INN).any():
+            # Код INVALID_INN не восстанавливается в строку - такие строки потерялись бы
+            invalid = sorted({value for value, code in zip(values, codes.tolist()) if code == INVALID_INN})
+            raise ArchiveError(f"Cannot archive non-digit INN: {', '.join(invalid)}")
+        return codes
+    if kind == 'uuid':
+        values = [value.bytes for value in values]
+    elif kind == 'money':
+        values = [int(value.scaleb(2)) for value in values]
+    elif kind == 'datetime':
+        values = [to_microseconds(value) for value in values]
+    elif kind == 'nullable_int':
+        values = [-1 if value is None else value for value in values]
+    elif kind == 'choice':
+        values = [choices.index(value) for value in values]
+    return np.array(values, dtype=FIXED_DTYPES[kind])
+
+
+def _decode_fixed(kind, value, choices=None):
+    """Восстанавливает значение поля из элемента колонки"""
+    if kind == 'inn':
+        return decode_inn(value)
+    if kind == 'uuid':
+        # numpy отбрасывает нулевые байты в конце S16 - дополняем обратно
+        return uuid.UUID(bytes=bytes(value).ljust(16, b'\0'))
+    if kind == 'money':
+        return from_minor_units(value)
+    if kind == 'datetime':
+        return from_microseconds(value)
+    if kind == 'nullable_int':
+        return None if value < 0 else int(value)
+    if kind == 'choice':
+        return choices[int(value)]
+    return int(value)
+
+
+def _encode_text(kind, values):
+    """
+    Кодирует строки в смещения и кучу байтов UTF-8.
+
+    Returns:
+        tuple: (offsets int64 длиной n + 1, heap uint8)
+    """
+    if kind == 'json':
+        values = [json.dumps(value, ensure_ascii=False, sort_keys=True) for value in values]
+    elif kind == 'nullable_text':
+        values = ['' if value is None else value for value in values]
+    encoded = [value.encode() for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def _decode_text(kind, raw):
+    """Восстанавливает строковое значение из байтов кучи"""
+    value = raw.decode()
+    if kind == 'json':
+        return json.loads(value)
+    if kind == 'nullable_text' and not value:
+        return None
+    return value
+
+
+class Segment:
+    """
+    Месячный сегмент таблицы, открытый для чтения через np.memmap.
+    Файлы отображаются в память лениво - при первом обращении к колонке.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'segment.json')) as manifest_file:
+            self.manifest = json.load(manifest_file)
+        if self.manifest['format'] != FORMAT_VERSION:
+            raise ArchiveError(f"Unsupported archive format {self.manifest['format']} in {path}")
+        self.table = self.manifest['table']
+        self.rows = self.manifest['rows']
+        self.start = datetime.fromisoformat(self.manifest['start'])
+        self.end = datetime.fromisoformat(self.manifest['end'])
+        self.kinds = dict(self.manifest['columns'])
+        self._arrays = {}
+        self._lock = threading.Lock()
+
+    def array(self, name):
+        """
+        Массив файла сегмента (без копирования, только для чтения).
+
+        Args:
+            name: Имя файла без .bin, например 'amount' или 'inn.codes'
+        """
+        array = self._arrays.get(name)
+        if array is None:
+            with self._lock:
+                array = self._arrays.get(name)
+                if array is None:
+                    info = self.manifest['files'][name]
+                    if info['length']:
+                        # Обычное представление ndarray над отображенным буфером:
+                        # срезы np.memmap заметно дороже из-за __array_finalize__
+                        array = np.memmap(os.path.join(self.path, f"{name}.bin"),
+                                          dtype=info['dtype'], mode='r', shape=(info['length'],)).view(np.ndarray)
+                    else:
+                        # Пустой файл нельзя отобразить в память
+                        array = np.zeros(0, dtype=info['dtype'])
+                    self._arrays[name] = array
+        return array
+
+    def inn_rows(self, inn):
+        """
+        Диапазон строк организации (бинарный поиск по индексу ИНН).
+
+        Returns:
+            slice: Срез строк (пустой, если ИНН нет в сегменте)
+        """
+        if not inn.isdigit():
+            return slice(0, 0)
+        return self.code_rows(encode_inn([inn])[0])
+
+    def code_rows(self, code):
+        """Диапазон строк по коду ИНН (см. inn_rows)"""
+        codes = self.array('inn.codes')
+        index = int(np.searchsorted(codes, code))
+        if index == len(codes) or codes[index] != code:
+            return slice(0, 0)
+        offsets = self.array('inn.offsets')
+        return slice(int(offsets[index]), int(offsets[index + 1]))
+
+    def find_operation(self, operation_id):
+        """
+        Номер строки платежа по operation_id (бинарный поиск по индексу).
+
+        Returns:
+            int: Номер строки или None
+        """
+        keys = self.array('operation_id.index')
+        key = np.array(operation_id.bytes, dtype='S16')
+        index = int(np.searchsorted(keys, key))
+        if index == len(keys) or keys[index] != key:
+            return None
+        return int(self.array('operation_id.rows')[index])
+
+    @cached_property
+    def signs(self):
+        """Знак суммы по номеру типа операции: -1 для списаний, +1 для остальных"""
+        choices = self.manifest['choices']['operation_type']
+        return np.array([-1 if choice == BalanceLog.OperationType.WITHDRAWAL else 1 for choice in choices],
+                        dtype=np.int64)
+
+    def value(self, name, position):
+        """Значение поля в строке сегмента"""
+        kind = self.kinds[name]
+        if kind in TEXT_KINDS:
+            offsets = self.array(f"{name}.offsets")
+            heap = self.array(f"{name}.heap")
+            return _decode_text(kind, heap[offsets[position]:offsets[position + 1]].tobytes())
+        choices = self.manifest.get('choices', {}).get(name)
+        return _decode_fixed(kind, self.array(name)[position], choices)
+
+    def row(self, position):
+        """Строка сегмента в виде dict с именами полей модели"""
+        return {name: self.value(name, position) for name in self.kinds}
+
+    def checksum_errors(self):
+        """Проверяет длины и CRC32 файлов сегмента"""
+        errors = []
+        for name, info in self.manifest['files'].items():
+            array = self.array(name)
+            if len(array) != info['length']:
+                errors.append(f"{self.path}: {name} has {len(array)} items, expected {info['length']}")
+            # zlib читает отображенный буфер напрямую, без копии в памяти процесса
+            elif zlib.crc32(array) != info['crc32']:
+                errors.append(f"{self.path}: {name} checksum mismatch")
+        return errors
+
+
+class Archive:
+    """
+    Архив в каталоге ARCHIVE_DIR.
+
+    Список сегментов и горизонт кэшируются и перечитываются, только когда
+    меняется время изменения каталога таблицы или archive.json, поэтому
+    сегменты, выгруженные командой в другом процессе, подхватываются без
+    перезапуска воркеров.
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        self._horizon = HorizonFile(self.path)
+        self._segments = {}  # Таблица -> (mtime каталога, список сегментов)
+
+    def _mtime(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    @property
+    def horizon(self):
+        """Граница архива: строки с created_at раньше нее читаются из архива (None - архива нет)"""
+        return self._horizon.get()
+
+    def set_horizon(self, horizon):
+        """Атомарно сдвигает горизонт архива"""
+        os.makedirs(self.path, exist_ok=True)
+        path = self._horizon.path
+        with open(f"{path}.tmp", 'w') as state_file:
+            json.dump({'format': FORMAT_VERSION, 'horizon': horizon.isoformat()}, state_file)
+        os.replace(f"{path}.tmp", path)
+
+    def segments(self, table):
+        """Сегменты таблицы в порядке месяцев"""
+        directory = os.path.join(self.path, table)
+        mtime = self._mtime(directory)
+        cached = self._segments.get(table)
+        if cached is None or cached[0] != mtime:
+            segments = []
+            if mtime is not None:
+                for name in sorted(os.listdir(directory)):
+                    # Каталоги .tmp - недописанные сегменты прерванной выгрузки
+                    if not name.endswith('.tmp') and os.path.exists(os.path.join(directory, name, 'segment.json')):
+                        segments.append(Segment(os.path.join(directory, name)))
+            cached = self._segments[table] = (mtime, segments)
+        return cached[1]
+
+    def contains_payment(self, operation_id):
+        """Есть ли платеж с таким operation_id в архиве"""
+        return any(segment.find_operation(operation_id) is not None
+                   for segment in self.segments(PAYMENTS))
+
+    def _log_positions(self, segment, code, after=None, until=None):
+        """
+        Строки истории организации в сегменте с created_at в (after, until).
+
+        Returns:
+            slice или np.ndarray: Срез, если подходит весь диапазон организации
+                (индексация срезом не копирует данные), иначе номера строк
+        """
+        rows = segment.code_rows(code)
+        after = None if after is None or after < segment.start else to_microseconds(after)
+        until = None if until is None or until >= segment.end else to_microseconds(until)
+        if after is None and until is None:
+            return rows
+        created_at = segment.array('created_at')[rows]  # Представление без копирования
+        mask = np.ones(len(created_at), dtype=bool)
+        if after is not None:
+            mask &= created_at > after
+        if until is not None:
+            mask &= created_at < until
+        return rows.start + np.flatnonzero(mask)
+
+    @staticmethod
+    def _inn_code(inn):
+        return encode_inn([inn])[0] if inn.isdigit() else None
+
+    def balance_logs(self, inn, after=None, until=None, limit=None):
+        """
+        Архивная история изменений баланса организации.
+
+        Args:
+            inn: ИНН организации
+            after: Только записи позже этого момента
+            until: Только записи раньше этого момента
+            limit: Максимальное число записей
+
+        Returns:
+            list: dict-ы в формате полей BalanceLog по возрастанию created_at
+        """
+        result = []
+        code = self._inn_code(inn)
+        if code is None:
+            return result
+        for segment in self.segments(BALANCE_LOGS):
+            if (after is not None and segment.end <= after) or (until is not None and segment.start >= until):
+                continue
+            positions = self._log_positions(segment, code, after, until)
+            if isinstance(positions, slice):
+                positions = range(positions.start, positions.stop)
+            for position in positions:
+                if limit is not None and len(result) >= limit:
+                    return result
+                result.append(segment.row(int(position)))
+        return result
+
+    def balance_delta(self, inn, after):
+        """
+        Сумма архивных изменений баланса организации позже момента after.
+
+        Считается векторно по срезам колонок без декодирования строк.
+
+        Returns:
+            Decimal: Сумма со знаком (списания уменьшают баланс)
+        """
+        total = 0
+        code = self._inn_code(inn)
+        if code is None:
+            return from_minor_units(total)
+        for segment in self.segments(BALANCE_LOGS):
+            if segment.end <= after:
+                continue
+            positions = self._log_positions(segment, code, after=after)
+            amounts = segment.array('amount')[positions]
+            signs = segment.signs[segment.array('operation_type')[positions]]
+            total += int(np.dot(amounts, signs))
+        return from_minor_units(total)
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    """Архив процесса (создается при первом обращении)"""
+    global _archive
+    if _archive is None:
+        with _archive_lock:
+            if _archive is None:
+                _archive = Archive(settings.ARCHIVE_DIR)
+    return _archive
+
+
+@receiver(setting_changed)
+def reset_archive(setting=None, **kwargs):
+    """Сбрасывает архив при изменении ARCHIVE_DIR (например, в тестах)"""
+    global _archive
+    if setting == 'ARCHIVE_DIR':
+        _archive = None
+
+
+def balance_as_of(inn, moment):
+    """
+    Баланс организации на момент moment.
+
+    Текущий баланс минус все изменения позже moment: из горячей таблицы
+    BalanceLog (created_at не раньше горизонта архива) и из архивных
+    сегментов (раньше горизонта). Правки баланса в админке без записи в
+    истории учитываются как уже бывшие на момент moment.
+
+    Баланс и изменения читаются разными запросами: чтобы они были
+    согласованы, вызывайте функцию внутри transaction.atomic().
+
+    Returns:
+        Decimal: Баланс или None, если организации нет
+    """
+    balance = Organization.objects.filter(inn=inn).values_list('balance', flat=True).first()
+    if balance is None:
+        return None
+
+    horizon = get_archive().horizon
+    hot = BalanceLog.objects.filter(organization_id=inn, created_at__gt=moment)
+    if horizon is not None:
+        hot = hot.filter(created_at__gte=horizon)
+    # Суммы по типам операций; знак - в Python (выражение Case заметно дороже компилировать)
+    totals = hot.order_by().values_list('operation_type').annotate(total=Sum('amount'))
+    later = sum(
+        (-total if operation_type == BalanceLog.OperationType.WITHDRAWAL else total
+         for operation_type, total in totals),
+        Decimal('0.00'),
+    )
+
+    if horizon is not None and moment < horizon:
+        later += get_archive().balance_delta(inn, moment)
+    return balance - later
+
+
+HISTORY_FIELDS = ('id', 'organization_id', 'amount', 'operation_type', 'payment_id',
+                  'created_at', 'idempotency_key', 'metadata')
+
+
+def balance_history(inn, start, end, limit):
+    """
+    История изменений баланса организации за период [start, end).
+
+    Записи раньше горизонта архива читаются из сегментов, остальные - из БД.
+
+    Returns:
+        tuple: (список записей по возрастанию created_at, признак обрезки по limit)
+    """
+    horizon = get_archive().horizon
+    entries = []
+    if horizon is not None and start < horizon:
+        # Берем на одну запись больше, чтобы понять, обрезана ли история
+        entries = get_archive().balance_logs(inn, after=start - timedelta(microseconds=1),
+                                             until=min(end, horizon), limit=limit + 1)
+        for entry in entries:
+            entry['archived'] = True
+
+    if len(entries) <= limit and (horizon is None or end > horizon):
+        hot = BalanceLog.objects.filter(organization_id=inn, created_at__gte=start, created_at__lt=end)
+        if horizon is not None:
+            hot = hot.filter(created_at__gte=horizon)
+        for entry in hot.order_by('created_at', 'id').values(*HISTORY_FIELDS)[:limit + 1 - len(entries)]:
+            entry['archived'] = False
+            entries.append(entry)
+
+    return entries[:limit], len(entries) > limit
+
+
+def _iter_rows(queryset, fields, chunk_size):
+    """Читает строки порциями по первичному ключу (keyset pagination)"""
+    last_pk = None
+    queryset = queryset.order_by('pk')
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(chunk.values_list(*fields)[:chunk_size])
+        if not rows:
+            return
+        last_pk = rows[-1][0]
+        yield from rows
+
+
+def _month_queryset(table, start, end):
+    return TABLES[table]['model'].objects.filter(created_at__gte=start, created_at__lt=end)
+
+
+def write_segment(table, start, end, directory, chunk_size=10000):
+    """
+    Выгружает строки таблицы с created_at в [start, end) в сегмент.
+
+    Сегмент пишется во временный каталог и переименовывается целиком,
+    поэтому читатели никогда не видят его частично записанным.
+
+    Returns:
+        int: Число выгруженных строк (0 - сегмент не создан)
+    """
+    schema = TABLES[table]
+    columns = schema['columns']
+    fields = [name for name, _ in columns]
+    choices = schema.get('choices', {})
+
+    values = {name: [] for name in fields}
+    for row in _iter_rows(_month_queryset(table, start, end), fields, chunk_size):
+        for name, value in zip(fields, row):
+            values[name].append(value)
+    rows = len(values['id'])
+    if not rows:
+        return 0
+
+    fixed = {
+        name: _encode_fixed(kind, values[name], choices.get(name))
+        for name, kind in columns if kind not in TEXT_KINDS
+    }
+    # Строки одного ИНН подряд и по времени: история организации - один срез
+    order = np.lexsort((fixed['id'], fixed['created_at'], fixed[schema['inn']]))
+
+    files = {}
+    for name, kind in columns:
+        if kind in TEXT_KINDS:
+            offsets, heap = _encode_text(kind, [values[name][position] for position in order])
+            files[f"{name}.offsets"] = offsets
+            files[f"{name}.heap"] = heap
+        else:
+            files[name] = fixed[name][order]
+
+    # Индекс ИНН: уникальные коды и смещения их первых строк
+    codes, first_rows = np.unique(files[schema['inn']], return_index=True)
+    files['inn.codes'] = codes
+    files['inn.offsets'] = np.append(first_rows, rows).astype(np.int64)
+    if table == PAYMENTS:
+        # Отсортированные operation_id и номера их строк для бинарного поиска
+        operation_order = np.argsort(files['operation_id'], kind='stable')
+        files['operation_id.index'] = files['operation_id'][operation_order]
+        files['operation_id.rows'] = operation_order.astype(np.int64)
+
+    target = os.path.join(directory, table, start.strftime('%Y-%m'))
+    if os.path.exists(target):
+        raise ArchiveError(f"Segment {target} already exists")
+    temporary = f"{target}.tmp"
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+
+    manifest = {
+        'format': FORMAT_VERSION,
+        'table': table,
+        'rows': rows,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'columns': [list(column) for column in columns],
+        'choices': choices,
+        'files': {},
+    }
+    for name, array in files.items():
+        array = np.ascontiguousarray(array)
+        array.tofile(os.path.join(temporary, f"{name}.bin"))
+        manifest['files'][name] = {
+            'dtype': array.dtype.str,
+            'length': len(array),
+            'crc32': zlib.crc32(array),
+        }
+    with open(os.path.join(temporary, 'segment.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(temporary, target)
+    return rows
+
+
+def verify_segment(segment, chunk_size=10000):
+    """
+    Проверяет целостность сегмента и сверяет его с БД.
+
+    Проверяются CRC32 файлов, согласованность индексов и то, что каждая
+    строка, еще оставшаяся в БД, после декодирования из сегмента совпадает
+    с ней поле в поле. Строки, удаленные из БД после архивации, сверяются
+    только по контрольным суммам.
+
+    Returns:
+        tuple: (список ошибок, число сверенных с БД строк)
+    """
+    errors = segment.checksum_errors()
+    if errors:
+        return errors, 0
+
+    schema = TABLES[segment.table]
+    inn_codes = segment.array(schema['inn'])
+    offsets = segment.array('inn.offsets')
+    if (len(offsets) != len(segment.array('inn.codes')) + 1 or offsets[-1] != segment.rows
+            or not np.array_equal(np.repeat(segment.array('inn.codes'), np.diff(offsets)), inn_codes)):
+        errors.append(f"{segment.path}: INN index does not match rows")
+    if segment.table == PAYMENTS:
+        index = segment.array('operation_id.index')
+        if (np.any(index[1:] <= index[:-1])
+                or not np.array_equal(segment.array('operation_id')[segment.array('operation_id.rows')], index)):
+            errors.append(f"{segment.path}: operation_id index is not sorted or does not match rows")
+
+    ids = segment.array('id')
+    id_order = np.argsort(ids)
+    fields = [name for name, _ in schema['columns']]
+    checked = 0
+    for row in _iter_rows(_month_queryset(segment.table, segment.start, segment.end), fields, chunk_size):
+        expected = dict(zip(fields, row))
+        found = int(np.searchsorted(ids, expected['id'], sorter=id_order))
+        if found == len(ids) or ids[id_order[found]] != expected['id']:
+            errors.append(f"{segment.path}: row id={expected['id']} is missing from the segment")
+            continue
+        if segment.row(int(id_order[found])) != expected:
+            errors.append(f"{segment.path}: row id={expected['id']} differs from the database")
+        checked += 1
+    return errors, checked
+
+
+def _segment_errors(path, chunk_size=10000, complete=False):
+    """
+    Проверяет сегмент по пути (см. verify_segment), не падая на поврежденных файлах.
+
+    Args:
+        path: Каталог сегмента
+        complete: Строки месяца еще не удалялись из БД - число сверенных
+            строк должно совпасть с числом строк сегмента
+
+    Returns:
+        list: Ошибки (пустой список, если сегмент цел и совпадает с БД)
+    """
+    if not os.path.exists(os.path.join(path, 'segment.json')):
+        return [f"{path}: segment is missing"]
+    try:
+        segment = Segment(path)
+        errors, checked = verify_segment(segment, chunk_size)
+    except (ArchiveError, OSError, ValueError, KeyError) as error:
+        # Битый манифест или файл короче заявленного: memmap не открывается
+        return [f"{path}: {error}"]
+    if not errors and complete and checked != segment.rows:
+        errors.append(f"{path}: {segment.rows} rows in the segment, {checked} in the database")
+    return errors
+
+
+def archive_history(before, directory=None, chunk_size=10000):
+    """
+    Выгружает в архив все полные месяцы раньше before и сдвигает горизонт.
+
+    Сегменты месяцев после текущего горизонта, оставшиеся от прерванного
+    запуска, не пропускаются вслепую: они сверяются с БД (контрольные
+    суммы, строки и их число), и не прошедшие проверку переписываются
+    заново. Горизонт сдвигается только после того, как все сегменты до
+    before сверены с БД.
+
+    Args:
+        before: Начало первого месяца, который остается в БД
+        directory: Каталог архива (по умолчанию ARCHIVE_DIR)
+
+    Returns:
+        dict: Таблица -> число выгруженных строк
+    """
+    archive = Archive(directory) if directory else get_archive()
+    horizon = archive.horizon
+    exported = {table: 0 for table in TABLES}
+    if horizon is not None and before <= horizon:
+        return exported
+
+    months = set()
+    for table, schema in TABLES.items():
+        queryset = schema['model'].objects.filter(created_at__lt=before)
+        if horizon is not None:
+            queryset = queryset.filter(created_at__gte=horizon)
+        months.update(queryset.dates('created_at', 'month'))
+
+    written = []
+    for month in sorted(months):
+        start = month_start(month)
+        end = next_month(start)
+        for table in TABLES:
+            path = os.path.join(archive.path, table, month.strftime('%Y-%m'))
+            if os.path.exists(path):
+                # Месяц после горизонта еще целиком в БД - сегмент должен совпасть с ней
+                if not _segment_errors(path, chunk_size, complete=True):
+                    continue
+                shutil.rmtree(path)
+            rows = write_segment(table, start, end, archive.path, chunk_size)
+            if rows:
+                exported[table] += rows
+                written.append(path)
+
+    for path in written:
+        errors = _segment_errors(path, chunk_size, complete=True)
+        if errors:
+            raise ArchiveError("; ".join(errors))
+    archive.set_horizon(before)
+    return exported
+
+
+def _archived_key(table, pk, key):
+    """Поля ArchivedKey для удаляемой строки таблицы"""
+    if table == PAYMENTS:
+        return {'kind': ArchivedKey.Kind.OPERATION_ID, 'key': str(key)}
+    return {'kind': ArchivedKey.Kind.IDEMPOTENCY_KEY, 'key': key, 'balance_log_id': pk}
+
+
+def prune_archived(directory=None, batch_size=1000, chunk_size=10000):
+    """
+    Удаляет из БД строки, выгруженные в архив (раньше горизонта).
+
+    Перед удалением строк месяца его сегмент еще раз сверяется с БД:
+    месяц, сегмент которого отсутствует, поврежден или не содержит всех
+    строк, не удаляется, а после обработки остальных месяцев поднимается
+    ArchiveError.
+
+    Платежи, на которые еще ссылаются записи истории в БД (запись попала
+    в следующий месяц), остаются, чтобы не потерять связь. Ключи
+    дедупликации удаляемых строк (operation_id платежа, ключ
+    идемпотентности проводки) сохраняются в ArchivedKey в той же
+    транзакции, что и удаление: повтор вебхука или проводки остается
+    дублем без чтения архива.
+
+    Returns:
+        dict: Таблица -> число удаленных строк
+    """
+    archive = Archive(directory) if directory else get_archive()
+    horizon = archive.horizon
+    deleted = {table: 0 for table in TABLES}
+    if horizon is None:
+        return deleted
+
+    querysets = {
+        BALANCE_LOGS: BalanceLog.objects.filter(created_at__lt=horizon),
+        PAYMENTS: Payment.objects.filter(created_at__lt=horizon, balance_logs__isnull=True),
+    }
+    key_fields = {BALANCE_LOGS: 'idempotency_key', PAYMENTS: 'operation_id'}
+    failed = []
+    for table, queryset in querysets.items():
+        for month in queryset.dates('created_at', 'month'):
+            start = month_start(month)
+            errors = _segment_errors(os.path.join(archive.path, table, month.strftime('%Y-%m')), chunk_size)
+            if errors:
+                failed.extend(errors)
+                continue
+            month_rows = queryset.filter(created_at__gte=start, created_at__lt=next_month(start))
+            while True:
+                batch = list(month_rows.values_list('pk', key_fields[table])[:batch_size])
+                if not batch:
+                    break
+                ids = [pk for pk, _ in batch]
+                with transaction.atomic():
+                    ArchivedKey.objects.bulk_create([
+                        ArchivedKey(**_archived_key(table, pk, key)) for pk, key in batch if key is not None
+                    ], batch_size=batch_size, ignore_conflicts=True)
+                    TABLES[table]['model'].objects.filter(pk__in=ids).delete()
+                deleted[table] += len(ids)
+    if failed:
+        raise ArchiveError("; ".join(failed))
+    return deleted
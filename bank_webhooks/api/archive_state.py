@@ -0,0 +1,65 @@
+"""
+Горизонт колоночного архива без загрузки самого архива.
+
+Модуль не импортирует NumPy: горизонт нужен проверке дублей вебхука,
+проводкам и пересчету агрегатов, которым сегменты архива не нужны
+(см. api.archive).
+"""
+import json
+import os
+import threading
+from datetime import datetime
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# Файл в каталоге архива с его горизонтом
+STATE_FILE = 'archive.json'
+
+
+class HorizonFile:
+    """
+    Горизонт из archive.json, перечитываемый только при изменении файла.
+    Стоимость проверки на запрос - один stat().
+    """
+    def __init__(self, directory):
+        self.path = os.path.join(str(directory), STATE_FILE)
+        self._cached = (None, None)  # (mtime archive.json, горизонт)
+
+    def get(self):
+        """Граница архива: строки с created_at раньше нее выгружены в архив (None - архива нет)"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        cached = self._cached
+        if mtime != cached[0]:
+            horizon = None
+            if mtime is not None:
+                with open(self.path) as state_file:
+                    horizon = datetime.fromisoformat(json.load(state_file)['horizon'])
+            cached = self._cached = (mtime, horizon)
+        return cached[1]
+
+
+_horizon_file = None
+_horizon_lock = threading.Lock()
+
+
+def archive_horizon():
+    """Горизонт архива ARCHIVE_DIR (None, если архив еще не создавался)"""
+    global _horizon_file
+    if _horizon_file is None:
+        with _horizon_lock:
+            if _horizon_file is None:
+                _horizon_file = HorizonFile(settings.ARCHIVE_DIR)
+    return _horizon_file.get()
+
+
+@receiver(setting_changed)
+def reset_horizon(setting=None, **kwargs):
+    """Сбрасывает кэш горизонта при изменении ARCHIVE_DIR (например, в тестах)"""
+    global _horizon_file
+    if setting == 'ARCHIVE_DIR':
+        _horizon_file = None
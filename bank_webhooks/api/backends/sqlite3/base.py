@@ -0,0 +1,73 @@
+"""
+Настроенный бэкенд SQLite для встраиваемого режима (edge-площадки без MySQL).
+
+Отличия от django.db.backends.sqlite3:
+- при каждом подключении применяются PRAGMA из OPTIONS['pragmas']
+  (WAL-журнал, synchronous, cache_size, mmap_size, busy_timeout);
+- транзакции записи, открытые через api.db.immediate_atomic(), начинаются
+  как BEGIN IMMEDIATE: писатель берет блокировку на запись сразу и ждет ее
+  по busy_timeout, а не получает "database is locked" при попытке повысить
+  блокировку посреди транзакции. Остальные atomic() (чтение, админка)
+  открываются в режиме OPTIONS['transaction_mode'] (по умолчанию DEFERRED)
+  и не занимают блокировку на запись.
+
+Пример:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'api.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'timeout': 5,
+                'transaction_mode': 'DEFERRED',
+                'pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL'},
+            },
+        }
+    }
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+# Значения по умолчанию для встраиваемого режима
+DEFAULT_PRAGMAS = {
+    # Читатели не блокируют писателя и наоборот
+    'journal_mode': 'WAL',
+    # В режиме WAL NORMAL не теряет целостность, fsync только на checkpoint
+    'synchronous': 'NORMAL',
+    # Отрицательное значение - размер кэша страниц в КиБ (64 МиБ)
+    'cache_size': -65536,
+    # Чтение файла БД через mmap (256 МиБ)
+    'mmap_size': 268435456,
+    # Временные таблицы и индексы в памяти
+    'temp_store': 'MEMORY',
+}
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        # Собственные опции бэкенда не передаются в sqlite3.connect()
+        self.pragmas = {**DEFAULT_PRAGMAS, **kwargs.pop('pragmas', {})}
+        self.transaction_mode = kwargs.pop('transaction_mode', 'DEFERRED').upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"OPTIONS['transaction_mode'] must be one of {', '.join(TRANSACTION_MODES)}"
+            )
+        # busy_timeout согласован с timeout драйвера (секунды -> миллисекунды)
+        self.pragmas.setdefault('busy_timeout', int(kwargs.get('timeout', 5) * 1000))
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    # Следующая транзакция начнется как BEGIN IMMEDIATE (см. api.db.immediate_atomic)
+    begin_immediate = False
+
+    def _start_transaction_under_autocommit(self):
+        # cursor() открывает соединение и читает transaction_mode из OPTIONS
+        cursor = self.cursor()
+        cursor.execute(f"BEGIN {'IMMEDIATE' if self.begin_immediate else self.transaction_mode}")
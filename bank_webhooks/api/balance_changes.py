@@ -0,0 +1,180 @@
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DatabaseError, connection
+from django.dispatch import receiver
+from django.utils.http import quote_etag
+
+from .models import Organization
+
+# Поля состояния баланса, по которым строится ETag
+STATE_FIELDS = ('inn', 'balance', 'balance_version', 'updated_at')
+
+
+def balance_state(inn):
+    """
+    Дешевая выборка состояния баланса по первичному ключу,
+    без создания экземпляра модели.
+
+    Returns:
+        dict: inn, balance, balance_version, updated_at или None, если организации нет
+    """
+    return Organization.objects.filter(inn=inn).values(*STATE_FIELDS).first()
+
+
+def balance_etag(state):
+    """
+    ETag баланса: версия баланса плюс время изменения организации
+    (updated_at учитывает и правки, сделанные не через вебхук, например в админке).
+    """
+    updated_at = int(state['updated_at'].timestamp() * 1_000_000)
+    return quote_etag(f"{state['balance_version']}-{updated_at}")
+
+
+class BalanceWatcher:
+    """
+    Общая для процесса проверка балансов, изменения которых ждут опросы.
+
+    Один фоновый поток раз в interval секунд одним запросом читает
+    состояние всех организаций, которых ждут запросы процесса, и будит
+    ожидающих. Поток работает, только пока есть ожидающие, и держит одно
+    свое соединение с БД, не переподключаясь на каждой проверке; сами
+    ожидающие запросы соединений не держат. Изменение в этом же процессе
+    (notify) запускает проверку сразу, изменения из других процессов
+    видны не позже чем через interval.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.changed = threading.Condition()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.waiting = Counter()  # ИНН -> число ожидающих запросов
+        self.states = {}  # ИНН -> состояние из последней проверки (None - организации нет)
+        # Номера начатой и завершенной проверок: ожидающий принимает только
+        # результат проверки, начатой после его регистрации
+        self.started = 0
+        self.completed = 0
+
+    def wait(self, state, etags, timeout):
+        """
+        Ждет, пока ETag баланса не перестанет совпадать с известными клиенту.
+
+        Returns:
+            dict: Актуальное состояние (None, если организация удалена)
+        """
+        inn = state['inn']
+        deadline = time.monotonic() + timeout
+        with self.changed:
+            self.waiting[inn] += 1
+            registered = self.started
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='balance-watcher', daemon=True)
+                self.thread.start()
+            try:
+                while state is not None and balance_etag(state) in etags:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.changed.wait(remaining)
+                    if self.completed > registered:
+                        state = self.states.get(inn)
+            finally:
+                self.waiting[inn] -= 1
+                if not self.waiting[inn]:
+                    del self.waiting[inn]
+        return state
+
+    def notify(self):
+        """Запускает внеочередную проверку (баланс изменился в этом процессе)"""
+        self.wakeup.set()
+
+    def _run(self):
+        try:
+            while True:
+                self.wakeup.wait(self.interval)
+                self.wakeup.clear()
+                with self.changed:
+                    if not self.waiting:
+                        # Ждать некому - поток завершается и закрывает соединение
+                        self.thread = None
+                        return
+                    inns = list(self.waiting)
+                    self.started += 1
+                    poll = self.started
+                try:
+                    rows = Organization.objects.filter(inn__in=inns).values(*STATE_FIELDS)
+                    states = {row['inn']: row for row in rows}
+                except DatabaseError:
+                    # Соединение потеряно - переподключимся при следующей проверке
+                    connection.close()
+                    continue
+                with self.changed:
+                    self.states = {inn: states.get(inn) for inn in inns}
+                    self.completed = poll
+                    self.changed.notify_all()
+        finally:
+            connection.close()
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def get_watcher():
+    """Возвращает наблюдатель балансов процесса, создавая его по настройкам"""
+    global _watcher
+    if _watcher is None:
+        with _watcher_lock:
+            if _watcher is None:
+                _watcher = BalanceWatcher(settings.BALANCE_POLL_INTERVAL)
+    return _watcher
+
+
+@receiver(setting_changed)
+def reset_watcher(setting=None, **kwargs):
+    """Сбрасывает наблюдатель при изменении интервала (например, в тестах)"""
+    global _watcher
+    if setting == 'BALANCE_POLL_INTERVAL':
+        _watcher = None
+
+
+def notify_balance_changed():
+    """Будит ожидающие в этом процессе опросы баланса"""
+    if _watcher is not None:
+        _watcher.notify()
+
+
+def wait_for_balance_change(state, etags, timeout):
+    """
+    Ждет, пока ETag баланса не перестанет совпадать с известными клиенту.
+
+    Ожидание идет через общий BalanceWatcher процесса: один поток раз в
+    BALANCE_POLL_INTERVAL проверяет все ожидаемые балансы одним запросом,
+    а соединение запроса на время ожидания закрывается. Внутри транзакции
+    (ATOMIC_REQUESTS, тесты) поток не видит ее данных, поэтому запрос
+    проверяет версию сам с тем же интервалом, не закрывая соединение.
+
+    Args:
+        state: Текущее состояние из balance_state()
+        etags: ETag-и из If-None-Match
+        timeout: Максимальное время ожидания (секунды)
+
+    Returns:
+        dict: Актуальное состояние из balance_state() (None, если организация удалена)
+    """
+    if not connection.in_atomic_block:
+        connection.close()
+        return get_watcher().wait(state, etags, timeout)
+
+    inn = state['inn']
+    deadline = time.monotonic() + timeout
+    while state is not None and balance_etag(state) in etags:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(settings.BALANCE_POLL_INTERVAL, remaining))
+        state = balance_state(inn)
+    return state
@@ -0,0 +1,73 @@
+import functools
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Сообщения SQLite о занятой блокировке (SQLITE_BUSY / SQLITE_LOCKED)
+_BUSY_MESSAGES = ('database is locked', 'database table is locked')
+
+
+def is_busy_error(error):
+    """Признак того, что ошибка вызвана занятой блокировкой SQLite"""
+    return isinstance(error, OperationalError) and any(
+        message in str(error) for message in _BUSY_MESSAGES
+    )
+
+
+def retry_on_busy(func):
+    """
+    Повторяет транзакцию записи, если SQLite так и не дождался блокировки
+    за busy_timeout.
+
+    Декорируемая функция должна целиком содержать транзакцию (atomic()),
+    чтобы повтор начинался с чистого состояния. Число попыток и базовая
+    пауза задаются настройками DB_BUSY_RETRIES и DB_BUSY_BACKOFF; паузы
+    растут экспоненциально со случайным разбросом. Для других СУБД
+    ошибки не перехватываются.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        attempts = getattr(settings, 'DB_BUSY_RETRIES', 3)
+        backoff = getattr(settings, 'DB_BUSY_BACKOFF', 0.05)
+        for attempt in range(attempts + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as error:
+                if attempt == attempts or not is_busy_error(error):
+                    raise
+                delay = backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                logger.warning(
+                    "Database is busy, retrying %s in %.3fs (attempt %d of %d)",
+                    func.__qualname__, delay, attempt + 1, attempts,
+                )
+                time.sleep(delay)
+    return wrapper
+
+
+@contextmanager
+def immediate_atomic(using=None):
+    """
+    atomic() для транзакций записи: на бэкенде api.backends.sqlite3 внешняя
+    транзакция начинается как BEGIN IMMEDIATE и сразу берет блокировку на
+    запись. Читающие транзакции используют обычный atomic() и блокировку
+    не занимают. Для других СУБД - обычный atomic().
+
+    Внутри уже открытой транзакции режим не меняется (действует режим
+    внешней транзакции).
+    """
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    previous = getattr(connection, 'begin_immediate', False)
+    connection.begin_immediate = True
+    try:
+        with transaction.atomic(using=using):
+            # Режим влияет только на BEGIN внешней транзакции - вложенные atomic() не затрагиваем
+            connection.begin_immediate = previous
+            yield
+    finally:
+        connection.begin_immediate = previous
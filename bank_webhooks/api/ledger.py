@@ -0,0 +1,138 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .aggregates import record_balance_log
+from .archive_state import archive_horizon
+from .balance_changes import notify_balance_changed
+from .db import immediate_atomic, retry_on_busy
+from .models import ArchivedKey, Organization, BalanceLog
+
+# Результаты проводки
+APPLIED = 'applied'
+DUPLICATE = 'duplicate'
+REJECTED = 'rejected'
+
+# Причины отказа
+INSUFFICIENT_FUNDS = 'insufficient_funds'
+ORGANIZATION_NOT_FOUND = 'organization_not_found'
+
+
+def apply_balance_change(inn, delta):
+    """
+    Изменяет баланс одним условным UPDATE.
+
+    Проверка неотрицательности баланса выполняется в том же запросе
+    (WHERE balance >= -delta), поэтому не нужна отдельная блокировка
+    строки SELECT ... FOR UPDATE и списания не могут увести баланс в минус
+    даже при конкурентных проводках по одной организации.
+
+    Returns:
+        bool: True, если баланс изменен
+    """
+    queryset = Organization.objects.filter(inn=inn)
+    if delta < 0:
+        queryset = queryset.filter(balance__gte=-delta)
+    return bool(queryset.update(
+        balance=F('balance') + delta,
+        balance_version=F('balance_version') + 1,
+        updated_at=timezone.now(),  # update() не обновляет auto_now поля
+    ))
+
+
+def _rejection_reason(inn):
+    """Уточняет причину отказа - только на редком пути, без лишнего запроса в обычном"""
+    if Organization.objects.filter(inn=inn).exists():
+        return INSUFFICIENT_FUNDS
+    return ORGANIZATION_NOT_FOUND
+
+
+@retry_on_busy
+def post_entry(entry):
+    """
+    Применяет одну проводку (списание или корректировку) в отдельной транзакции.
+
+    Args:
+        entry: dict с ключами idempotency_key, inn, operation_type, amount
+            и необязательным metadata. Для списания amount положителен,
+            для корректировки - со знаком.
+
+    Returns:
+        dict: idempotency_key, status (applied/duplicate/rejected),
+            reason для отказа и balance_log_id для примененной проводки
+    """
+    key = entry['idempotency_key']
+    inn = entry['inn']
+    amount = entry['amount']
+    operation_type = entry['operation_type']
+    delta = -amount if operation_type == BalanceLog.OperationType.WITHDRAWAL else amount
+
+    try:
+        with immediate_atomic():
+            if not apply_balance_change(inn, delta):
+                return {'idempotency_key': key, 'status': REJECTED, 'reason': _rejection_reason(inn)}
+
+            # Уникальный ключ идемпотентности: при гонке двух одинаковых
+            # проводок вставка второй упадет и откатит ее изменение баланса
+            balance_log = BalanceLog.objects.create(
+                organization_id=inn,
+                amount=amount,
+                operation_type=operation_type,
+                idempotency_key=key,
+                metadata=entry.get('metadata') or {},
+            )
+            record_balance_log(balance_log)
+            transaction.on_commit(notify_balance_changed)
+    except IntegrityError:
+        balance_log_id = BalanceLog.objects.filter(idempotency_key=key).values_list('pk', flat=True).first()
+        if balance_log_id is None:
+            # Нарушено другое ограничение (например, баланс < 0 в БД)
+            return {'idempotency_key': key, 'status': REJECTED, 'reason': INSUFFICIENT_FUNDS}
+        return _duplicate(key, balance_log_id)
+
+    return {'idempotency_key': key, 'status': APPLIED, 'balance_log_id': balance_log.pk}
+
+
+def post_entries(entries):
+    """
+    Применяет пачку проводок по порядку.
+
+    Каждая проводка - отдельная короткая транзакция, поэтому отказ одной
+    не отменяет остальные и строка организации не блокируется на время
+    всей пачки. Уже применявшиеся ключи идемпотентности находятся одним
+    запросом до начала проводок (и еще одним - среди ключей записей,
+    удаленных из БД после выгрузки в архив, если архив есть).
+
+    Args:
+        entries: Список проводок (см. post_entry)
+
+    Returns:
+        list: Результаты в порядке проводок
+    """
+    keys = [entry['idempotency_key'] for entry in entries]
+    # Ключ идемпотентности -> id записи BalanceLog уже примененной проводки
+    seen = dict(
+        BalanceLog.objects.filter(idempotency_key__in=keys).values_list('idempotency_key', 'pk')
+    )
+    if archive_horizon() is not None:
+        # Проводки, удаленные из БД после выгрузки в архив
+        seen.update(
+            ArchivedKey.objects.filter(kind=ArchivedKey.Kind.IDEMPOTENCY_KEY, key__in=keys)
+            .values_list('key', 'balance_log_id')
+        )
+
+    results = []
+    for entry in entries:
+        key = entry['idempotency_key']
+        if key in seen:
+            results.append(_duplicate(key, seen[key]))
+            continue
+        result = post_entry(entry)
+        if result['status'] != REJECTED:
+            seen[key] = result['balance_log_id']
+        results.append(result)
+    return results
+
+
+def _duplicate(key, balance_log_id):
+    return {'idempotency_key': key, 'status': DUPLICATE, 'balance_log_id': balance_log_id}
@@ -0,0 +1,153 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from django.utils.module_loading import import_string
+
+# Стандартные атрибуты LogRecord: все остальное пришло через extra=
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+# Живые асинхронные обработчики (для метрик и перезапуска после fork)
+_handlers = weakref.WeakSet()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Форматирует запись лога в одну строку JSON.
+    Поля, переданные через extra=, попадают в JSON как есть.
+    """
+    def format(self, record):
+        payload = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),  # Подстановка аргументов только здесь
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info:
+            payload['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class _BoundedStopListener(QueueListener):
+    """
+    QueueListener, остановка которого не падает на заполненной очереди.
+
+    Стандартный stop() кладет маркер остановки через put_nowait и получает
+    queue.Full как раз при всплеске записей и медленном выводе. Здесь маркер
+    кладется с ожиданием, а остановка ограничена timeout секунд: если вывод
+    не успевает, оставшиеся записи теряются, а поток (daemon) завершится
+    вместе с процессом.
+    """
+    def __init__(self, queue_, *handlers, timeout=5.0, **kwargs):
+        super().__init__(queue_, *handlers, **kwargs)
+        self.timeout = timeout
+
+    def stop(self):
+        deadline = time.monotonic() + self.timeout
+        try:
+            self.queue.put(self._sentinel, timeout=self.timeout)
+        except queue.Full:
+            pass
+        else:
+            self._thread.join(max(0.0, deadline - time.monotonic()))
+        self._thread = None
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    Асинхронный обработчик логов с ограниченной очередью.
+
+    Поток запроса только кладет запись в очередь; форматирование и запись
+    в целевой обработчик (stdout, файл, сборщик логов) выполняет фоновый
+    поток QueueListener. Если очередь заполнена, запись отбрасывается и
+    учитывается в счетчике dropped - запрос никогда не ждет медленный вывод.
+    При закрытии очередь дописывается не дольше close_timeout секунд.
+
+    Пример конфигурации в LOGGING:
+        'handlers': {
+            'console': {
+                '()': 'api.log_handlers.AsyncQueueHandler',
+                'target': 'logging.StreamHandler',
+                'maxsize': 10000,
+                'formatter': 'json',
+            },
+        }
+    """
+    def __init__(self, target='logging.StreamHandler', maxsize=10000, close_timeout=5.0, **target_kwargs):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.target = import_string(target)(**target_kwargs)
+        self.close_timeout = close_timeout
+        self._dropped_lock = threading.Lock()
+        self.dropped = 0
+        self.listener = None
+        self.start()
+        _handlers.add(self)
+
+    def start(self):
+        """Запускает фоновый поток записи"""
+        self.listener = _BoundedStopListener(
+            self.queue, self.target, respect_handler_level=True, timeout=self.close_timeout
+        )
+        self.listener.start()
+
+    def setFormatter(self, fmt):
+        # Форматирует целевой обработчик в фоновом потоке, а не поток запроса
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # В отличие от QueueHandler.prepare, не форматируем сообщение заранее:
+        # подстановка аргументов и сериализация выполняются в фоновом потоке
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def close(self):
+        # Вызывается и logging.shutdown() при выходе:
+        # дописываем оставшиеся записи перед остановкой
+        try:
+            if self.listener is not None:
+                self.listener.stop()
+                self.listener = None
+        finally:
+            self.target.close()
+            super().close()
+
+
+def logging_stats():
+    """Состояние очередей асинхронных обработчиков для метрик"""
+    return [
+        {
+            'target': type(handler.target).__name__,
+            'queued': handler.queue.qsize(),
+            'maxsize': handler.queue.maxsize,
+            'dropped': handler.dropped,
+        }
+        for handler in list(_handlers)
+    ]
+
+
+def _restart_after_fork():
+    # Потоки не переживают fork (например, gunicorn --preload) - запускаем заново
+    for handler in list(_handlers):
+        if handler.listener is not None:
+            handler.queue = queue.Queue(maxsize=handler.queue.maxsize)
+            handler._dropped_lock = threading.Lock()
+            handler.start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
@@ -0,0 +1,47 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.archive import ArchiveError, archive_history, month_start, prune_archived
+
+
+def parse_month(value):
+    """Разбирает месяц в формате YYYY-MM"""
+    return datetime.strptime(value, '%Y-%m').date()
+
+
+class Command(BaseCommand):
+    """
+    Выгрузка холодной истории платежей и баланса в колоночный архив.
+    """
+    help = "Export Payment and BalanceLog months older than --before to the columnar archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', type=parse_month, required=True,
+                            help="First month (YYYY-MM) that stays in the database")
+        parser.add_argument('--prune', action='store_true',
+                            help="Delete archived rows from the database after verification")
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help="Number of rows loaded from the database at a time")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of rows deleted per query with --prune")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or options['batch_size'] < 1:
+            raise CommandError("--chunk-size and --batch-size must be positive")
+
+        try:
+            exported = archive_history(month_start(options['before']), chunk_size=options['chunk_size'])
+        except ArchiveError as error:
+            raise CommandError(f"Archive verification failed: {error}")
+        for table, rows in exported.items():
+            self.stdout.write(f"Archived {rows} {table} rows")
+
+        if options['prune']:
+            try:
+                deleted = prune_archived(batch_size=options['batch_size'], chunk_size=options['chunk_size'])
+            except ArchiveError as error:
+                raise CommandError(f"Months that failed verification were not pruned: {error}")
+            for table, rows in deleted.items():
+                self.stdout.write(f"Deleted {rows} archived {table} rows")
+        self.stdout.write(self.style.SUCCESS(f"Archive horizon: {options['before']:%Y-%m}"))
@@ -0,0 +1,38 @@
+import json
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from api.analytics import payment_analytics
+
+
+class Command(BaseCommand):
+    """
+    Векторизованная аналитика по таблице платежей.
+    """
+    help = "Compute payment percentiles, payer concentration and per-INN histograms"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-from', type=date.fromisoformat,
+                            help="First document day (YYYY-MM-DD), defaults to all history")
+        parser.add_argument('--date-to', type=date.fromisoformat,
+                            help="Last document day (YYYY-MM-DD), defaults to all history")
+        parser.add_argument('--chunk-size', type=int, default=50000,
+                            help="Number of payments loaded from the database at a time")
+        parser.add_argument('--top', type=int, default=20,
+                            help="Number of largest payers to report")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be positive")
+        if options['date_from'] and options['date_to'] and options['date_from'] > options['date_to']:
+            raise CommandError("--date-from must not be later than --date-to")
+
+        result = payment_analytics(
+            date_from=options['date_from'],
+            date_to=options['date_to'],
+            chunk_size=options['chunk_size'],
+            top=options['top'],
+        )
+        self.stdout.write(json.dumps(result, cls=DjangoJSONEncoder, ensure_ascii=False, indent=2))
@@ -0,0 +1,37 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.aggregates import rebuild_daily_turnover
+
+
+class Command(BaseCommand):
+    """
+    Пересчет суточных агрегатов оборотов из истории BalanceLog.
+    """
+    help = "Rebuild DailyTurnover aggregates from BalanceLog history in parallel chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-from', type=date.fromisoformat,
+                            help="First day to rebuild (YYYY-MM-DD), defaults to the earliest log; "
+                                 "days before the archive horizon are never rebuilt")
+        parser.add_argument('--date-to', type=date.fromisoformat,
+                            help="Last day to rebuild (YYYY-MM-DD), defaults to the latest log")
+        parser.add_argument('--chunk-days', type=int, default=31,
+                            help="Number of days processed by one worker at a time")
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Number of parallel worker threads")
+
+    def handle(self, *args, **options):
+        if options['chunk_days'] < 1:
+            raise CommandError("--chunk-days must be positive")
+        if options['date_from'] and options['date_to'] and options['date_from'] > options['date_to']:
+            raise CommandError("--date-from must not be later than --date-to")
+
+        created = rebuild_daily_turnover(
+            date_from=options['date_from'],
+            date_to=options['date_to'],
+            chunk_days=options['chunk_days'],
+            workers=options['workers'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {created} daily turnover rows"))
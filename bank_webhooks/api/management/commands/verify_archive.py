@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.archive import TABLES, get_archive, verify_segment
+
+
+class Command(BaseCommand):
+    """
+    Проверка целостности колоночного архива.
+    """
+    help = "Verify archive checksums and indexes and compare archived rows with the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--table', choices=list(TABLES),
+                            help="Verify only this table")
+        parser.add_argument('--month',
+                            help="Verify only this month (YYYY-MM)")
+
+    def handle(self, *args, **options):
+        failed = False
+        segments = 0
+        for table in TABLES:
+            if options['table'] and table != options['table']:
+                continue
+            for segment in get_archive().segments(table):
+                if options['month'] and segment.start.strftime('%Y-%m') != options['month']:
+                    continue
+                segments += 1
+                errors, checked = verify_segment(segment)
+                for error in errors:
+                    self.stderr.write(error)
+                failed = failed or bool(errors)
+                self.stdout.write(
+                    f"{table}/{segment.start:%Y-%m}: {segment.rows} rows, "
+                    f"{checked} compared with the database, {'FAILED' if errors else 'OK'}"
+                )
+
+        if failed:
+            raise CommandError("Archive verification failed")
+        self.stdout.write(self.style.SUCCESS(f"Verified {segments} segments"))
@@ -0,0 +1,136 @@
+import time
+
+from django.db import connection
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+
+from .admission import get_controller
+from .profiling import get_profiler
+
+
+class AdmissionControlMiddleware:
+    """
+    Middleware контроля допуска для вебхука и опроса баланса.
+
+    До вызова view проверяет, есть ли у процесса свободная емкость
+    и токен в бакете источника; при отказе сразу отвечает 503 с
+    заголовком Retry-After, не занимая соединение с БД. Во время
+    обработки допущенных запросов замеряет суммарное время запросов к БД
+    для адаптации лимита; неограничиваемые маршруты (админка, отчеты)
+    на лимит не влияют.
+    Должен стоять последним в MIDDLEWARE, чтобы отказ не обходил
+    process_view остальных middleware.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        controller = get_controller()
+        if not controller.config['ENABLED']:
+            return self.get_response(request)
+
+        # Замеряем суммарное время запросов к БД, выполненных при обработке
+        observer = DbLatencyObserver()
+        with connection.execute_wrapper(observer):
+            response = self.get_response(request)
+        # Учитываются только классифицированные и допущенные запросы: медленный
+        # отчет не должен снижать лимит вебхуков и опроса баланса
+        if observer.queries and getattr(request, '_admission_class', None) is not None:
+            controller.observe_db_latency(observer.total)
+        release_admission(request)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        controller = get_controller()
+        if not controller.config['ENABLED']:
+            return None
+
+        request_class = controller.classify(request.resolver_match.url_name)
+        if request_class is None:
+            return None
+
+        source = request.META.get(controller.config['SOURCE_HEADER'], '')
+        # За прокси в заголовке может быть цепочка адресов - берем клиентский
+        source = source.split(',')[0].strip()
+
+        decision = controller.try_acquire(request_class, source)
+        if not decision.admitted:
+            response = JsonResponse(
+                {'detail': "Сервис перегружен, повторите запрос позже", 'reason': decision.reason},
+                status=503
+            )
+            response['Retry-After'] = str(decision.retry_after)
+            return response
+
+        # Слот освобождается в __call__ после формирования ответа
+        request._admission = (controller, request_class)
+        request._admission_class = request_class
+        return None
+
+
+def release_admission(request):
+    """
+    Освобождает слот контроля допуска запроса, если он еще занят.
+
+    View вызывает ее досрочно перед долгим ожиданием (long polling):
+    ожидающий запрос не нагружает БД и не должен вытеснять другие из
+    лимита. Повторный вызов из middleware ничего не делает.
+    """
+    # View получает Request DRF - слот хранится в исходном HttpRequest
+    request = getattr(request, '_request', request)
+    admission = getattr(request, '_admission', None)
+    if admission is not None:
+        request._admission = None
+        admitted_by, request_class = admission
+        admitted_by.release(request_class)
+
+
+class DbLatencyObserver:
+    """
+    Обертка выполнения SQL, суммирующая длительность запросов к БД
+    одного HTTP-запроса.
+    """
+    def __init__(self):
+        self.queries = 0
+        self.total = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.total += time.perf_counter() - started
+
+
+class ProfilingMiddleware:
+    """
+    Middleware сэмплирующего профилирования запросов.
+
+    Включается настройкой PROFILING или во время работы через
+    эндпоинт /api/profiling/ (общий файл состояния, см. SamplingProfiler).
+    В выключенном состоянии стоит проверку времени и флага на запрос. Во включенном - профилирует каждый N-й запрос и все
+    запросы к URL из URL_NAMES, накапливая стеки по view.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profiler = get_profiler()
+        profiler.sync()
+        if not profiler.enabled:
+            return self.get_response(request)
+
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return self.get_response(request)
+
+        if not profiler.should_profile(match.url_name):
+            return self.get_response(request)
+
+        profiler.start(match.url_name or match.view_name)
+        try:
+            return self.get_response(request)
+        finally:
+            profiler.stop()
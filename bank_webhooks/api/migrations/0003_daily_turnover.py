@@ -0,0 +1,35 @@
+# Generated by Django 4.2.17 on 2026-10-18 22:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_alter_payment_operation_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyTurnover',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(help_text='Calendar day of the balance operations', verbose_name='Day')),
+                ('operation_type', models.CharField(choices=[('deposit', 'Deposit'), ('withdrawal', 'Withdrawal'), ('correction', 'Correction')], help_text='Type of balance operation', max_length=10, verbose_name='Operation type')),
+                ('count', models.PositiveIntegerField(default=0, help_text='Number of operations during the day', verbose_name='Count')),
+                ('amount', models.DecimalField(decimal_places=2, default=0, help_text='Total amount of operations during the day', max_digits=18, verbose_name='Amount')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_turnovers', to='api.organization', verbose_name='Organization')),
+            ],
+            options={
+                'verbose_name': 'Daily turnover',
+                'verbose_name_plural': 'Daily turnovers',
+                'ordering': ['-day'],
+                'indexes': [models.Index(fields=['day'], name='api_dailytu_day_fc35fb_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyturnover',
+            constraint=models.UniqueConstraint(fields=('organization', 'day', 'operation_type'), name='unique_daily_turnover'),
+        ),
+    ]
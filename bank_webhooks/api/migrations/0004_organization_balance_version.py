@@ -0,0 +1,18 @@
+# Generated by Django 4.2.17 on 2026-10-18 22:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_daily_turnover'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organization',
+            name='balance_version',
+            field=models.PositiveBigIntegerField(default=0, editable=False, help_text='Incremented on every balance change', verbose_name='Balance version'),
+        ),
+    ]
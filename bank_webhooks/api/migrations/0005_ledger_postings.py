@@ -0,0 +1,22 @@
+# Generated by Django 4.2.17 on 2026-10-18 22:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_organization_balance_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='balancelog',
+            name='idempotency_key',
+            field=models.CharField(blank=True, help_text='Client-supplied key that makes a posting idempotent', max_length=64, null=True, unique=True, verbose_name='Idempotency key'),
+        ),
+        migrations.AddConstraint(
+            model_name='organization',
+            constraint=models.CheckConstraint(check=models.Q(('balance__gte', 0)), name='organization_balance_non_negative'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.17 on 2026-10-18 23:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_ledger_postings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('operation_id', 'Payment operation ID'), ('idempotency_key', 'Posting idempotency key')], max_length=16, verbose_name='Kind')),
+                ('key', models.CharField(max_length=64, verbose_name='Key')),
+                ('balance_log_id', models.BigIntegerField(blank=True, null=True, verbose_name='Balance log ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+            ],
+            options={
+                'verbose_name': 'Archived key',
+                'verbose_name_plural': 'Archived keys',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='archivedkey',
+            constraint=models.UniqueConstraint(fields=('kind', 'key'), name='unique_archived_key'),
+        ),
+    ]
@@ -21,6 +21,17 @@ class Organization(models.Model):
             # Индекс для ускорения поиска по ИНН
             models.Index(fields=['inn']),
         ]
+        constraints = [
+            # MinValueValidator проверяется только в формах - дублируем его в БД.
+            # Это лишь страховка: MySQL до 8.0.16 (в т.ч. 5.7 из docker-compose)
+            # CHECK не применяет (models.W027), соблюдается он только в SQLite
+            # и MySQL >= 8.0.16. Настоящая защита от ухода в минус - условный
+            # UPDATE в ledger.apply_balance_change (WHERE balance >= -delta)
+            models.CheckConstraint(
+                check=models.Q(balance__gte=0),
+                name='organization_balance_non_negative'
+            ),
+        ]
 
     # ИНН организации - основной идентификатор
     inn = models.CharField(
@@ -48,6 +59,15 @@ class Organization(models.Model):
         help_text=_("Current organization balance in currency units")
     )
 
+    # Версия баланса: увеличивается при каждом изменении баланса
+    # (используется для ETag при опросе баланса)
+    balance_version = models.PositiveBigIntegerField(
+        _("Balance version"),
+        default=0,
+        editable=False,
+        help_text=_("Incremented on every balance change")
+    )
+
     # Автоматически добавляемая дата создания
     created_at = models.DateTimeField(
         _("Created at"),
@@ -206,6 +226,16 @@ class BalanceLog(models.Model):
         db_index=True  # Индекс для быстрого поиска
     )
     
+    # Ключ идемпотентности проводки: повтор с тем же ключом не применяется
+    idempotency_key = models.CharField(
+        _("Idempotency key"),
+        max_length=64,
+        unique=True,
+        null=True,  # Пополнения по вебхуку идемпотентны по operation_id платежа
+        blank=True,
+        help_text=_("Client-supplied key that makes a posting idempotent")
+    )
+
     # Дополнительные метаданные операции
     metadata = models.JSONField(
         _("Metadata"),
@@ -220,4 +250,126 @@ class BalanceLog(models.Model):
                     'operation_type': self.OperationType(self.operation_type).label,  # Используем .label
                     'amount': self.amount,
                     'inn': self.organization.inn
-                }
\ No newline at end of file
+                }
+
+class DailyTurnover(models.Model):
+    """
+    Суточные агрегаты оборотов организации.
+    Поддерживаются инкрементально при каждой записи в BalanceLog,
+    чтобы отчеты по периодам не сканировали всю историю.
+    """
+
+    class Meta:
+        verbose_name = _("Daily turnover")
+        verbose_name_plural = _("Daily turnovers")
+        ordering = ['-day']  # Новые дни сначала
+        constraints = [
+            # Одна строка на организацию, день и тип операции (ключ для upsert)
+            models.UniqueConstraint(
+                fields=['organization', 'day', 'operation_type'],
+                name='unique_daily_turnover'
+            ),
+        ]
+        indexes = [
+            # Индекс для выборок по диапазону дат без привязки к организации
+            models.Index(fields=['day']),
+        ]
+
+    # Организация, по которой считается оборот
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,  # Агрегаты не имеют смысла без организации
+        related_name='daily_turnovers',
+        verbose_name=_("Organization")
+    )
+
+    # День операции (по дате записи в BalanceLog)
+    day = models.DateField(
+        _("Day"),
+        help_text=_("Calendar day of the balance operations")
+    )
+
+    # Тип операции
+    operation_type = models.CharField(
+        _("Operation type"),
+        max_length=10,
+        choices=BalanceLog.OperationType.choices,
+        help_text=_("Type of balance operation")
+    )
+
+    # Количество операций за день
+    count = models.PositiveIntegerField(
+        _("Count"),
+        default=0,
+        help_text=_("Number of operations during the day")
+    )
+
+    # Сумма операций за день
+    amount = models.DecimalField(
+        _("Amount"),
+        max_digits=18,  # С запасом относительно суммы одной операции
+        decimal_places=2,
+        default=0,
+        help_text=_("Total amount of operations during the day")
+    )
+
+    def __str__(self):
+        """Человекочитаемое представление агрегата"""
+        return _("%(inn)s %(day)s %(operation_type)s: %(count)s / %(amount)s") % {
+            'inn': self.organization_id,
+            'day': self.day,
+            'operation_type': self.operation_type,
+            'count': self.count,
+            'amount': self.amount,
+        }
+
+
+class ArchivedKey(models.Model):
+    """
+    Ключи дедупликации строк, удаленных из БД после выгрузки в архив.
+    Таблица не очищается: повтор вебхука или проводки после удаления
+    исходной строки распознается как дубль без чтения архива.
+    """
+
+    # Чей ключ хранится
+    class Kind(models.TextChoices):
+        OPERATION_ID = 'operation_id', _("Payment operation ID")  # Платеж из вебхука
+        IDEMPOTENCY_KEY = 'idempotency_key', _("Posting idempotency key")  # Проводка
+
+    class Meta:
+        verbose_name = _("Archived key")
+        verbose_name_plural = _("Archived keys")
+        constraints = [
+            # Один ключ каждого вида (он же индекс для проверки дублей)
+            models.UniqueConstraint(fields=['kind', 'key'], name='unique_archived_key'),
+        ]
+
+    # Вид ключа
+    kind = models.CharField(
+        _("Kind"),
+        max_length=16,
+        choices=Kind.choices
+    )
+
+    # operation_id платежа или ключ идемпотентности проводки
+    key = models.CharField(
+        _("Key"),
+        max_length=64
+    )
+
+    # id удаленной записи BalanceLog - для ответа на повтор проводки
+    balance_log_id = models.BigIntegerField(
+        _("Balance log ID"),
+        null=True,
+        blank=True
+    )
+
+    # Когда строка была удалена из БД
+    created_at = models.DateTimeField(
+        _("Created at"),
+        auto_now_add=True
+    )
+
+    def __str__(self):
+        """Строковое представление для отладки"""
+        return f"{self.kind}: {self.key}"
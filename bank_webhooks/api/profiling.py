@@ -0,0 +1,341 @@
+import atexit
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# Настройки по умолчанию, переопределяются через settings.PROFILING
+DEFAULTS = {
+    'ENABLED': False,
+    # Профилировать каждый N-й запрос (0 - не профилировать по счетчику)
+    'EVERY_N': 100,
+    # Имена URL, запросы к которым профилируются всегда (например, 'bank-webhook')
+    'URL_NAMES': [],
+    # Интервал снятия стеков (секунды)
+    'INTERVAL': 0.005,
+    # Максимальная глубина стека в одном сэмпле
+    'MAX_DEPTH': 128,
+    # Каталог для выгрузки профилей и общего состояния воркеров
+    'OUTPUT_DIR': 'profiles',
+    # Как часто воркер перечитывает общее состояние (секунды)
+    'SYNC_INTERVAL': 1.0,
+    # Идентификатор развертывания (например, версия релиза): общее состояние,
+    # записанное другим поколением, игнорируется. None - игнорируется
+    # состояние, записанное до запуска процесса
+    'GENERATION': None,
+}
+
+# Файл в OUTPUT_DIR с настройками, заданными через /api/profiling/
+STATE_FILE = 'profiling.json'
+# Настройки, которые задаются только в settings и не попадают в общее состояние
+LOCAL_OPTIONS = ('OUTPUT_DIR', 'SYNC_INTERVAL', 'GENERATION')
+
+# Время запуска процесса (с gunicorn --preload - мастер-процесса) для
+# отсечения файла состояния, оставшегося от прошлого запуска
+PROCESS_STARTED_NS = time.time_ns()
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профилировщик запросов.
+
+    Фоновый поток с заданным интервалом снимает стеки потоков, которые
+    сейчас обрабатывают выбранные запросы, и накапливает их по view.
+    Профили выгружаются в формате свернутых стеков (folded stacks:
+    "frame;frame;frame count"), который читают flamegraph.pl, speedscope
+    и inferno.
+
+    Настройки меняются во время работы через configure() без перезапуска.
+    publish() записывает их в файл STATE_FILE в OUTPUT_DIR, а sync() не
+    чаще раза в SYNC_INTERVAL подхватывает его изменения - так включение
+    через эндпоинт доходит до всех воркеров, использующих общий каталог.
+    Файл от прошлого запуска (другое GENERATION или, если оно не задано,
+    записанный до старта процесса) не применяется: после перезапуска
+    действуют настройки PROFILING. Без GENERATION воркер, перезапущенный
+    по max_requests, тоже начинает с PROFILING.
+
+    Накопленные стеки и счетчики свои у каждого процесса. request_dump()
+    публикует номер выгрузки: каждый воркер, увидев его при sync() (из
+    middleware или, пока профилирование включено, из потока сэмплирования),
+    выгружает свои стеки в общий каталог выгрузки, а merge_dump() сводит
+    их в один профиль на view. При выходе процесса несохраненные стеки
+    выгружаются в OUTPUT_DIR.
+    """
+    def __init__(self, config=None):
+        self.lock = threading.Lock()
+        self.config = {}
+        self.counter = itertools.count(1)
+        # Потоки, обрабатывающие профилируемые запросы: id потока -> имя view
+        self.active = {}
+        self.samples = defaultdict(Counter)
+        self.requests = Counter()
+        self.sampler = None
+        # Время последней проверки и версия (mtime, size) прочитанного файла состояния
+        self.synced_at = None
+        self.state_version = None
+        # Номер последней выгрузки, запрошенной через общее состояние
+        self.dump_id = None
+        self.configure(**{**DEFAULTS, **(config or {})})
+
+    @property
+    def enabled(self):
+        return self.config['ENABLED']
+
+    def configure(self, **changes):
+        """
+        Меняет настройки профилировщика во время работы.
+
+        Args:
+            **changes: Ключи из DEFAULTS (ENABLED, EVERY_N, URL_NAMES, ...)
+        """
+        unknown = set(changes) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown profiling options: {', '.join(sorted(unknown))}")
+        with self.lock:
+            self.config.update(changes)
+            self.config['URL_NAMES'] = frozenset(self.config['URL_NAMES'])
+            if self.enabled and (self.sampler is None or not self.sampler.is_alive()):
+                self.sampler = threading.Thread(
+                    target=self._run, name='request-profiler', daemon=True
+                )
+                self.sampler.start()
+
+    def state_path(self):
+        return os.path.join(self.config['OUTPUT_DIR'], STATE_FILE)
+
+    def publish(self):
+        """Записывает текущие настройки в общий файл состояния"""
+        with self.lock:
+            state = {
+                key: sorted(value) if key == 'URL_NAMES' else value
+                for key, value in self.config.items() if key not in LOCAL_OPTIONS
+            }
+            state['generation'] = self.config['GENERATION']
+            state['dump'] = self.dump_id
+        path = self.state_path()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Атомарная замена: воркеры не прочитают недописанный файл
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as output:
+            json.dump(state, output)
+        os.replace(tmp_path, path)
+        self.state_version = self._state_version(path)
+
+    def sync(self, now=None):
+        """
+        Применяет настройки из общего файла, если он изменился.
+        Файл проверяется не чаще раза в SYNC_INTERVAL секунд.
+        """
+        now = time.monotonic() if now is None else now
+        if self.synced_at is not None and now - self.synced_at < self.config['SYNC_INTERVAL']:
+            return
+        self.synced_at = now
+        path = self.state_path()
+        version = self._state_version(path)
+        if version is None or version == self.state_version:
+            return
+        try:
+            with open(path) as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            # Файл заменяется атомарно; ошибка чтения - повторим при следующей проверке
+            return
+        self.state_version = version
+        if not self._current_state(state, version):
+            return
+        self.configure(**{
+            key: value for key, value in state.items() if key in DEFAULTS and key not in LOCAL_OPTIONS
+        })
+        dump_id = state.get('dump')
+        with self.lock:
+            requested = dump_id is not None and dump_id != self.dump_id
+            if requested:
+                self.dump_id = dump_id
+        if requested:
+            self.dump(self.dump_dir(dump_id))
+
+    def dump_dir(self, dump_id):
+        """Общий каталог выгрузки dump_id, куда пишут стеки все воркеры"""
+        return os.path.join(self.config['OUTPUT_DIR'], f"dump-{dump_id}")
+
+    def request_dump(self):
+        """
+        Запрашивает выгрузку стеков у всех воркеров с общим OUTPUT_DIR.
+
+        Returns:
+            str: Номер выгрузки для merge_dump()
+        """
+        with self.lock:
+            self.dump_id = uuid.uuid4().hex
+        self.publish()
+        return self.dump_id
+
+    def merge_dump(self, dump_id):
+        """
+        Сводит стеки, выгруженные воркерами по запросу dump_id, в один
+        файл на view (<view>.merged.folded в каталоге выгрузки).
+
+        Returns:
+            dict: Процессы, чьи стеки учтены (pids), и пути сводных файлов (files)
+        """
+        directory = self.dump_dir(dump_id)
+        merged = defaultdict(Counter)
+        pids = set()
+        names = os.listdir(directory) if os.path.isdir(directory) else []
+        for name in names:
+            if not name.endswith('.folded') or name.endswith('.merged.folded'):
+                continue
+            # <view>-<дата>-<время>-<pid>.folded
+            view_name, _, _, pid = name[:-len('.folded')].rsplit('-', 3)
+            pids.add(int(pid))
+            with open(os.path.join(directory, name)) as dumped:
+                for line in dumped:
+                    stack, count = line.rstrip('\n').rsplit(' ', 1)
+                    merged[view_name][stack] += int(count)
+
+        paths = []
+        for view_name, stacks in sorted(merged.items()):
+            path = os.path.join(directory, f"{view_name}.merged.folded")
+            with open(path, 'w') as output:
+                for stack, count in stacks.most_common():
+                    output.write(f"{stack} {count}\n")
+            paths.append(path)
+        return {'pids': sorted(pids), 'files': paths}
+
+    def _current_state(self, state, version):
+        """Записано ли общее состояние текущим развертыванием"""
+        generation = self.config['GENERATION']
+        if generation is not None:
+            return state.get('generation') == generation
+        return version[0] >= PROCESS_STARTED_NS
+
+    @staticmethod
+    def _state_version(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def should_profile(self, url_name):
+        """Решает, профилировать ли запрос: по имени URL или каждый N-й"""
+        if url_name in self.config['URL_NAMES']:
+            return True
+        every_n = self.config['EVERY_N']
+        return bool(every_n) and next(self.counter) % every_n == 0
+
+    def start(self, view_name):
+        """Регистрирует текущий поток как обрабатывающий профилируемый запрос"""
+        with self.lock:
+            self.active[threading.get_ident()] = view_name
+            self.requests[view_name] += 1
+
+    def stop(self):
+        """Снимает текущий поток с профилирования"""
+        with self.lock:
+            self.active.pop(threading.get_ident(), None)
+
+    def sample_once(self):
+        """Снимает по одному стеку с каждого профилируемого потока"""
+        frames = sys._current_frames()
+        with self.lock:
+            for thread_id, view_name in self.active.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.samples[view_name][self._fold(frame)] += 1
+
+    def dump(self, output_dir=None):
+        """
+        Выгружает накопленные профили в каталог и очищает их.
+
+        Args:
+            output_dir: Каталог выгрузки (по умолчанию OUTPUT_DIR из настроек)
+
+        Returns:
+            list: Пути созданных файлов (по одному на view)
+        """
+        output_dir = output_dir or self.config['OUTPUT_DIR']
+        os.makedirs(output_dir, exist_ok=True)
+        with self.lock:
+            samples, self.samples = self.samples, defaultdict(Counter)
+            self.requests.clear()
+
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        paths = []
+        for view_name, stacks in samples.items():
+            path = os.path.join(output_dir, f"{view_name}-{stamp}-{os.getpid()}.folded")
+            # Дописываем: повторная выгрузка процесса в ту же секунду не затирает первую
+            with open(path, 'a') as output:
+                for stack, count in stacks.most_common():
+                    output.write(f"{stack} {count}\n")
+            paths.append(path)
+        return paths
+
+    def snapshot(self):
+        """Текущие настройки и объем накопленных данных"""
+        with self.lock:
+            config = {**self.config, 'URL_NAMES': sorted(self.config['URL_NAMES'])}
+            return {
+                'config': config,
+                # Счетчики и сэмплы относятся к процессу, ответившему на запрос
+                'pid': os.getpid(),
+                'requests': dict(self.requests),
+                'samples': {view: sum(stacks.values()) for view, stacks in self.samples.items()},
+            }
+
+    def _fold(self, frame):
+        """Сворачивает стек в строку от корня к листу"""
+        names = []
+        while frame is not None and len(names) < self.config['MAX_DEPTH']:
+            code = frame.f_code
+            names.append(f"{frame.f_globals.get('__name__', '?')}.{code.co_name}")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _run(self):
+        # Поток живет, пока профилирование включено; он же подхватывает
+        # запросы выгрузки, когда воркер не получает HTTP-запросов
+        while self.enabled:
+            time.sleep(self.config['INTERVAL'])
+            if self.active:
+                self.sample_once()
+            self.sync()
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler():
+    """Возвращает профилировщик процесса, создавая его по настройкам"""
+    global _profiler
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                _profiler = SamplingProfiler(getattr(settings, 'PROFILING', None))
+    return _profiler
+
+
+@atexit.register
+def _dump_at_exit():
+    # Стеки, не выгруженные по запросу, сохраняются при остановке воркера
+    if _profiler is not None and _profiler.samples:
+        _profiler.dump()
+
+
+@receiver(setting_changed)
+def reset_profiler(setting=None, **kwargs):
+    """Пересоздает профилировщик при изменении настроек (например, в тестах)"""
+    global _profiler
+    if setting in (None, 'PROFILING'):
+        if _profiler is not None:
+            _profiler.configure(ENABLED=False)
+        _profiler = None
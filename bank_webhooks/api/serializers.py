@@ -1,8 +1,21 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Organization
+from .models import Organization, BalanceLog
 from django.core.validators import MinLengthValidator
 
 
+def validate_inn(value):
+    """
+    Проверка формата ИНН: 10 цифр (организация) или 12 цифр (ИП).
+
+    Raises:
+        ValidationError: Если ИНН содержит не только цифры или другой длины
+    """
+    if not (value.isascii() and value.isdigit()) or len(value) not in (10, 12):
+        raise serializers.ValidationError("ИНН должен состоять из 10 или 12 цифр")
+    return value
+
+
 class WebhookSerializer(serializers.Serializer):
     """
     Сериализатор для обработки данных вебхука о платежах.
@@ -17,6 +30,10 @@ class WebhookSerializer(serializers.Serializer):
     document_number = serializers.CharField(max_length=50)  # Номер платежного документа
     document_date = serializers.DateTimeField()  # Дата платежного документа
 
+    def validate_payer_inn(self, value):
+        """Проверка формата ИНН плательщика (см. validate_inn)"""
+        return validate_inn(value)
+
     def validate_amount(self, value):
         """
         Проверка, что сумма платежа положительная.
@@ -35,6 +52,28 @@ class WebhookSerializer(serializers.Serializer):
         return value
 
 
+class BalanceQuerySerializer(serializers.Serializer):
+    """
+    Сериализатор параметров опроса баланса.
+    """
+    # Сколько секунд ждать изменения баланса, если ETag клиента актуален
+    wait = serializers.IntegerField(min_value=0, default=0)
+
+    def validate_wait(self, value):
+        """
+        Проверка, что ожидание не превышает BALANCE_MAX_WAIT.
+        Предел читается при проверке, а не при импорте модуля.
+
+        Raises:
+            ValidationError: Если ожидание больше BALANCE_MAX_WAIT
+        """
+        if value > settings.BALANCE_MAX_WAIT:
+            raise serializers.ValidationError(
+                f"Ожидание не может превышать {settings.BALANCE_MAX_WAIT} секунд"
+            )
+        return value
+
+
 class OrganizationBalanceSerializer(serializers.ModelSerializer):
     """
     Сериализатор для отображения баланса организации.
@@ -47,4 +86,180 @@ class OrganizationBalanceSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Organization
-        fields = ['inn', 'balance']
\ No newline at end of file
+        fields = ['inn', 'balance']
+
+
+class TurnoverQuerySerializer(serializers.Serializer):
+    """
+    Сериализатор параметров запроса статистики оборотов.
+    """
+    date_from = serializers.DateField()  # Первый день периода (включительно)
+    date_to = serializers.DateField()  # Последний день периода (включительно)
+    operation_type = serializers.ChoiceField(
+        choices=BalanceLog.OperationType.choices,
+        required=False  # Без фильтра возвращаются все типы операций
+    )
+
+    def validate(self, attrs):
+        """
+        Проверка, что период задан в правильном порядке.
+
+        Raises:
+            ValidationError: Если date_from позже date_to
+        """
+        if attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError("date_from не может быть позже date_to")
+        return attrs
+
+
+class TurnoverTotalSerializer(serializers.Serializer):
+    """
+    Сериализатор итогов оборота по типу операции.
+    """
+    operation_type = serializers.CharField()
+    count = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=18, decimal_places=2, coerce_to_string=False)
+
+
+class TurnoverDaySerializer(TurnoverTotalSerializer):
+    """
+    Сериализатор суточного оборота по типу операции.
+    """
+    day = serializers.DateField()
+
+
+
+class ProfilingConfigSerializer(serializers.Serializer):
+    """
+    Сериализатор изменения настроек профилировщика во время работы.
+    Каталог выгрузки через API не меняется - только в настройках.
+    """
+    enabled = serializers.BooleanField(required=False)  # Включить/выключить профилирование
+    every_n = serializers.IntegerField(min_value=0, required=False)  # Профилировать каждый N-й запрос
+    url_names = serializers.ListField(  # Имена URL, профилируемые всегда
+        child=serializers.CharField(max_length=100),
+        required=False
+    )
+    interval = serializers.FloatField(min_value=0.001, max_value=1, required=False)  # Интервал сэмплов
+    dump = serializers.BooleanField(default=False)  # Выгрузить накопленные профили всех воркеров
+
+
+class ProfilingDumpQuerySerializer(serializers.Serializer):
+    """
+    Сериализатор параметров запроса сводного профиля выгрузки.
+    """
+    dump = serializers.RegexField(r'^[0-9a-f]{32}$', required=False)  # Номер выгрузки из POST dump
+
+
+
+class PostingSerializer(serializers.Serializer):
+    """
+    Сериализатор одной проводки по балансу (списание или корректировка).
+    """
+    idempotency_key = serializers.CharField(max_length=64)  # Ключ идемпотентности клиента
+    inn = serializers.CharField(
+        max_length=12,
+        validators=[MinLengthValidator(10)]  # ИНН организации (10-12 символов)
+    )
+    operation_type = serializers.ChoiceField(choices=[
+        BalanceLog.OperationType.WITHDRAWAL,
+        BalanceLog.OperationType.CORRECTION,
+    ])
+    # Для списания - положительная сумма, для корректировки - со знаком
+    amount = serializers.DecimalField(max_digits=15, decimal_places=2)
+    metadata = serializers.JSONField(required=False)  # Дополнительный контекст операции
+
+    def validate_inn(self, value):
+        """Проверка формата ИНН организации (см. validate_inn)"""
+        return validate_inn(value)
+
+    def validate(self, attrs):
+        """
+        Проверка суммы в зависимости от типа операции.
+
+        Raises:
+            ValidationError: Если сумма списания не положительна или корректировка нулевая
+        """
+        if attrs['operation_type'] == BalanceLog.OperationType.WITHDRAWAL and attrs['amount'] <= 0:
+            raise serializers.ValidationError({'amount': "Сумма списания должна быть больше нуля"})
+        if attrs['amount'] == 0:
+            raise serializers.ValidationError({'amount': "Сумма корректировки не может быть нулевой"})
+        return attrs
+
+
+class PostingBatchSerializer(serializers.Serializer):
+    """
+    Сериализатор пачки проводок, применяемых по порядку.
+    """
+    postings = PostingSerializer(many=True, allow_empty=False)
+
+    def validate_postings(self, value):
+        """
+        Проверка размера пачки и уникальности ключей идемпотентности в ней.
+        Предел LEDGER_MAX_BATCH читается при проверке, а не при импорте модуля.
+
+        Raises:
+            ValidationError: Если проводок больше LEDGER_MAX_BATCH или ключ повторяется
+        """
+        if len(value) > settings.LEDGER_MAX_BATCH:
+            raise serializers.ValidationError(
+                f"В пачке не может быть больше {settings.LEDGER_MAX_BATCH} проводок"
+            )
+        keys = [posting['idempotency_key'] for posting in value]
+        if len(keys) != len(set(keys)):
+            raise serializers.ValidationError("Ключи идемпотентности в пачке должны быть уникальны")
+        return value
+
+
+class PaymentAnalyticsQuerySerializer(serializers.Serializer):
+    """
+    Сериализатор параметров запроса аналитики платежей.
+    """
+    date_from = serializers.DateField(required=False)  # Первый день периода (включительно)
+    date_to = serializers.DateField(required=False)  # Последний день периода (включительно)
+    top = serializers.IntegerField(min_value=0, max_value=100, default=20)  # Число крупнейших плательщиков
+
+    def validate(self, attrs):
+        """
+        Проверка, что период задан в правильном порядке.
+
+        Raises:
+            ValidationError: Если date_from позже date_to
+        """
+        if attrs.get('date_from') and attrs.get('date_to') and attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError("date_from не может быть позже date_to")
+        return attrs
+
+
+class BalanceHistoryQuerySerializer(serializers.Serializer):
+    """
+    Сериализатор параметров запроса выписки по балансу.
+    """
+    date_from = serializers.DateField()  # Первый день периода (включительно)
+    date_to = serializers.DateField()  # Последний день периода (включительно)
+    limit = serializers.IntegerField(min_value=1, max_value=10000, default=1000)  # Максимум записей
+
+    def validate(self, attrs):
+        """
+        Проверка, что период задан в правильном порядке.
+
+        Raises:
+            ValidationError: Если date_from позже date_to
+        """
+        if attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError("date_from не может быть позже date_to")
+        return attrs
+
+
+class BalanceHistoryEntrySerializer(serializers.Serializer):
+    """
+    Сериализатор записи истории баланса (из БД или из архива).
+    """
+    id = serializers.IntegerField()
+    operation_type = serializers.CharField()
+    amount = serializers.DecimalField(max_digits=15, decimal_places=2)
+    payment_id = serializers.IntegerField(allow_null=True)
+    idempotency_key = serializers.CharField(allow_null=True)
+    metadata = serializers.JSONField()
+    created_at = serializers.DateTimeField()
+    archived = serializers.BooleanField()  # Запись прочитана из колоночного архива
@@ -1,8 +1,37 @@
-from django.test import TestCase
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
-from .models import Organization, Payment
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.utils import ConnectionHandler
+from django.utils import timezone
+from .analytics import INVALID_INN, decode_inn, encode_inn, payment_analytics
+from .archive import (
+    Archive, ArchiveError, archive_history, balance_as_of, month_start, next_month, prune_archived, write_segment,
+)
+from .admission import AdmissionController, CRITICAL, SHEDDABLE, get_controller
+from .aggregates import rebuild_daily_turnover
+from .balance_changes import BalanceWatcher, balance_etag, balance_state
+from .db import retry_on_busy
+from .log_handlers import AsyncQueueHandler, JsonFormatter
+from .profiling import PROCESS_STARTED_NS, SamplingProfiler, get_profiler
+from .models import Organization, Payment, BalanceLog, DailyTurnover
+from io import StringIO
+from unittest import mock
+import json
+import logging
+import numpy as np
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
 import uuid
 
 class BankWebhookTests(TestCase):
@@ -63,6 +92,17 @@ class BankWebhookTests(TestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_invalid_inn(self):
+        for payer_inn in ['12345-6789', '12345678901', '１２３４５６７８９０']:
+            response = self.client.post(
+                self.webhook_url,
+                data={**self.sample_data, 'payer_inn': payer_inn},
+                format='json'
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('payer_inn', response.data)
+        self.assertFalse(Payment.objects.exists())
+
 class OrganizationBalanceTests(TestCase):
     """Тесты для получения баланса организации."""
     def setUp(self):
@@ -80,4 +120,1158 @@ class OrganizationBalanceTests(TestCase):
         response = self.client.get(
             reverse('organization-balance', kwargs={'inn': '0000000000'})
         )
-        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        # Изменение баланса меняет ETag
+        self.org.balance += 1
+        self.org.balance_version += 1
+        self.org.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_wait_returns_changed_balance(self):
+        etag = self.client.get(self.url)['ETag']
+        # Баланс уже изменился - ответ приходит сразу, без ожидания
+        Organization.objects.filter(inn=self.org.inn).update(balance=2000, balance_version=1)
+        response = self.client.get(self.url, {'wait': 5}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(float(response.data['balance']), 2000)
+
+    def test_wait_times_out_with_304(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, {'wait': 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_waiting_poll_releases_admission_slot(self):
+        etag = self.client.get(self.url)['ETag']
+        in_flight = []
+
+        def wait(state, etags, timeout):
+            in_flight.append(get_controller().snapshot()['in_flight'][SHEDDABLE])
+            return state
+
+        with mock.patch('api.views.wait_for_balance_change', side_effect=wait):
+            response = self.client.get(self.url, {'wait': 5}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(in_flight, [0])
+        # Слот освобожден ровно один раз
+        self.assertEqual(get_controller().snapshot()['in_flight'][SHEDDABLE], 0)
+
+    def test_max_wait_read_at_request_time(self):
+        with override_settings(BALANCE_MAX_WAIT=2):
+            response = self.client.get(self.url, {'wait': 3})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'wait': 3}).status_code, status.HTTP_200_OK)
+
+
+class BalanceWatcherTests(TransactionTestCase):
+    """Тесты общей проверки ожидаемых балансов (без транзакции теста)."""
+    def setUp(self):
+        Organization.objects.create(inn="1234567890", balance=1000)
+        Organization.objects.create(inn="0987654321", balance=500)
+
+    def change_later(self, delay, **changes):
+        def change():
+            try:
+                Organization.objects.filter(inn="1234567890").update(**changes)
+            finally:
+                connection.close()
+        timer = threading.Timer(delay, change)
+        timer.start()
+        self.addCleanup(timer.join)
+
+    def test_wakes_waiter_on_change(self):
+        watcher = BalanceWatcher(interval=0.05)
+        state = balance_state("1234567890")
+        self.change_later(0.2, balance=2000, balance_version=1)
+
+        started = time.monotonic()
+        changed = watcher.wait(state, [balance_etag(state)], timeout=5)
+        self.assertLess(time.monotonic() - started, 4)
+        self.assertEqual(changed['balance_version'], 1)
+        self.assertEqual(changed['balance'], 2000)
+
+    def test_one_query_per_check_for_all_waiters(self):
+        watcher = BalanceWatcher(interval=0.05)
+        results = {}
+
+        def wait(inn):
+            state = balance_state(inn)
+            connection.close()
+            results[inn] = watcher.wait(state, [balance_etag(state)], timeout=0.5)
+
+        threads = [
+            threading.Thread(target=wait, args=(inn,)) for inn in ("1234567890", "0987654321", "1234567890")
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Три ожидающих, но проверок не больше, чем интервалов за время ожидания
+        self.assertLessEqual(watcher.started, 0.5 / 0.05 + 2)
+        self.assertEqual(results["0987654321"]['balance_version'], 0)
+        # Ожидающих не осталось - поток останавливается
+        deadline = time.monotonic() + 2
+        while watcher.thread is not None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertIsNone(watcher.thread)
+
+    def test_deleted_organization(self):
+        watcher = BalanceWatcher(interval=0.05)
+        state = balance_state("1234567890")
+        Organization.objects.filter(inn="1234567890").delete()
+        self.assertIsNone(watcher.wait(state, [balance_etag(state)], timeout=2))
+
+
+class DailyTurnoverTests(TestCase):
+    """Тесты суточных агрегатов оборотов."""
+    def setUp(self):
+        self.client = APIClient()
+        self.webhook_url = reverse('bank-webhook')
+        self.inn = "1234567890"
+        self.today = timezone.localdate().isoformat()
+
+    def post_payment(self, amount):
+        return self.client.post(self.webhook_url, data={
+            "operation_id": str(uuid.uuid4()),
+            "amount": amount,
+            "payer_inn": self.inn,
+            "document_number": "PAY-1",
+            "document_date": "2024-04-27T21:00:00Z"
+        }, format='json')
+
+    def test_webhook_updates_aggregate(self):
+        self.post_payment("100.00")
+        self.post_payment("50.50")
+
+        turnover = DailyTurnover.objects.get(organization_id=self.inn)
+        self.assertEqual(turnover.count, 2)
+        self.assertEqual(float(turnover.amount), 150.50)
+        self.assertEqual(turnover.operation_type, BalanceLog.OperationType.DEPOSIT)
+
+    def test_rebuild_matches_incremental(self):
+        self.post_payment("100.00")
+        self.post_payment("25.00")
+        DailyTurnover.objects.update(count=0, amount=0)
+
+        call_command('rebuild_daily_turnover', workers=1, stdout=StringIO())
+
+        turnover = DailyTurnover.objects.get(organization_id=self.inn)
+        self.assertEqual(turnover.count, 2)
+        self.assertEqual(float(turnover.amount), 125.00)
+
+    def test_turnover_endpoint(self):
+        self.post_payment("100.00")
+        response = self.client.get(
+            reverse('organization-turnover', kwargs={'inn': self.inn}),
+            {'date_from': self.today, 'date_to': self.today}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['totals'][0]['count'], 1)
+        self.assertEqual(float(response.data['totals'][0]['amount']), 100.00)
+        self.assertEqual(len(response.data['days']), 1)
+
+    def test_turnover_invalid_period(self):
+        self.post_payment("100.00")
+        response = self.client.get(
+            reverse('organization-turnover', kwargs={'inn': self.inn}),
+            {'date_from': '2024-02-01', 'date_to': '2024-01-01'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+
+class ParallelRebuildTests(TransactionTestCase):
+    """Тесты параллельного пересчета агрегатов (потоки видят только зафиксированные данные)."""
+    def setUp(self):
+        self.inn = "1234567890"
+        Organization.objects.create(inn=self.inn, balance=0)
+        today = timezone.localdate()
+        # По две операции в день за последние 10 дней, включая сегодня
+        for days_ago in range(10):
+            moment = timezone.make_aware(datetime.combine(today - timedelta(days=days_ago), datetime.min.time()))
+            for amount in ('10.00', '2.50'):
+                log = BalanceLog.objects.create(organization_id=self.inn, amount=amount, operation_type='deposit')
+                BalanceLog.objects.filter(pk=log.pk).update(created_at=moment + timedelta(hours=12))
+        # Устаревшие агрегаты, которые пересчет должен заменить
+        DailyTurnover.objects.create(organization_id=self.inn, day=today - timedelta(days=3),
+                                     operation_type='deposit', count=99, amount=99)
+
+    def test_parallel_rebuild(self):
+        created = rebuild_daily_turnover(chunk_days=3, workers=3)
+        self.assertEqual(created, 10)
+        turnover = DailyTurnover.objects.order_by('day')
+        self.assertEqual([(row.count, row.amount) for row in turnover], [(2, Decimal('12.50'))] * 10)
+
+    def test_past_days_aggregated_outside_transaction(self):
+        aggregations = []
+
+        def observer(execute, sql, params, many, context):
+            if 'GROUP BY' in sql and 'api_balancelog' in sql:
+                aggregations.append(connection.in_atomic_block)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(observer):
+            rebuild_daily_turnover(chunk_days=31, workers=1)
+        # Один GROUP BY по прошлым дням без транзакции и один по вчера и сегодня под блокировкой
+        self.assertEqual(aggregations, [False, True])
+        self.assertEqual(DailyTurnover.objects.filter(count=2).count(), 10)
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    """Тесты адаптивного контроля допуска."""
+    def make_controller(self, **config):
+        self.now = 0.0
+        return AdmissionController(config, clock=lambda: self.now)
+
+    def test_sheddable_rejected_before_critical(self):
+        controller = self.make_controller(INITIAL_LIMIT=4, SHEDDABLE_SHARE=0.5)
+        self.assertTrue(controller.try_acquire(SHEDDABLE, 'a').admitted)
+        self.assertTrue(controller.try_acquire(SHEDDABLE, 'a').admitted)
+
+        decision = controller.try_acquire(SHEDDABLE, 'a')
+        self.assertFalse(decision.admitted)
+        self.assertEqual(decision.reason, 'overload')
+        self.assertGreaterEqual(decision.retry_after, 1)
+        # Вебхуки продолжают приниматься до полного лимита
+        self.assertTrue(controller.try_acquire(CRITICAL, 'a').admitted)
+        self.assertTrue(controller.try_acquire(CRITICAL, 'a').admitted)
+        self.assertFalse(controller.try_acquire(CRITICAL, 'a').admitted)
+
+    def test_source_token_bucket(self):
+        controller = self.make_controller(SOURCE_RATE=1.0, SOURCE_BURST=2.0)
+        for _ in range(2):
+            self.assertTrue(controller.try_acquire(SHEDDABLE, 'noisy').admitted)
+            controller.release(SHEDDABLE)
+        decision = controller.try_acquire(SHEDDABLE, 'noisy')
+        self.assertEqual(decision.reason, 'rate_limit')
+        # Другой источник не страдает от шумного клиента
+        self.assertTrue(controller.try_acquire(SHEDDABLE, 'quiet').admitted)
+        controller.release(SHEDDABLE)
+        # Через секунду бакет пополняется
+        self.now += 1.0
+        self.assertTrue(controller.try_acquire(SHEDDABLE, 'noisy').admitted)
+
+    def test_critical_not_limited_per_source_by_default(self):
+        controller = self.make_controller(SOURCE_RATE=1.0, SOURCE_BURST=2.0, INITIAL_LIMIT=32)
+        # Банк - один источник: 200 вебхуков подряд проходят, пока хватает лимита
+        for _ in range(200):
+            self.assertTrue(controller.try_acquire(CRITICAL, 'bank').admitted)
+            controller.release(CRITICAL)
+        self.assertEqual(controller.snapshot()['counters']['shed_rate_limit'][CRITICAL], 0)
+
+    def test_critical_source_rate(self):
+        controller = self.make_controller(
+            SOURCE_RATE=1.0, SOURCE_BURST=1.0, CRITICAL_SOURCE_RATE=100.0, CRITICAL_SOURCE_BURST=3.0,
+        )
+        # Бакет опроса баланса пуст, но у вебхуков свои бакеты
+        self.assertTrue(controller.try_acquire(SHEDDABLE, 'bank').admitted)
+        controller.release(SHEDDABLE)
+        for _ in range(3):
+            self.assertTrue(controller.try_acquire(CRITICAL, 'bank').admitted)
+            controller.release(CRITICAL)
+        self.assertEqual(controller.try_acquire(CRITICAL, 'bank').reason, 'rate_limit')
+        # Скорость критичных не снижается вместе с лимитом
+        controller.limit = 4.0
+        self.now += 0.01
+        self.assertTrue(controller.try_acquire(CRITICAL, 'bank').admitted)
+
+    def test_limit_backs_off_on_db_latency(self):
+        controller = self.make_controller(INITIAL_LIMIT=32, MIN_LIMIT=4)
+        for _ in range(200):
+            controller.observe_db_latency(0.005)
+        controller.try_acquire(CRITICAL, 'a')
+        for _ in range(20):
+            controller.observe_db_latency(0.2)
+        controller.release(CRITICAL)
+
+        snapshot = controller.snapshot()
+        self.assertTrue(snapshot['degraded'])
+        self.assertLess(snapshot['limit'], 32)
+        self.assertLess(snapshot['sheddable_capacity'], 16)
+
+    def test_backoff_once_per_interval(self):
+        controller = self.make_controller(INITIAL_LIMIT=32, BACKOFF=0.9, BACKOFF_INTERVAL=1.0)
+        controller.observe_db_latency(0.02)
+        for _ in range(10):
+            controller.observe_db_latency(0.6)
+        for _ in range(10):
+            controller.try_acquire(CRITICAL, 'a')
+        for _ in range(10):
+            controller.release(CRITICAL)
+        self.assertAlmostEqual(controller.limit, 32 * 0.9)
+        self.now += 1.0
+        controller.try_acquire(CRITICAL, 'a')
+        controller.release(CRITICAL)
+        self.assertAlmostEqual(controller.limit, 32 * 0.9 * 0.9)
+
+    def test_steady_load_keeps_limit(self):
+        controller = self.make_controller(INITIAL_LIMIT=32, SOURCE_RATE=1000.0, SOURCE_BURST=1000.0)
+        # Время в БД на запрос колеблется вокруг базового, включая короткие запросы
+        samples = [0.004, 0.012, 0.008, 0.02, 0.002, 0.015]
+        for index in range(600):
+            self.now += 0.01
+            request_class = CRITICAL if index % 2 else SHEDDABLE
+            self.assertTrue(controller.try_acquire(request_class, 'a').admitted)
+            controller.observe_db_latency(samples[index % len(samples)])
+            controller.release(request_class)
+
+        snapshot = controller.snapshot()
+        self.assertFalse(snapshot['degraded'])
+        self.assertEqual(snapshot['limit'], 32)
+        self.assertEqual(snapshot['sheddable_capacity'], 16)
+        self.assertEqual(snapshot['source_rate'], 1000.0)
+
+
+class AdmissionMiddlewareTests(TestCase):
+    """Тесты сброса нагрузки на уровне HTTP."""
+    def setUp(self):
+        self.client = APIClient()
+        Organization.objects.create(inn="1234567890", balance=1000)
+        self.url = reverse('organization-balance', kwargs={'inn': "1234567890"})
+
+    @override_settings(ADMISSION_CONTROL={'SOURCE_RATE': 0.001, 'SOURCE_BURST': 1.0})
+    def test_rate_limited_request_gets_503(self):
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn('Retry-After', response)
+
+        metrics = get_controller().snapshot()
+        self.assertEqual(metrics['counters']['shed_rate_limit'][SHEDDABLE], 1)
+        self.assertEqual(metrics['in_flight'][SHEDDABLE], 0)
+
+    def test_metrics_require_admin(self):
+        url = reverse('admission-metrics')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_authenticate(admin)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('limit', response.json())
+
+    @override_settings(ADMISSION_CONTROL={'SOURCE_RATE': 1000.0, 'SOURCE_BURST': 1000.0})
+    def test_steady_traffic_does_not_shrink_limit(self):
+        webhook_url = reverse('bank-webhook')
+        for index in range(60):
+            self.client.post(webhook_url, {
+                "operation_id": str(uuid.uuid4()),
+                "amount": "10.00",
+                "payer_inn": "1234567890",
+                "document_number": f"PAY-{index}",
+                "document_date": "2024-04-27T21:00:00Z",
+            }, format='json')
+            self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+
+        snapshot = get_controller().snapshot()
+        self.assertFalse(snapshot['degraded'])
+        self.assertGreaterEqual(snapshot['limit'], 32)
+
+    @override_settings(ADMISSION_CONTROL={'MIN_DB_LATENCY': 0.0, 'MAX_DB_LATENCY': 0.0})
+    def test_unclassified_route_does_not_change_limit(self):
+        # Любое время в БД считается деградацией - но отчет не классифицирован
+        turnover_url = reverse('organization-turnover', kwargs={'inn': "1234567890"})
+        for _ in range(3):
+            response = self.client.get(turnover_url, {'date_from': '2024-01-01', 'date_to': '2024-12-31'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        snapshot = get_controller().snapshot()
+        self.assertIsNone(snapshot['db_latency'])
+        self.assertEqual(snapshot['limit'], 32)
+        self.assertFalse(snapshot['degraded'])
+
+        # Опрос баланса классифицирован - его время в БД учитывается
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(get_controller().snapshot()['db_latency'])
+
+
+
+class ProfilingTests(TestCase):
+    """Тесты профилировщика запросов."""
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('profiling')
+        self.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        # Общее состояние профилировщика пишется во временный каталог
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.output_dir.cleanup)
+        settings_override = override_settings(PROFILING={'OUTPUT_DIR': self.output_dir.name})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def tearDown(self):
+        get_profiler().configure(ENABLED=False)
+
+    def test_sample_and_dump_folded_stacks(self):
+        profiler = SamplingProfiler({'EVERY_N': 0, 'URL_NAMES': ['bank-webhook']})
+        self.assertTrue(profiler.should_profile('bank-webhook'))
+        self.assertFalse(profiler.should_profile('organization-balance'))
+
+        profiler.start('bank-webhook')
+        profiler.sample_once()
+        profiler.stop()
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            paths = profiler.dump(output_dir)
+            self.assertEqual(len(paths), 1)
+            with open(paths[0]) as dumped:
+                stack, count = dumped.readline().rsplit(' ', 1)
+            self.assertIn('test_sample_and_dump_folded_stacks', stack)
+            self.assertEqual(int(count), 1)
+
+    def test_every_nth_request(self):
+        profiler = SamplingProfiler({'EVERY_N': 3})
+        decisions = [profiler.should_profile('organization-balance') for _ in range(6)]
+        self.assertEqual(decisions, [False, False, True, False, False, True])
+
+    def test_endpoint_requires_admin(self):
+        response = self.client.post(self.url, {'enabled': True}, format='json')
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+        self.assertFalse(get_profiler().enabled)
+
+    def test_switch_on_at_runtime(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.post(
+            self.url, {'enabled': True, 'every_n': 0, 'url_names': ['organization-balance']}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(get_profiler().enabled)
+
+        Organization.objects.create(inn="1234567890", balance=1000)
+        self.client.get(reverse('organization-balance', kwargs={'inn': "1234567890"}))
+        self.assertEqual(self.client.get(self.url).data['requests'], {'organization-balance': 1})
+
+    def test_switch_reaches_other_workers(self):
+        # Два профилировщика с общим каталогом - как два процесса-воркера
+        worker = SamplingProfiler({'OUTPUT_DIR': self.output_dir.name, 'SYNC_INTERVAL': 0})
+        self.client.force_authenticate(self.admin)
+        self.client.post(self.url, {'enabled': True, 'every_n': 0, 'url_names': ['bank-webhook']}, format='json')
+        try:
+            worker.sync()
+            self.assertTrue(worker.enabled)
+            self.assertTrue(worker.should_profile('bank-webhook'))
+
+            self.client.post(self.url, {'enabled': False}, format='json')
+            worker.sync()
+            self.assertFalse(worker.enabled)
+        finally:
+            worker.configure(ENABLED=False)
+
+    def test_dump_collects_all_workers(self):
+        # Второй воркер с общим каталогом накопил свои стеки
+        worker = SamplingProfiler({'OUTPUT_DIR': self.output_dir.name, 'SYNC_INTERVAL': 0})
+        worker.start('bank-webhook')
+        worker.sample_once()
+        worker.sample_once()
+        worker.stop()
+        profiler = get_profiler()
+        profiler.start('bank-webhook')
+        profiler.sample_once()
+        profiler.stop()
+
+        self.client.force_authenticate(self.admin)
+        response = self.client.post(self.url, {'dump': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        dump_id = response.data['dump']
+        self.assertEqual(len(response.data['files']), 1)
+
+        # Воркер выгружает свои стеки, увидев запрос при следующей проверке
+        worker.sync()
+        self.assertEqual(worker.samples, {})
+        response = self.client.get(self.url, {'dump': dump_id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['pids']), 1)  # Оба "воркера" в одном процессе
+        self.assertEqual(len(response.data['files']), 1)
+        with open(response.data['files'][0]) as merged:
+            self.assertEqual(sum(int(line.rsplit(' ', 1)[1]) for line in merged), 3)
+
+        # Повторное чтение того же запроса не выгружает новые стеки
+        worker.start('bank-webhook')
+        worker.sample_once()
+        worker.stop()
+        worker.synced_at = worker.state_version = None
+        worker.sync()
+        self.assertEqual(sum(worker.samples['bank-webhook'].values()), 1)
+        self.assertEqual(self.client.get(self.url, {'dump': '../etc'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def write_state(self, generation=None, **config):
+        path = os.path.join(self.output_dir.name, 'profiling.json')
+        with open(path, 'w') as state_file:
+            json.dump({'ENABLED': True, 'EVERY_N': 1, 'URL_NAMES': [], 'generation': generation, **config},
+                      state_file)
+        return path
+
+    def test_state_from_previous_run_ignored(self):
+        path = self.write_state()
+        # Файл остался от прошлого запуска: записан до старта процесса
+        stale = (PROCESS_STARTED_NS - 10 ** 9) / 10 ** 9
+        os.utime(path, (stale, stale))
+        worker = SamplingProfiler({'OUTPUT_DIR': self.output_dir.name, 'ENABLED': False, 'SYNC_INTERVAL': 0})
+        worker.sync()
+        self.assertFalse(worker.enabled)
+
+        # Свежая запись в файл применяется
+        self.write_state()
+        worker.sync()
+        try:
+            self.assertTrue(worker.enabled)
+        finally:
+            worker.configure(ENABLED=False)
+
+    def test_state_of_other_generation_ignored(self):
+        self.write_state(generation='release-1')
+        worker = SamplingProfiler({'OUTPUT_DIR': self.output_dir.name, 'GENERATION': 'release-2',
+                                   'SYNC_INTERVAL': 0})
+        worker.sync()
+        self.assertFalse(worker.enabled)
+
+        self.write_state(generation='release-2', EVERY_N=7)
+        worker.sync()
+        try:
+            self.assertTrue(worker.enabled)
+            self.assertEqual(worker.config['EVERY_N'], 7)
+        finally:
+            worker.configure(ENABLED=False)
+
+
+
+class SlowHandler(logging.Handler):
+    """Целевой обработчик с медленной записью (для тестов AsyncQueueHandler)."""
+    def __init__(self, delay=0.2):
+        super().__init__()
+        self.delay = delay
+        self.records = []
+        self.closed = False
+
+    def emit(self, record):
+        time.sleep(self.delay)
+        self.records.append(record)
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+
+class AsyncLoggingTests(SimpleTestCase):
+    """Тесты асинхронного структурированного логирования."""
+    def make_record(self, msg, *args, **extra):
+        record = logging.LogRecord('api.views', logging.INFO, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_json_formatter(self):
+        record = self.make_record("Processed payment %s", "abc", inn="1234567890")
+        payload = json.loads(JsonFormatter().format(record))
+        self.assertEqual(payload['message'], "Processed payment abc")
+        self.assertEqual(payload['level'], 'INFO')
+        self.assertEqual(payload['inn'], "1234567890")
+
+    def test_records_written_by_listener(self):
+        stream = StringIO()
+        handler = AsyncQueueHandler(maxsize=10, stream=stream)
+        handler.setFormatter(JsonFormatter())
+        handler.handle(self.make_record("Balance %s", 100))
+        handler.close()  # Останавливает поток и дописывает очередь
+        self.assertEqual(json.loads(stream.getvalue())['message'], "Balance 100")
+
+    def test_full_queue_drops_and_counts(self):
+        stream = StringIO()
+        handler = AsyncQueueHandler(maxsize=1, stream=stream)
+        handler.listener.stop()  # Имитируем зависший вывод: очередь никто не разбирает
+        for index in range(3):
+            handler.handle(self.make_record("Record %s", index))
+        self.assertEqual(handler.dropped, 2)
+        handler.start()
+        handler.close()
+        self.assertEqual(len(stream.getvalue().splitlines()), 1)
+
+    def test_close_with_full_queue(self):
+        handler = AsyncQueueHandler(target='api.tests.SlowHandler', maxsize=5, close_timeout=0.3)
+        for index in range(20):
+            handler.handle(self.make_record("Record %s", index))
+        self.assertTrue(handler.queue.full())
+
+        started = time.monotonic()
+        handler.close()  # Не бросает queue.Full и не ждет весь вывод
+        self.assertLess(time.monotonic() - started, 2.0)
+        self.assertIsNone(handler.listener)
+        self.assertTrue(handler.target.closed)
+
+    def test_close_flushes_full_queue_in_time(self):
+        handler = AsyncQueueHandler(target='api.tests.SlowHandler', maxsize=5, delay=0.01)
+        for index in range(20):
+            handler.handle(self.make_record("Record %s", index))
+        handler.close()
+        self.assertEqual(len(handler.target.records) + handler.dropped, 20)
+        self.assertTrue(handler.target.closed)
+
+    def test_metrics_require_admin(self):
+        client = APIClient()
+        url = reverse('logging-metrics')
+        self.assertEqual(client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        client.force_authenticate(get_user_model()(username='admin', is_staff=True))
+        response = client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('handlers', response.json())
+
+
+
+class LedgerPostingTests(TestCase):
+    """Тесты проводок списаний и корректировок."""
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('ledger-postings')
+        self.org = Organization.objects.create(inn="1234567890", balance=100)
+        admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_authenticate(admin)
+
+    def posting(self, key, amount, operation_type='withdrawal', inn="1234567890"):
+        return {'idempotency_key': key, 'inn': inn, 'operation_type': operation_type, 'amount': amount}
+
+    def post(self, *postings):
+        return self.client.post(self.url, {'postings': list(postings)}, format='json')
+
+    def test_postings_applied_in_order(self):
+        response = self.post(
+            self.posting('w1', '60.00'),
+            self.posting('w2', '60.00'),  # Не хватает средств
+            self.posting('c1', '30.00', 'correction'),
+            self.posting('w3', '60.00'),  # После корректировки средств хватает
+            self.posting('w4', '1.00', inn='0000000000'),
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results],
+                         ['applied', 'rejected', 'applied', 'applied', 'rejected'])
+        self.assertEqual(results[1]['reason'], 'insufficient_funds')
+        self.assertEqual(results[4]['reason'], 'organization_not_found')
+
+        self.org.refresh_from_db()
+        self.assertEqual(float(self.org.balance), 10.00)
+        self.assertEqual(self.org.balance_logs.count(), 3)
+        self.assertEqual(
+            DailyTurnover.objects.get(operation_type='withdrawal').count, 2
+        )
+
+    def test_idempotency_key(self):
+        first = self.post(self.posting('w1', '40.00')).data['results'][0]
+        second = self.post(self.posting('w1', '40.00')).data['results'][0]
+        self.assertEqual(second['status'], 'duplicate')
+        self.assertEqual(second['balance_log_id'], first['balance_log_id'])
+
+        self.org.refresh_from_db()
+        self.assertEqual(float(self.org.balance), 60.00)
+
+    def test_invalid_postings(self):
+        self.assertEqual(self.post(self.posting('w1', '-5.00')).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            self.post(self.posting('k', '1.00'), self.posting('k', '2.00')).status_code,
+            status.HTTP_400_BAD_REQUEST
+        )
+
+    def test_invalid_inn(self):
+        for inn in ('12345abcde', '123456789', '１２３４５６７８９０'):
+            response = self.post(self.posting('w1', '1.00', inn=inn))
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('inn', response.data['postings'][0])
+
+    def test_max_batch_read_at_request_time(self):
+        postings = [self.posting(f'c{index}', '1.00', 'correction') for index in range(3)]
+        with override_settings(LEDGER_MAX_BATCH=2):
+            response = self.post(*postings)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('postings', response.data)
+        self.assertEqual(self.post(*postings).status_code, status.HTTP_200_OK)
+
+    def test_requires_admin(self):
+        self.client.force_authenticate(None)
+        self.assertIn(self.post(self.posting('w1', '1.00')).status_code,
+                      (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+
+
+# Проверка профиля api-only в отдельном процессе: загружает настройки,
+# маршруты, применяет миграции и выполняет вебхук и запрос баланса
+API_PROFILE_SCRIPT = """
+import json
+import sys
+
+import django
+
+HEAVY_MODULES = ('numpy', 'api.analytics', 'api.archive')
+
+
+def loaded():
+    return sorted(name for name in HEAVY_MODULES if name in sys.modules)
+
+
+django.setup()
+from django.core.management import call_command
+from django.test import Client
+from django.urls import Resolver404, resolve
+
+result = {'setup': loaded(), 'routes': {}}
+for url in ('/api/webhook/bank/', '/api/organizations/0123456789/balance/', '/admin/'):
+    try:
+        result['routes'][url] = resolve(url).url_name
+    except Resolver404:
+        result['routes'][url] = None
+result['urls'] = loaded()
+
+call_command('migrate', verbosity=0)
+client = Client()
+payment = {
+    'operation_id': '7c1f0e2a-3f4b-4e55-9a8e-6d1f2b3c4d5e',
+    'amount': '100.00',
+    'payer_inn': '0123456789',
+    'document_number': 'PAY-1',
+    'document_date': '2023-01-01T10:00:00Z',
+}
+# Второй вебхук - дубль
+for _ in range(2):
+    response = client.post('/api/webhook/bank/', payment, content_type='application/json')
+    result.setdefault('statuses', []).append(response.status_code)
+balance = client.get('/api/organizations/0123456789/balance/')
+result['statuses'].append(balance.status_code)
+result['balance'] = balance.json()['balance']
+result['requests'] = loaded()
+print(json.dumps(result))
+"""
+
+
+class ApiProfileTests(SimpleTestCase):
+    """Тесты облегченного профиля api-only (bank_webhooks.settings_api)."""
+    def run_profile(self, directory):
+        # Архив существует: проверка дублей вебхука идет по ключам ArchivedKey
+        archive_dir = os.path.join(directory, 'archive')
+        os.makedirs(archive_dir)
+        with open(os.path.join(archive_dir, 'archive.json'), 'w') as state_file:
+            json.dump({'format': 1, 'horizon': '2023-01-01T00:00:00+00:00'}, state_file)
+
+        # Окружение задается явно: профиль не зависит от SECRET_KEY и
+        # ALLOWED_HOSTS того, кто запускает тесты
+        env = dict(
+            os.environ,
+            SECRET_KEY='api-profile-test',
+            ALLOWED_HOSTS='testserver',
+            PROFILING_ENABLED='False',
+            DJANGO_SETTINGS_MODULE='bank_webhooks.settings_api',
+            DB_ENGINE='django.db.backends.sqlite3',
+            DB_NAME=os.path.join(directory, 'api.sqlite3'),
+            ARCHIVE_DIR=archive_dir,
+            PROFILING_OUTPUT_DIR=os.path.join(directory, 'profiles'),
+        )
+        process = subprocess.run(
+            [sys.executable, '-c', API_PROFILE_SCRIPT], cwd=settings.BASE_DIR, env=env,
+            capture_output=True, text=True, timeout=120,
+        )
+        self.assertEqual(process.returncode, 0, process.stderr)
+        return json.loads(process.stdout.strip().splitlines()[-1])
+
+    def test_routes_and_startup_imports(self):
+        with tempfile.TemporaryDirectory() as directory:
+            result = self.run_profile(directory)
+
+        self.assertEqual(result['routes'], {
+            '/api/webhook/bank/': 'bank-webhook',
+            '/api/organizations/0123456789/balance/': 'organization-balance',
+            '/admin/': None,
+        })
+        self.assertEqual(result['statuses'], [200, 200, 200])
+        self.assertEqual(result['balance'], 100.0)
+        # NumPy и архив не загружаются ни при старте, ни вебхуком и балансом
+        self.assertEqual(result['setup'], [])
+        self.assertEqual(result['urls'], [])
+        self.assertEqual(result['requests'], [])
+
+
+class EmbeddedSqliteTests(SimpleTestCase):
+    """Тесты настроенного бэкенда SQLite для встраиваемого режима."""
+    def make_connection(self, directory, **options):
+        handler = ConnectionHandler({
+            'default': {
+                'ENGINE': 'api.backends.sqlite3',
+                'NAME': os.path.join(directory, 'embedded.sqlite3'),
+                'OPTIONS': options,
+            }
+        })
+        return handler['default']
+
+    def test_pragmas_applied_on_connect(self):
+        with tempfile.TemporaryDirectory() as directory:
+            connection = self.make_connection(
+                directory, timeout=2, pragmas={'synchronous': 'NORMAL', 'cache_size': -1024}
+            )
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode")
+                self.assertEqual(cursor.fetchone()[0], 'wal')
+                cursor.execute("PRAGMA synchronous")
+                self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+                cursor.execute("PRAGMA cache_size")
+                self.assertEqual(cursor.fetchone()[0], -1024)
+                cursor.execute("PRAGMA busy_timeout")
+                self.assertEqual(cursor.fetchone()[0], 2000)
+            connection.close()
+
+    def test_atomic_begins_deferred_by_default(self):
+        with tempfile.TemporaryDirectory() as directory:
+            reader = self.make_connection(directory, timeout=0.1)
+            other = self.make_connection(directory, timeout=0.1)
+            # Обычная транзакция не занимает блокировку на запись
+            reader._start_transaction_under_autocommit()
+            other._start_transaction_under_autocommit()
+            reader.cursor().execute("COMMIT")
+            other.cursor().execute("COMMIT")
+            reader.close()
+            other.close()
+
+    def test_write_transaction_begins_immediate(self):
+        with tempfile.TemporaryDirectory() as directory:
+            writer = self.make_connection(directory, timeout=0.1)
+            other = self.make_connection(directory, timeout=0.1)
+            # Транзакция записи сразу берет блокировку, даже без изменений
+            writer.begin_immediate = True
+            writer._start_transaction_under_autocommit()
+            other.begin_immediate = True
+            with self.assertRaises(OperationalError):
+                other._start_transaction_under_autocommit()
+            writer.cursor().execute("COMMIT")
+            writer.close()
+            other.close()
+
+    def test_retry_on_busy(self):
+        calls = []
+
+        @retry_on_busy
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError("database is locked")
+            return 'ok'
+
+        self.assertEqual(flaky(), 'ok')
+        self.assertEqual(len(calls), 3)
+
+
+class PaymentAnalyticsTests(TestCase):
+    """Тесты векторизованной аналитики платежей."""
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('payment-analytics')
+        admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_authenticate(admin)
+        # Крупный плательщик и плательщик с ведущим нулем в ИНН
+        for index, amount in enumerate(['100.00', '200.00', '300.00', '0.01']):
+            self.create_payment('7700000001', amount, datetime(2024, 1, 10 + index, tzinfo=dt_timezone.utc))
+        self.create_payment('0123456789', '400.00', datetime(2024, 2, 1, tzinfo=dt_timezone.utc))
+
+    def create_payment(self, inn, amount, document_date):
+        Payment.objects.create(
+            operation_id=uuid.uuid4(), amount=amount, payer_inn=inn,
+            document_number='PAY-1', document_date=document_date,
+        )
+
+    def test_inn_codes_keep_leading_zeros(self):
+        codes = encode_inn(['0123456789', '123456789012'])
+        self.assertEqual([decode_inn(code) for code in codes], ['0123456789', '123456789012'])
+
+    def test_non_digit_inn_gets_invalid_code(self):
+        codes = encode_inn(['12345-6789', '1234567890', ''])
+        self.assertEqual(codes.tolist()[0], INVALID_INN)
+        self.assertEqual(codes.tolist()[2], INVALID_INN)
+        self.assertIsNone(decode_inn(codes[0]))
+        self.assertEqual(decode_inn(codes[1]), '1234567890')
+
+        # Строки, заведенные до проверки формата, не ломают аналитику
+        self.create_payment('12345-6789', Decimal('1.00'), datetime(2024, 3, 1, tzinfo=dt_timezone.utc))
+        result = payment_analytics()
+        self.assertEqual(result['payments'], 6)
+        self.assertIn(None, [payer['inn'] for payer in result['top_payers']])
+
+    def test_aggregates_do_not_depend_on_chunk_size(self):
+        result = payment_analytics(chunk_size=2)
+        self.assertEqual(result, payment_analytics(chunk_size=1000))
+
+        self.assertEqual(result['payments'], 5)
+        self.assertEqual(result['total'], Decimal('1000.01'))
+        self.assertEqual(result['concentration']['payers'], 2)
+        top = result['top_payers'][0]
+        self.assertEqual((top['inn'], top['count'], top['amount']), ('7700000001', 4, Decimal('600.01')))
+        self.assertEqual(sum(top['histogram']), 4)
+        self.assertEqual(result['top_payers'][1]['inn'], '0123456789')
+        # HHI = 0.6^2 + 0.4^2
+        self.assertAlmostEqual(result['concentration']['hhi'], 0.52, places=4)
+        self.assertEqual(
+            [(month['month'], month['count']) for month in result['monthly']],
+            [('2024-01', 4), ('2024-02', 1)]
+        )
+        # Перцентили по логарифмическим корзинам - с погрешностью 1%
+        self.assertAlmostEqual(float(result['amount_percentiles']['p50']), 200.00, delta=2.00)
+
+    def test_period_filter(self):
+        result = payment_analytics(date_from=datetime(2024, 2, 1).date(), date_to=datetime(2024, 2, 1).date())
+        self.assertEqual(result['payments'], 1)
+        self.assertEqual(result['total'], Decimal('400.00'))
+
+    def test_endpoint(self):
+        response = self.client.get(self.url, {'date_to': '2024-01-31', 'top': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['payments'], 4)
+        self.assertEqual(len(response.data['top_payers']), 1)
+
+        response = self.client.get(self.url, {'date_from': '2024-02-01', 'date_to': '2024-01-01'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.force_authenticate(None)
+        self.assertIn(self.client.get(self.url).status_code,
+                      (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('payment_analytics', chunk_size=3, stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['payments'], 5)
+
+
+class ArchiveTests(TestCase):
+    """Тесты колоночного архива холодной истории."""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        settings_override = override_settings(ARCHIVE_DIR=self.directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.inn = "0123456789"
+        self.operation_ids = [uuid.uuid4() for _ in range(3)]
+        # Два пополнения в январе 2023, одно в феврале и одно сейчас
+        for operation_id, amount, created_at in zip(
+            self.operation_ids + [uuid.uuid4()],
+            ['100.00', '50.25', '10.00', '1.00'],
+            [datetime(2023, 1, 5, tzinfo=dt_timezone.utc), datetime(2023, 1, 31, 23, 59, tzinfo=dt_timezone.utc),
+             datetime(2023, 2, 10, tzinfo=dt_timezone.utc), None],
+        ):
+            self.post_payment(operation_id, amount)
+            if created_at is not None:
+                Payment.objects.filter(operation_id=operation_id).update(created_at=created_at)
+                BalanceLog.objects.filter(payment__operation_id=operation_id).update(created_at=created_at)
+        # Списание с ключом идемпотентности и метаданными в феврале 2023
+        withdrawal = BalanceLog.objects.create(
+            organization_id=self.inn, amount='30.00', operation_type='withdrawal',
+            idempotency_key='wd-1', metadata={'reason': 'комиссия'},
+        )
+        BalanceLog.objects.filter(pk=withdrawal.pk).update(created_at=datetime(2023, 2, 20, tzinfo=dt_timezone.utc))
+        Organization.objects.filter(inn=self.inn).update(balance=Decimal('131.25'))
+
+    def post_payment(self, operation_id, amount):
+        return self.client.post(reverse('bank-webhook'), data={
+            "operation_id": str(operation_id),
+            "amount": amount,
+            "payer_inn": self.inn,
+            "document_number": "PAY-1",
+            "document_date": "2023-01-01T10:00:00Z"
+        }, format='json')
+
+    def archive(self):
+        return archive_history(month_start(datetime(2023, 3, 1).date()))
+
+    def test_export_segments_and_indexes(self):
+        self.assertEqual(self.archive(), {'payments': 3, 'balance_logs': 4})
+        archive = Archive(self.directory.name)
+        segments = archive.segments('payments')
+        self.assertEqual([segment.start.strftime('%Y-%m') for segment in segments], ['2023-01', '2023-02'])
+
+        january = segments[0]
+        self.assertEqual(january.inn_rows(self.inn), slice(0, 2))
+        self.assertEqual(january.inn_rows('1111111111'), slice(0, 0))
+        position = january.find_operation(self.operation_ids[1])
+        self.assertEqual(january.row(position)['amount'], Decimal('50.25'))
+        self.assertEqual(january.row(position)['payer_inn'], self.inn)
+        self.assertIsNone(january.find_operation(self.operation_ids[2]))
+        # Колонки - представления отображенных в память файлов, а не копии
+        self.assertIsInstance(january.array('amount').base, np.memmap)
+        self.assertFalse(january.array('amount').flags.writeable)
+
+        # Повторный запуск не выгружает уже архивированные месяцы
+        self.assertEqual(self.archive(), {'payments': 0, 'balance_logs': 0})
+
+    def test_leftover_segments_are_verified_before_horizon(self):
+        # Прерванный запуск: сегменты января записаны, горизонт не сдвинут,
+        # а после этого в январе появилась еще одна запись истории
+        start = month_start(datetime(2023, 1, 1).date())
+        for table in ('payments', 'balance_logs'):
+            write_segment(table, start, next_month(start), self.directory.name)
+        late = BalanceLog.objects.create(organization_id=self.inn, amount='5.00', operation_type='correction')
+        BalanceLog.objects.filter(pk=late.pk).update(created_at=datetime(2023, 1, 20, tzinfo=dt_timezone.utc))
+        # Сегмент платежей января поврежден
+        path = os.path.join(self.directory.name, 'payments', '2023-01', 'amount.bin')
+        with open(path, 'r+b') as column:
+            column.write(b'\xff')
+
+        # Оба сегмента января переписаны заново, февраль выгружен впервые
+        self.assertEqual(self.archive(), {'payments': 3, 'balance_logs': 5})
+        archive = Archive(self.directory.name)
+        self.assertEqual([segment.rows for segment in archive.segments('balance_logs')], [3, 2])
+        out = StringIO()
+        call_command('verify_archive', stdout=out)
+        self.assertIn("Verified 4 segments", out.getvalue())
+
+    def test_prune_skips_month_with_bad_segment(self):
+        self.archive()
+        path = os.path.join(self.directory.name, 'balance_logs', '2023-02', 'amount.bin')
+        with open(path, 'r+b') as column:
+            column.write(b'\xff')
+
+        with self.assertRaisesMessage(ArchiveError, 'balance_logs/2023-02'):
+            prune_archived()
+        # Январь удален, февраль с поврежденным сегментом остался в БД
+        remaining = BalanceLog.objects.filter(created_at__lt=datetime(2023, 3, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(remaining.count(), 2)
+        self.assertFalse(remaining.filter(created_at__lt=datetime(2023, 2, 1, tzinfo=dt_timezone.utc)).exists())
+
+    def test_non_digit_inn_is_not_archived(self):
+        # Строка, заведенная в обход вебхука, не может быть закодирована без потерь
+        payment = Payment.objects.create(
+            operation_id=uuid.uuid4(), amount='5.00', payer_inn='12345-6789',
+            document_number='PAY-2', document_date=datetime(2023, 1, 10, tzinfo=dt_timezone.utc),
+        )
+        Payment.objects.filter(pk=payment.pk).update(created_at=datetime(2023, 1, 10, tzinfo=dt_timezone.utc))
+        with self.assertRaisesMessage(ArchiveError, '12345-6789'):
+            self.archive()
+        self.assertIsNone(Archive(self.directory.name).horizon)
+
+    def test_verify_round_trip(self):
+        self.archive()
+        out = StringIO()
+        call_command('verify_archive', stdout=out)
+        self.assertIn("balance_logs/2023-02: 2 rows, 2 compared with the database, OK", out.getvalue())
+        self.assertIn("Verified 4 segments", out.getvalue())
+
+        # Порча файла обнаруживается по контрольной сумме
+        path = os.path.join(self.directory.name, 'balance_logs', '2023-02', 'amount.bin')
+        with open(path, 'r+b') as column:
+            column.write(b'\xff')
+        with self.assertRaises(CommandError):
+            call_command('verify_archive', table='balance_logs', month='2023-02', stdout=StringIO(), stderr=StringIO())
+
+    def test_history_and_balance_from_archive_after_prune(self):
+        self.archive()
+        self.assertEqual(prune_archived(), {'balance_logs': 4, 'payments': 3})
+        self.assertEqual(BalanceLog.objects.count(), 1)
+
+        # Баланс на начало февраля: 131.25 - 1.00 - (10.00 - 30.00)
+        self.assertEqual(balance_as_of(self.inn, datetime(2023, 2, 1, tzinfo=dt_timezone.utc)), Decimal('150.25'))
+        self.assertEqual(balance_as_of(self.inn, datetime(2023, 1, 1, tzinfo=dt_timezone.utc)), Decimal('0.00'))
+
+        admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_authenticate(admin)
+        response = self.client.get(reverse('organization-history', kwargs={'inn': self.inn}),
+                                   {'date_from': '2023-01-01', 'date_to': timezone.localdate().isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['opening_balance'], Decimal('0.00'))
+        self.assertEqual(response.data['closing_balance'], Decimal('131.25'))
+        entries = response.data['entries']
+        self.assertEqual([(entry['amount'], entry['archived']) for entry in entries],
+                         [('100.00', True), ('50.25', True), ('10.00', True), ('30.00', True), ('1.00', False)])
+        self.assertEqual(entries[3]['metadata'], {'reason': 'комиссия'})
+        self.assertEqual(entries[3]['idempotency_key'], 'wd-1')
+
+        response = self.client.get(reverse('organization-history', kwargs={'inn': self.inn}),
+                                   {'date_from': '2023-01-01', 'date_to': '2023-01-31', 'limit': 1})
+        self.assertEqual(len(response.data['entries']), 1)
+        self.assertTrue(response.data['truncated'])
+
+        # Повтор архивированного платежа - дубль, баланс не меняется
+        self.post_payment(self.operation_ids[0], '100.00')
+        self.assertEqual(Organization.objects.get(inn=self.inn).balance, Decimal('131.25'))
+
+    def test_rebuild_keeps_turnover_of_pruned_months(self):
+        call_command('rebuild_daily_turnover', workers=1, stdout=StringIO())
+        archived_days = list(
+            DailyTurnover.objects.filter(day__lt=datetime(2023, 3, 1).date())
+            .order_by('day', 'operation_type').values_list('day', 'operation_type', 'count', 'amount')
+        )
+        self.assertEqual(len(archived_days), 4)
+
+        self.archive()
+        prune_archived()
+        call_command('rebuild_daily_turnover', workers=1, stdout=StringIO())
+        # Явный date_from раньше горизонта тоже не трогает архивные дни
+        call_command('rebuild_daily_turnover', date_from=datetime(2023, 1, 1).date(), workers=1, stdout=StringIO())
+
+        self.assertEqual(list(
+            DailyTurnover.objects.filter(day__lt=datetime(2023, 3, 1).date())
+            .order_by('day', 'operation_type').values_list('day', 'operation_type', 'count', 'amount')
+        ), archived_days)
+        # Дни после горизонта пересчитываются как обычно
+        self.assertEqual(
+            DailyTurnover.objects.get(day=timezone.localdate(), operation_type='deposit').amount, Decimal('1.00'),
+        )
+
+    def test_history_reads_one_snapshot(self):
+        from . import archive
+
+        in_transaction = []
+
+        def balance_as_of(*args):
+            in_transaction.append(len(connection.savepoint_ids) > depth)
+            return original_balance_as_of(*args)
+
+        original_balance_as_of = archive.balance_as_of
+        # TestCase уже держит транзакцию: atomic() представления добавляет точку сохранения
+        depth = len(connection.savepoint_ids)
+        admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_authenticate(admin)
+        with mock.patch.object(archive, 'balance_as_of', balance_as_of):
+            response = self.client.get(reverse('organization-history', kwargs={'inn': self.inn}),
+                                       {'date_from': '2023-01-01', 'date_to': timezone.localdate().isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(in_transaction, [True, True])
+        entries_total = sum(
+            (-Decimal(entry['amount']) if entry['operation_type'] == 'withdrawal' else Decimal(entry['amount'])
+             for entry in response.data['entries']),
+            Decimal('0.00'),
+        )
+        self.assertEqual(response.data['opening_balance'] + entries_total, response.data['closing_balance'])
+
+    def test_history_requires_admin(self):
+        url = reverse('organization-history', kwargs={'inn': self.inn})
+        query = {'date_from': '2023-01-01', 'date_to': '2023-01-31'}
+        response = self.client.get(url, query)
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+        user = get_user_model().objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get(url, query).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_posting_replay_after_prune_is_duplicate(self):
+        withdrawal_id = BalanceLog.objects.get(idempotency_key='wd-1').pk
+        self.archive()
+        prune_archived()
+        self.assertFalse(BalanceLog.objects.filter(idempotency_key='wd-1').exists())
+
+        admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_authenticate(admin)
+        response = self.client.post(reverse('ledger-postings'), {'postings': [
+            {'idempotency_key': 'wd-1', 'inn': self.inn, 'operation_type': 'withdrawal', 'amount': '30.00'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            {'idempotency_key': 'wd-1', 'status': 'duplicate', 'balance_log_id': withdrawal_id},
+        ])
+        self.assertEqual(Organization.objects.get(inn=self.inn).balance, Decimal('131.25'))
+
@@ -1,5 +1,15 @@
 from django.urls import path
-from .views import BankWebhookView, OrganizationBalanceView
+from .views import (
+    BankWebhookView,
+    OrganizationBalanceView,
+    OrganizationTurnoverView,
+    OrganizationHistoryView,
+    LedgerPostingView,
+    AdmissionMetricsView,
+    LoggingMetricsView,
+    ProfilingView,
+    PaymentAnalyticsView,
+)
 
 # Определение URL-маршрутов (endpoints) API
 urlpatterns = [
@@ -15,4 +25,48 @@ urlpatterns = [
     path('organizations/<str:inn>/balance/',
          OrganizationBalanceView.as_view(),
          name='organization-balance'),
+
+    # Эндпоинт статистики оборотов организации за период
+    # Доступен по URL: /organizations/<ИНН>/turnover/?date_from=...&date_to=...
+    # Использует суточные агрегаты DailyTurnover
+    path('organizations/<str:inn>/turnover/',
+         OrganizationTurnoverView.as_view(),
+         name='organization-turnover'),
+
+    # Эндпоинт выписки по балансу: баланс на начало и конец периода и история
+    # Доступен по URL: /organizations/<ИНН>/history/?date_from=...&date_to=...
+    # Старые записи читаются из колоночного архива (ARCHIVE_DIR)
+    path('organizations/<str:inn>/history/',
+         OrganizationHistoryView.as_view(),
+         name='organization-history'),
+
+    # Эндпоинт проводок по балансу (списания и корректировки)
+    # Доступен по URL: /ledger/postings/
+    path('ledger/postings/',
+         LedgerPostingView.as_view(),
+         name='ledger-postings'),
+
+    # Метрики контроля допуска (лимиты, запросы в обработке, отказы)
+    # Доступен по URL: /metrics/admission/
+    path('metrics/admission/',
+         AdmissionMetricsView.as_view(),
+         name='admission-metrics'),
+
+    # Метрики асинхронного логирования (очередь, отброшенные записи)
+    # Доступен по URL: /metrics/logging/
+    path('metrics/logging/',
+         LoggingMetricsView.as_view(),
+         name='logging-metrics'),
+
+    # Управление профилировщиком запросов (только администраторы)
+    # Доступен по URL: /profiling/
+    path('profiling/',
+         ProfilingView.as_view(),
+         name='profiling'),
+
+    # Аналитика платежей: перцентили, концентрация плательщиков, гистограммы
+    # Доступен по URL: /analytics/payments/?date_from=...&date_to=...&top=...
+    path('analytics/payments/',
+         PaymentAnalyticsView.as_view(),
+         name='payment-analytics'),
          ]
\ No newline at end of file
@@ -1,10 +1,44 @@
 from rest_framework import status
 from rest_framework.response import Response
+from rest_framework.permissions import IsAdminUser
 from rest_framework.views import APIView
-from django.shortcuts import get_object_or_404
-from .models import Organization, Payment, BalanceLog
-from .serializers import WebhookSerializer, OrganizationBalanceSerializer
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_etags
+from .admission import get_controller
+from .aggregates import record_balance_log, turnover_totals
+from .archive_state import archive_horizon
+from .balance_changes import (
+    balance_state,
+    balance_etag,
+    notify_balance_changed,
+    wait_for_balance_change,
+)
+from .db import immediate_atomic, retry_on_busy
+from .ledger import apply_balance_change, post_entries
+from .log_handlers import logging_stats
+from .middleware import release_admission
+from .profiling import get_profiler
+from .models import ArchivedKey, Organization, Payment, BalanceLog
+from .serializers import (
+    WebhookSerializer,
+    OrganizationBalanceSerializer,
+    BalanceQuerySerializer,
+    TurnoverQuerySerializer,
+    TurnoverTotalSerializer,
+    TurnoverDaySerializer,
+    ProfilingConfigSerializer,
+    ProfilingDumpQuerySerializer,
+    PostingBatchSerializer,
+    PaymentAnalyticsQuerySerializer,
+    BalanceHistoryQuerySerializer,
+    BalanceHistoryEntrySerializer,
+)
 import logging
+from datetime import datetime, time, timedelta
 
 # Инициализация логгера для этого модуля
 logger = logging.getLogger(__name__)
@@ -25,52 +59,297 @@ class BankWebhookView(APIView):
         amount = data['amount']              # Сумма платежа
         payer_inn = data['payer_inn']        # ИНН плательщика
 
-        # Проверка на дубликат платежа (по operation_id)
-        if Payment.objects.filter(operation_id=operation_id).exists():
-            logger.info(f"Duplicate payment with operation_id: {operation_id}")
+        # Проверка на дубликат платежа (по operation_id), в том числе среди
+        # платежей, удаленных из БД после выгрузки в архив: их ключи ищутся,
+        # только если архив есть (горизонт читается без загрузки архива)
+        if Payment.objects.filter(operation_id=operation_id).exists() or (
+            archive_horizon() is not None
+            and ArchivedKey.objects.filter(kind=ArchivedKey.Kind.OPERATION_ID, key=str(operation_id)).exists()
+        ):
+            logger.info(
+                "Duplicate payment with operation_id: %s", operation_id,
+                extra={'operation_id': operation_id}
+            )
             return Response(status=status.HTTP_200_OK)
 
-        # Получаем организацию по ИНН или создаем новую с нулевым балансом
-        organization, created = Organization.objects.get_or_create(
-            inn=payer_inn,
-            defaults={'balance': 0}
-        )
-
-        # Создаем запись о платеже в базе данных
-        payment = Payment.objects.create(**data)
-
-        # Обновляем баланс организации (увеличиваем на сумму платежа)
-        organization.balance += amount
-        organization.save()
-
-        # Логируем изменение баланса в отдельной таблице истории
-        BalanceLog.objects.create(
-            organization=organization,
-            amount=amount,
-            operation_type='deposit',  # Тип операции - пополнение
-            payment=payment             # Связь с платежом
-        )
+        # Платеж, баланс, история и суточные агрегаты пишутся одной транзакцией
+        balance = self.save_payment(data)
 
         # Записываем в лог информацию об успешной обработке
+        # Аргументы подставляются в фоновом потоке логирования, а не здесь
         logger.info(
-            f"Processed payment {operation_id}. "
-            f"New balance for {payer_inn}: {organization.balance}"
+            "Processed payment %s. New balance for %s: %s",
+            operation_id, payer_inn, balance,
+            extra={'operation_id': operation_id, 'inn': payer_inn, 'amount': amount}
         )
 
         # Возвращаем успешный статус (без данных)
         return Response(status=status.HTTP_200_OK)
 
+    @retry_on_busy
+    def save_payment(self, data):
+        """
+        Сохраняет платеж и пополняет баланс в одной транзакции.
+        При занятой блокировке SQLite транзакция повторяется целиком.
+
+        Returns:
+            Decimal: Баланс организации после пополнения
+        """
+        payer_inn = data['payer_inn']
+        amount = data['amount']
+
+        with immediate_atomic():
+            # Получаем организацию по ИНН или создаем новую с нулевым балансом
+            organization, created = Organization.objects.get_or_create(
+                inn=payer_inn,
+                defaults={'balance': 0}
+            )
+
+            # Создаем запись о платеже в базе данных
+            payment = Payment.objects.create(**data)
+
+            # Обновляем баланс организации (увеличиваем на сумму платежа)
+            # атомарным UPDATE, чтобы не затереть параллельные списания
+            apply_balance_change(payer_inn, amount)
+            organization.refresh_from_db(fields=['balance'])
+
+            # Логируем изменение баланса в отдельной таблице истории
+            balance_log = BalanceLog.objects.create(
+                organization=organization,
+                amount=amount,
+                operation_type='deposit',  # Тип операции - пополнение
+                payment=payment             # Связь с платежом
+            )
+
+            # Обновляем суточный агрегат оборотов
+            record_balance_log(balance_log)
+
+            # После фиксации будим ожидающие опросы баланса (?wait=)
+            transaction.on_commit(notify_balance_changed)
+
+        return organization.balance
+
 
 class OrganizationBalanceView(APIView):
     """
     API-эндпоинт для получения текущего баланса организации по её ИНН.
+
+    Поддерживает условные запросы: отдает ETag (версия баланса и время
+    изменения) и Last-Modified, а на If-None-Match / If-Modified-Since
+    с актуальными значениями отвечает 304 Not Modified. С параметром
+    ?wait=N запрос с актуальным ETag ждет до N секунд изменения баланса
+    вместо немедленного 304.
+    """
+    def get(self, request, inn):
+        query = BalanceQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        wait = query.validated_data['wait']
+
+        # Одна выборка по первичному ключу - и для 304, и для ответа с данными
+        state = balance_state(inn)
+        if state is None:
+            raise Http404
+
+        known_etags = parse_etags(request.headers.get('If-None-Match', ''))
+        if wait and balance_etag(state) in known_etags:
+            # Клиент знает актуальную версию - ждем изменения (long polling),
+            # не занимая слот контроля допуска и соединение с БД
+            release_admission(request)
+            state = wait_for_balance_change(state, known_etags, timeout=wait)
+            if state is None:
+                raise Http404
+
+        etag = balance_etag(state)
+        last_modified = int(state['updated_at'].timestamp())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            # Сериализуем данные организации (только ИНН и баланс)
+            response = Response(OrganizationBalanceSerializer(state).data)
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        # Клиент может кэшировать ответ, но обязан его перепроверять
+        patch_cache_control(response, no_cache=True)
+        return response
+
+
+class OrganizationTurnoverView(APIView):
+    """
+    API-эндпоинт статистики оборотов организации за период.
+    Отдает итоги из суточных агрегатов, не сканируя историю платежей.
     """
     def get(self, request, inn):
-        # Получаем организацию по ИНН или возвращаем 404
-        organization = get_object_or_404(Organization, inn=inn)
-        
-        # Сериализуем данные организации (только ИНН и баланс)
-        serializer = OrganizationBalanceSerializer(organization)
-        
-        # Возвращаем данные организации
-        return Response(serializer.data)
\ No newline at end of file
+        # Валидация параметров периода
+        query = TurnoverQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        # Проверяем существование организации (поиск по первичному ключу)
+        if not Organization.objects.filter(inn=inn).exists():
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        result = turnover_totals(
+            organization_id=inn,
+            date_from=params['date_from'],
+            date_to=params['date_to'],
+            operation_type=params.get('operation_type'),
+        )
+
+        return Response({
+            'inn': inn,
+            'date_from': params['date_from'],
+            'date_to': params['date_to'],
+            'totals': TurnoverTotalSerializer(result['totals'], many=True).data,
+            'days': TurnoverDaySerializer(result['days'], many=True).data,
+        })
+
+
+class OrganizationHistoryView(APIView):
+    """
+    API-эндпоинт выписки по балансу организации за период:
+    баланс на начало и конец периода и записи истории изменений.
+    Записи старше горизонта архива читаются из колоночного архива, а не из БД.
+    Доступна только администраторам: записи содержат metadata и ключи
+    идемпотентности проводок.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, inn):
+        query = BalanceHistoryQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        from .archive import balance_as_of, balance_history
+
+        # Период в днях (включительно) -> полуинтервал моментов времени
+        start = timezone.make_aware(datetime.combine(params['date_from'], time.min))
+        end = timezone.make_aware(datetime.combine(params['date_to'] + timedelta(days=1), time.min))
+
+        # Баланс и история читаются в одной транзакции чтения (один снимок БД:
+        # REPEATABLE READ на MySQL; на SQLite atomic() - BEGIN DEFERRED и
+        # блокировку записи не берет, см. api.db.immediate_atomic)
+        with transaction.atomic():
+            opening_balance = balance_as_of(inn, start)
+            if opening_balance is None:
+                return Response(status=status.HTTP_404_NOT_FOUND)
+            closing_balance = balance_as_of(inn, end)
+            entries, truncated = balance_history(inn, start, end, params['limit'])
+
+        return Response({
+            'inn': inn,
+            'date_from': params['date_from'],
+            'date_to': params['date_to'],
+            'opening_balance': opening_balance,
+            'closing_balance': closing_balance,
+            'entries': BalanceHistoryEntrySerializer(entries, many=True).data,
+            'truncated': truncated,  # Записей больше, чем limit
+        })
+
+
+class LedgerPostingView(APIView):
+    """
+    API-эндпоинт проводок по балансу: списаний и корректировок.
+    Принимает пачку проводок и применяет их по порядку; повтор проводки
+    с тем же ключом идемпотентности не меняет баланс.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        serializer = PostingBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        results = post_entries(serializer.validated_data['postings'])
+
+        # Результат по каждой проводке: applied / duplicate / rejected
+        return Response({'results': results})
+
+
+class AdmissionMetricsView(APIView):
+    """
+    API-эндпоинт метрик контроля допуска текущего процесса (только для
+    администраторов): адаптивные пороги, число запросов в обработке и
+    счетчики отказов.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(get_controller().snapshot())
+
+
+class ProfilingView(APIView):
+    """
+    API-эндпоинт управления профилировщиком (только для администраторов).
+    GET возвращает состояние, POST меняет настройки без перезапуска для
+    всех воркеров с общим PROFILING['OUTPUT_DIR'] и по флагу dump
+    запрашивает выгрузку стеков у всех воркеров (номер в поле dump).
+    GET ?dump=<номер> сводит выгруженные к этому моменту стеки в один
+    профиль на view и возвращает, какие процессы в нем учтены.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        query = ProfilingDumpQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        profiler = get_profiler()
+        profiler.sync()
+        if 'dump' in query.validated_data:
+            dump_id = query.validated_data['dump']
+            return Response({'dump': dump_id, **profiler.merge_dump(dump_id)})
+        return Response(profiler.snapshot())
+
+    def post(self, request):
+        serializer = ProfilingConfigSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        profiler = get_profiler()
+        changes = {
+            key.upper(): value for key, value in data.items() if key != 'dump'
+        }
+        if changes:
+            profiler.configure(**changes)
+            profiler.publish()
+
+        result = profiler.snapshot()
+        if data['dump']:
+            # Остальные воркеры выгрузят свои стеки в тот же каталог при sync()
+            result['dump'] = profiler.request_dump()
+            result['files'] = profiler.dump(profiler.dump_dir(result['dump']))
+        return Response(result)
+
+
+class LoggingMetricsView(APIView):
+    """
+    API-эндпоинт метрик асинхронного логирования текущего процесса
+    (только для администраторов): заполненность очередей и число
+    отброшенных записей.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({'handlers': logging_stats()})
+
+
+class PaymentAnalyticsView(APIView):
+    """
+    API-эндпоинт аналитики платежей (только для администраторов):
+    перцентили сумм, концентрация плательщиков, гистограммы крупнейших
+    плательщиков и помесячный оборот за период.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        query = PaymentAnalyticsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        # NumPy импортируется только при первом запросе аналитики,
+        # а не при старте каждого воркера
+        from .analytics import payment_analytics
+
+        return Response(payment_analytics(
+            date_from=params.get('date_from'),
+            date_to=params.get('date_to'),
+            chunk_size=settings.ANALYTICS_CHUNK_SIZE,
+            top=params['top'],
+        ))
@@ -35,6 +35,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Профилирование включается во время работы, выключенное почти бесплатно
+    'api.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -42,6 +44,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Контроль допуска и сброс нагрузки для вебхука и опроса баланса (последним)
+    'api.middleware.AdmissionControlMiddleware',
 ]
 
 ROOT_URLCONF = 'bank_webhooks.urls'
@@ -85,11 +89,107 @@ DATABASES = {
     }
 }
 
+# Embedded mode for single-node/edge deployments: DB_ENGINE=api.backends.sqlite3
+# (WAL journal, tuned pragmas, BEGIN IMMEDIATE for write transactions opened
+# via api.db.immediate_atomic(); other transactions use transaction_mode)
+
+if DATABASES['default']['ENGINE'] == 'api.backends.sqlite3':
+    DATABASES['default'].update({
+        'NAME': os.getenv('DB_NAME') or BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Сколько писатель ждет блокировку, прежде чем получить "database is locked"
+            'timeout': float(os.getenv('SQLITE_BUSY_TIMEOUT', 5)),
+            'transaction_mode': 'DEFERRED',
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+                'cache_size': -int(os.getenv('SQLITE_CACHE_SIZE_KB', 65536)),
+                'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 268435456)),
+            },
+        },
+    })
+
+# Retries of a whole write transaction when SQLite stays locked past the busy timeout
+
+DB_BUSY_RETRIES = int(os.getenv('DB_BUSY_RETRIES', 3))
+DB_BUSY_BACKOFF = float(os.getenv('DB_BUSY_BACKOFF', 0.05))
+
+# Adaptive admission control for the webhook and balance endpoints
+# (see api/admission.py for the full list of options and defaults)
+
+ADMISSION_CONTROL = {
+    'ENABLED': os.getenv('ADMISSION_CONTROL_ENABLED', 'True') == 'True',
+    'INITIAL_LIMIT': int(os.getenv('ADMISSION_INITIAL_LIMIT', 32)),
+    'MAX_LIMIT': int(os.getenv('ADMISSION_MAX_LIMIT', 256)),
+    'SOURCE_RATE': float(os.getenv('ADMISSION_SOURCE_RATE', 50)),
+    'SOURCE_BURST': float(os.getenv('ADMISSION_SOURCE_BURST', 100)),
+    # Per-source rate for webhooks and postings; unset - not rate limited per source
+    'CRITICAL_SOURCE_RATE': float(os.environ['ADMISSION_CRITICAL_SOURCE_RATE'])
+    if os.getenv('ADMISSION_CRITICAL_SOURCE_RATE') else None,
+    'CRITICAL_SOURCE_BURST': float(os.environ['ADMISSION_CRITICAL_SOURCE_BURST'])
+    if os.getenv('ADMISSION_CRITICAL_SOURCE_BURST') else None,
+    'SOURCE_HEADER': os.getenv('ADMISSION_SOURCE_HEADER', 'REMOTE_ADDR'),
+}
+
+# Longest allowed ?wait= for balance long polling (seconds); a waiting
+# request releases its admission slot and DB connection but still holds a
+# worker thread, keep it below the proxy read timeout
+
+BALANCE_MAX_WAIT = int(os.getenv('BALANCE_MAX_WAIT', 25))
+
+# How often one watcher thread per process checks the balances that waiting
+# requests are interested in, with one query for all of them (seconds);
+# changes made in the same process wake waiters immediately
+
+BALANCE_POLL_INTERVAL = float(os.getenv('BALANCE_POLL_INTERVAL', 3))
+
+# Largest number of postings accepted by one /api/ledger/postings/ call
+
+LEDGER_MAX_BATCH = int(os.getenv('LEDGER_MAX_BATCH', 1000))
+
+# Number of payments loaded per chunk by payment analytics; bounds the
+# memory of /api/analytics/payments/ and the payment_analytics command
+
+ANALYTICS_CHUNK_SIZE = int(os.getenv('ANALYTICS_CHUNK_SIZE', 50000))
+
+# Columnar archive of cold Payment/BalanceLog months (see api/archive.py);
+# must be shared by all web workers and the archive_history command
+
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive'))
+
+# On-demand sampling profiler (can also be switched at runtime via /api/profiling/)
+
+PROFILING = {
+    'ENABLED': os.getenv('PROFILING_ENABLED', 'False') == 'True',
+    'EVERY_N': int(os.getenv('PROFILING_EVERY_N', 100)),
+    'URL_NAMES': [name for name in os.getenv('PROFILING_URL_NAMES', '').split(' ') if name],
+    'OUTPUT_DIR': os.getenv('PROFILING_OUTPUT_DIR', os.path.join(BASE_DIR, 'profiles')),
+    # Deploy id (e.g. release tag): runtime switches from an older deploy are ignored
+    'GENERATION': os.getenv('PROFILING_GENERATION') or None,
+}
+
+# Logs are handed to a background thread through a bounded queue and written
+# as JSON lines; when the queue is full records are dropped and counted
+# (see /api/metrics/logging/). Set LOG_ASYNC=False for synchronous output.
+
+LOG_ASYNC = os.getenv('LOG_ASYNC', 'True') == 'True'
+
 LOGGING = {
     'version': 1,
+    'formatters': {
+        'json': {
+            '()': 'api.log_handlers.JsonFormatter',
+        },
+    },
     'handlers': {
         'console': {
+            '()': 'api.log_handlers.AsyncQueueHandler',
+            'target': 'logging.StreamHandler',
+            'maxsize': int(os.getenv('LOG_QUEUE_SIZE', 10000)),
+            'formatter': 'json',
+        } if LOG_ASYNC else {
             'class': 'logging.StreamHandler',
+            'formatter': 'json',
         },
     },
     'loggers': {
@@ -99,7 +199,7 @@ LOGGING = {
         },
         'api': {
             'handlers': ['console'],
-            'level': os.getenv('APP_LOG_LEVEL', 'DEBUG'),
+            'level': os.getenv('APP_LOG_LEVEL', 'INFO'),
         },
     },
 }
@@ -0,0 +1,49 @@
+"""
+API-only settings profile for bank_webhooks project.
+
+Serves only the machine-to-machine endpoints (bank-webhook,
+organization-balance and the rest of api.urls): no admin, sessions,
+CSRF, auth, messages, templates or static files, and DRF works with
+JSON only and without authentication. Select it with
+DJANGO_SETTINGS_MODULE=bank_webhooks.settings_api or use the
+bank_webhooks.wsgi_api / bank_webhooks.asgi_api entry points.
+
+Migrations and the admin site are still run with the full profile
+(bank_webhooks.settings).
+"""
+
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'api',
+]
+
+MIDDLEWARE = [
+    'api.middleware.ProfilingMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'api.middleware.AdmissionControlMiddleware',
+]
+
+ROOT_URLCONF = 'bank_webhooks.urls_api'
+
+WSGI_APPLICATION = 'bank_webhooks.wsgi_api.application'
+
+TEMPLATES = []
+
+# No static files are served by this profile
+STATIC_URL = None
+
+STATICFILES_DIRS = []
+
+AUTH_PASSWORD_VALIDATORS = []
+
+# Minimal DRF stack: no authentication (and no django.contrib.auth import),
+# JSON in and out only
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.AllowAny'],
+    'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer'],
+    'DEFAULT_PARSER_CLASSES': ['rest_framework.parsers.JSONParser'],
+    'UNAUTHENTICATED_USER': None,
+}
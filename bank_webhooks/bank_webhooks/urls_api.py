@@ -0,0 +1,8 @@
+"""
+URL configuration for the API-only settings profile (no admin site).
+"""
+from django.urls import path, include
+
+urlpatterns = [
+    path('api/', include('api.urls'))
+]
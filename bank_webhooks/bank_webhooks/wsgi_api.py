@@ -0,0 +1,17 @@
+"""
+WSGI config for the API-only profile of bank_webhooks project.
+
+It exposes the WSGI callable as a module-level variable named ``application``
+using bank_webhooks.settings_api (webhook and balance endpoints only).
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/wsgi/
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bank_webhooks.settings_api')
+
+application = get_wsgi_application()
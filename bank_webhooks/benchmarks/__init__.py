@@ -0,0 +1,51 @@
+"""
+Бенчмарки сервиса.
+
+Запускаются из каталога bank_webhooks как модули, например:
+
+    python -m benchmarks.bench_profiling
+
+По умолчанию работают с SQLite в памяти, поэтому не требуют MySQL
+и переменных окружения из .env.
+"""
+import os
+import time
+
+
+def setup_django(**environ):
+    """
+    Настраивает Django для бенчмарка и создает схему БД.
+
+    Args:
+        **environ: Переменные окружения, переопределяющие значения по умолчанию
+    """
+    defaults = {
+        'DJANGO_SETTINGS_MODULE': 'bank_webhooks.settings',
+        'SECRET_KEY': 'benchmark',
+        'ALLOWED_HOSTS': '*',
+        'DB_ENGINE': 'django.db.backends.sqlite3',
+        'DB_NAME': ':memory:',
+        'APP_LOG_LEVEL': 'WARNING',
+        'ADMISSION_CONTROL_ENABLED': 'False',
+    }
+    for key, value in {**defaults, **environ}.items():
+        os.environ.setdefault(key, value)
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command('migrate', verbosity=0)
+
+
+def timeit(func, iterations):
+    """
+    Замеряет среднее время одного вызова функции.
+
+    Returns:
+        float: Среднее время вызова в секундах
+    """
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations
@@ -0,0 +1,152 @@
+"""
+Аналитика платежей: векторизованный расчет против цикла по объектам ORM.
+
+Генерирует платежи во временной БД SQLite и считает одни и те же
+агрегаты (итог, перцентили сумм, доли и гистограммы плательщиков,
+помесячный оборот) двумя способами:
+
+- orm: перебор Payment.objects.iterator() с накоплением в словарях и
+  сортировкой всех сумм для перцентилей;
+- numpy: api.analytics.payment_analytics - порции values_list в колонках
+  NumPy и группировки bincount / np.unique.
+
+Печатает время и пик памяти (tracemalloc) каждого способа и проверяет,
+что итоги совпадают.
+
+    python -m benchmarks.bench_analytics [--payments N] [--payers N] [--chunk-size N]
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from benchmarks import setup_django
+
+
+def generate(payments, payers):
+    """Создает платежи с суммами от 1 до 100 000 рублей за последние два года"""
+    import random
+
+    from api.models import Payment
+
+    generator = random.Random(42)
+    now = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    inns = [f"{7700000000 + index}" for index in range(payers)]
+    batch = []
+    for index in range(payments):
+        batch.append(Payment(
+            operation_id=uuid.uuid4(),
+            amount=Decimal(generator.randint(100, 10_000_000)).scaleb(-2),
+            # Несколько крупных плательщиков дают большую часть платежей
+            payer_inn=inns[min(int(generator.paretovariate(1.2)) - 1, payers - 1)],
+            document_number=f"PAY-{index}",
+            document_date=now - timedelta(minutes=generator.randint(0, 2 * 365 * 24 * 60)),
+        ))
+        if len(batch) == 5000:
+            Payment.objects.bulk_create(batch)
+            batch = []
+    Payment.objects.bulk_create(batch)
+
+
+def orm_analytics(top=20):
+    """Те же агрегаты наивным перебором объектов модели"""
+    from api.models import Payment
+
+    amounts = []
+    payer_sums = defaultdict(Decimal)
+    payer_counts = defaultdict(int)
+    months = defaultdict(lambda: [0, Decimal(0)])
+    for payment in Payment.objects.order_by('pk').iterator():
+        amounts.append(payment.amount)
+        payer_sums[payment.payer_inn] += payment.amount
+        payer_counts[payment.payer_inn] += 1
+        month = months[payment.document_date.strftime('%Y-%m')]
+        month[0] += 1
+        month[1] += payment.amount
+
+    total = sum(amounts, Decimal(0))
+    amounts.sort()
+    ranked = sorted(payer_sums.items(), key=lambda item: item[1], reverse=True)
+    return {
+        'payments': len(amounts),
+        'total': total,
+        'amount_percentiles': {
+            f"p{percentile}": amounts[max(0, -(-len(amounts) * percentile // 100) - 1)]
+            for percentile in (50, 90, 95, 99)
+        },
+        'hhi': float(sum((amount / total) ** 2 for amount in payer_sums.values())),
+        'top_payers': [(inn, payer_counts[inn], amount) for inn, amount in ranked[:top]],
+        'monthly': sorted(months.items()),
+    }
+
+
+def measure(func):
+    """
+    Returns:
+        tuple: (результат, время в секундах, пик памяти в байтах)
+    """
+    gc.collect()
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--payments', type=int, default=200_000)
+    parser.add_argument('--payers', type=int, default=5_000)
+    parser.add_argument('--chunk-size', type=int, default=10_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(DB_NAME=os.path.join(directory, 'bench.sqlite3'))
+        generate(args.payments, args.payers)
+
+        from api.analytics import payment_analytics
+
+        orm, orm_time, orm_peak = measure(orm_analytics)
+        vectorized, numpy_time, numpy_peak = measure(
+            lambda: payment_analytics(chunk_size=args.chunk_size)
+        )
+
+    print(f"payments: {args.payments}, payers: {args.payers}, chunk size: {args.chunk_size}")
+    print(f"{'method':<8} {'time':>9} {'peak memory':>12}")
+    print(f"{'orm':<8} {orm_time:8.2f}s {orm_peak / 2 ** 20:10.1f}MB")
+    print(f"{'numpy':<8} {numpy_time:8.2f}s {numpy_peak / 2 ** 20:10.1f}MB")
+    print(f"speedup: {orm_time / numpy_time:.1f}x, memory: {orm_peak / numpy_peak:.1f}x less")
+
+    # Точные агрегаты должны совпасть, перцентили - в пределах 1%
+    failed = (
+        vectorized['payments'] != orm['payments']
+        or vectorized['total'] != orm['total']
+        or abs(vectorized['concentration']['hhi'] - orm['hhi']) > 1e-9
+        or [(payer['inn'], payer['count'], payer['amount']) for payer in vectorized['top_payers']]
+        != orm['top_payers']
+        or [(month['month'], [month['count'], month['amount']]) for month in vectorized['monthly']]
+        != orm['monthly']
+        or any(
+            abs(vectorized['amount_percentiles'][key] - value) > value * Decimal('0.0101')
+            for key, value in orm['amount_percentiles'].items()
+        )
+    )
+    if failed:
+        print("FAIL: vectorized aggregates differ from the ORM reference")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+Колоночный архив: выгрузка, скорость сканирования и резидентная память.
+
+Генерирует платежи и историю баланса за два года во временной БД SQLite,
+выгружает все месяцы, кроме последнего, в архив (api.archive) и сравнивает:
+
+- полное сканирование истории (сумма по всем записям):
+  агрегат в БД против векторного прохода по отображенным колонкам;
+- изменения баланса одной организации с даты двухлетней давности и
+  баланс на эту дату (balance_as_of): по горячей таблице против архива
+  после удаления строк из БД.
+
+Резидентная память (RSS из /proc/self/statm) замеряется до и после
+сканирования: страницы отображенных файлов принадлежат кэшу ОС и
+вытесняются им без записи в swap, а запрос по одной организации
+подгружает только свой срез колонок.
+
+    python -m benchmarks.bench_archive [--payments N] [--payers N]
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from benchmarks import setup_django, timeit
+
+
+def rss():
+    """Текущая резидентная память процесса в байтах"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Не Linux: доступен только пик
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def generate(payments, payers, now):
+    """Платежи и записи истории с created_at, равномерно распределенным за два года"""
+    from django.db.models import F, OuterRef, Subquery
+
+    from api.models import BalanceLog, Organization, Payment
+
+    generator = random.Random(42)
+    inns = [f"{7700000000 + index}" for index in range(payers)]
+    Organization.objects.bulk_create([Organization(inn=inn, balance=0) for inn in inns])
+    for start in range(0, payments, 5000):
+        batch = [
+            Payment(
+                operation_id=uuid.uuid4(),
+                amount=Decimal(generator.randint(100, 10_000_000)).scaleb(-2),
+                payer_inn=generator.choice(inns),
+                document_number=f"PAY-{index}",
+                document_date=now - timedelta(minutes=generator.randint(0, 2 * 365 * 24 * 60)),
+            )
+            for index in range(start, min(start + 5000, payments))
+        ]
+        Payment.objects.bulk_create(batch)
+        BalanceLog.objects.bulk_create([
+            BalanceLog(organization_id=payment.payer_inn, amount=payment.amount, payment=payment)
+            for payment in batch
+        ])
+    # auto_now_add не дает задать created_at при создании - сдвигаем в прошлое
+    Payment.objects.update(created_at=F('document_date'))
+    BalanceLog.objects.update(created_at=Subquery(
+        Payment.objects.filter(pk=OuterRef('payment_id')).values('document_date')[:1]
+    ))
+    for inn in inns:
+        total = BalanceLog.objects.filter(organization_id=inn).values_list('amount', flat=True)
+        Organization.objects.filter(inn=inn).update(balance=sum(total, Decimal(0)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--payments', type=int, default=200_000)
+    parser.add_argument('--payers', type=int, default=2_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        archive_dir = os.path.join(directory, 'archive')
+        setup_django(DB_NAME=os.path.join(directory, 'bench.sqlite3'), ARCHIVE_DIR=archive_dir)
+        return run(args, archive_dir)
+
+
+def run(args, archive_dir):
+    from django.db.models import Sum
+
+    from api.archive import (
+        BALANCE_LOGS, archive_history, balance_as_of, get_archive, month_start, prune_archived,
+    )
+    from api.models import BalanceLog
+
+    now = datetime(2024, 6, 15, tzinfo=timezone.utc)
+    generate(args.payments, args.payers, now)
+    inn = '7700000000'
+    moment = now - timedelta(days=700)
+
+    db_scan = timeit(lambda: BalanceLog.objects.aggregate(total=Sum('amount')), 3)
+    db_as_of = timeit(lambda: balance_as_of(inn, moment), 20)
+    db_delta = timeit(
+        lambda: BalanceLog.objects.filter(organization_id=inn, created_at__gt=moment).aggregate(Sum('amount')), 20
+    )
+    expected_as_of = balance_as_of(inn, moment)
+
+    started = time.perf_counter()
+    exported = archive_history(month_start(now.date()))
+    export_time = time.perf_counter() - started
+    pruned = prune_archived(batch_size=5000)
+    archived_rows = exported[BALANCE_LOGS]
+    size = sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(archive_dir) for name in names
+    )
+
+    segments = get_archive().segments(BALANCE_LOGS)
+
+    def archive_scan():
+        # Векторный проход по всем сегментам: срезы memmap без копирования
+        return sum(int(segment.array('amount').sum()) for segment in segments)
+
+    before = rss()
+    archive_scan_time = timeit(archive_scan, 3)
+    scan_rss = rss() - before
+    scanned_bytes = sum(segment.array('amount').nbytes for segment in segments)
+
+    archive_as_of = timeit(lambda: balance_as_of(inn, moment), 20)
+    archive_delta = timeit(lambda: get_archive().balance_delta(inn, moment), 20)
+    actual_as_of = balance_as_of(inn, moment)
+
+    print(f"payments: {args.payments}, payers: {args.payers}, archived months: {len(segments)}")
+    print(f"export:   {archived_rows} balance logs + {exported['payments']} payments in {export_time:.1f}s, "
+          f"{size / 2 ** 20:.1f}MB on disk, pruned {sum(pruned.values())} rows")
+    print(f"{'query':<28} {'database':>12} {'archive':>12}")
+    print(f"{'full history scan':<28} {db_scan * 1e3:10.1f}ms {archive_scan_time * 1e3:10.1f}ms"
+          f"  ({archived_rows / archive_scan_time / 1e6:.0f}M rows/s, "
+          f"{scanned_bytes / archive_scan_time / 2 ** 30:.1f}GB/s)")
+    print(f"{'one INN changes since date':<28} {db_delta * 1e3:10.2f}ms {archive_delta * 1e3:10.2f}ms")
+    print(f"{'balance as of 700 days ago':<28} {db_as_of * 1e3:10.2f}ms {archive_as_of * 1e3:10.2f}ms"
+          f"  (both include ORM queries for the balance and recent history)")
+    print(f"rss growth after full scan: {scan_rss / 2 ** 20:.1f}MB "
+          f"(mapped amount columns: {scanned_bytes / 2 ** 20:.1f}MB)")
+
+    failed = actual_as_of != expected_as_of
+    if failed:
+        print(f"FAIL: balance as of {moment} from archive {actual_as_of} != database {expected_as_of}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Конкурентные списания по одной "горячей" организации.
+
+Несколько потоков одновременно проводят пачки списаний через
+api.ledger.post_entries, суммарно запрашивая больше, чем есть на балансе.
+Проверяет, что баланс не уходит в минус и сходится с историей, и
+печатает пропускную способность.
+
+По умолчанию работает с временной БД SQLite; для замера на MySQL
+задайте DB_ENGINE/DB_NAME/DB_USER/... в окружении.
+
+    python -m benchmarks.bench_ledger [--threads N] [--postings N] [--batch N]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+from benchmarks import setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--postings', type=int, default=250, help="Postings per thread")
+    parser.add_argument('--batch', type=int, default=25, help="Postings per post_entries call")
+    parser.add_argument('--amount', type=Decimal, default=Decimal('1.00'))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(DB_NAME=os.path.join(directory, 'bench.sqlite3'))
+        return run(args)
+
+
+def run(args):
+
+    from django.db import connections
+
+    from api.ledger import APPLIED, post_entries
+    from api.models import BalanceLog, Organization
+
+    inn = '1234567890'
+    attempted = args.threads * args.postings
+    # Средств хватает только на половину списаний
+    initial = args.amount * (attempted // 2)
+    Organization.objects.create(inn=inn, balance=initial)
+
+    applied = [0] * args.threads
+    errors = []
+
+    def worker(index):
+        try:
+            for start in range(0, args.postings, args.batch):
+                entries = [
+                    {
+                        'idempotency_key': f"bench-{index}-{number}",
+                        'inn': inn,
+                        'operation_type': BalanceLog.OperationType.WITHDRAWAL,
+                        'amount': args.amount,
+                    }
+                    for number in range(start, min(start + args.batch, args.postings))
+                ]
+                applied[index] += sum(
+                    result['status'] == APPLIED for result in post_entries(entries)
+                )
+        except Exception as error:  # Ошибку показываем в итогах, а не в потоке
+            errors.append(error)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    organization = Organization.objects.get(inn=inn)
+    total_applied = sum(applied)
+    logged = BalanceLog.objects.filter(organization_id=inn).count()
+    expected_balance = initial - args.amount * total_applied
+
+    print(f"attempted: {attempted}, applied: {total_applied}, logged: {logged}")
+    print(f"balance:   {organization.balance} (initial {initial}, expected {expected_balance})")
+    print(f"elapsed:   {elapsed:.2f}s, throughput: {attempted / elapsed:.0f} postings/s")
+
+    failed = (
+        errors
+        or organization.balance < 0
+        or organization.balance != expected_balance
+        or logged != total_applied
+        or total_applied != min(attempted, int(initial / args.amount))
+    )
+    for error in errors:
+        print(f"error: {error!r}")
+    if failed:
+        print("FAIL: ledger invariants violated")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Задержка вебхука при медленном приемнике логов.
+
+Сравнивает синхронный StreamHandler и AsyncQueueHandler, пишущие
+в поток, каждая запись в который занимает --sink-delay секунд
+(имитация медленного stdout или сборщика логов).
+
+    python -m benchmarks.bench_logging [--requests N] [--sink-delay S]
+"""
+import argparse
+import io
+import json
+import logging
+import statistics
+import sys
+import time
+import uuid
+
+from benchmarks import setup_django
+
+
+class SlowStream(io.StringIO):
+    """Поток, каждая запись в который блокируется на заданное время"""
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+
+    def write(self, text):
+        time.sleep(self.delay)
+        return super().write(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--sink-delay', type=float, default=0.002)
+    parser.add_argument('--queue-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    setup_django(APP_LOG_LEVEL='INFO')
+
+    from django.test import Client
+
+    from api.log_handlers import AsyncQueueHandler, JsonFormatter
+
+    def sync_handler():
+        return logging.StreamHandler(SlowStream(args.sink_delay))
+
+    def async_handler():
+        return AsyncQueueHandler(maxsize=args.queue_size, stream=SlowStream(args.sink_delay))
+
+    logger = logging.getLogger('api')
+    logger.setLevel(logging.INFO)
+    client = Client()
+
+    print(f"{'handler':<8} {'p50':>10} {'p99':>10} {'dropped':>8}")
+    for name, factory in (('sync', sync_handler), ('async', async_handler)):
+        handler = factory()
+        handler.setFormatter(JsonFormatter())
+        logger.handlers = [handler]
+
+        timings = []
+        for _ in range(args.requests):
+            body = json.dumps({
+                'operation_id': str(uuid.uuid4()),
+                'amount': '10.00',
+                'payer_inn': '1234567890',
+                'document_number': 'PAY-1',
+                'document_date': '2024-04-27T21:00:00Z',
+            })
+            started = time.perf_counter()
+            response = client.post('/api/webhook/bank/', body, content_type='application/json')
+            timings.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.status_code
+
+        dropped = getattr(handler, 'dropped', 0)
+        handler.close()
+        timings.sort()
+        print(f"{name:<8} {statistics.median(timings) * 1e6:8.0f}us "
+              f"{timings[int(len(timings) * 0.99) - 1] * 1e6:8.0f}us {dropped:8d}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+Сравнение полного профиля настроек и профиля api-only.
+
+Для каждого профиля в отдельных процессах замеряет:
+- холодный старт: импорт WSGI-приложения и первый запрос;
+- память воркера (max RSS) после серии запросов;
+- время запроса: чередование POST /api/webhook/bank/ и
+  GET /api/organizations/<inn>/balance/.
+
+    python -m benchmarks.bench_profiles [--requests N] [--runs N]
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import setup_django
+
+PROFILES = {
+    'full': ('bank_webhooks.settings', 'bank_webhooks.wsgi'),
+    'api-only': ('bank_webhooks.settings_api', 'bank_webhooks.wsgi_api'),
+}
+
+
+def make_environ(method, path, body=b''):
+    """Минимальное WSGI-окружение запроса"""
+    from wsgiref.util import setup_testing_defaults
+
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+    }
+    setup_testing_defaults(environ)
+    return environ
+
+
+def call(application, method, path, body=b''):
+    """Выполняет запрос к WSGI-приложению и возвращает код ответа"""
+    statuses = []
+    result = application(make_environ(method, path, body), lambda status, headers: statuses.append(status))
+    b''.join(result)
+    if hasattr(result, 'close'):
+        result.close()
+    return int(statuses[0].split()[0])
+
+
+def worker(wsgi_module, requests):
+    """Замеры внутри процесса воркера; результат печатается в stdout как JSON"""
+    import importlib
+    import resource
+    import uuid
+
+    started = time.perf_counter()
+    application = importlib.import_module(wsgi_module).application
+    imported = time.perf_counter()
+
+    balance_url = '/api/organizations/1234567890/balance/'
+
+    def webhook():
+        return json.dumps({
+            'operation_id': str(uuid.uuid4()),
+            'amount': '10.00',
+            'payer_inn': '1234567890',
+            'document_number': 'PAY-1',
+            'document_date': '2024-04-27T21:00:00Z',
+        }).encode()
+
+    assert call(application, 'POST', '/api/webhook/bank/', webhook()) == 200
+    first_request = time.perf_counter()
+
+    timings = []
+    for index in range(requests):
+        request_started = time.perf_counter()
+        if index % 2:
+            code = call(application, 'GET', balance_url)
+        else:
+            code = call(application, 'POST', '/api/webhook/bank/', webhook())
+        timings.append(time.perf_counter() - request_started)
+        assert code == 200, code
+
+    print(json.dumps({
+        'import': imported - started,
+        'cold_start': first_request - started,
+        'request': statistics.median(timings),
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'modules': len(sys.modules),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args.worker, args.requests)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_name = os.path.join(directory, 'bench.sqlite3')
+        # Схему создаем один раз полным профилем
+        setup_django(DB_NAME=db_name)
+
+        print(f"{'profile':<10} {'process':>10} {'import':>10} {'cold start':>11} "
+              f"{'request':>10} {'max RSS':>10} {'modules':>8}")
+        for name, (settings_module, wsgi_module) in PROFILES.items():
+            environ = {
+                **os.environ,
+                'DJANGO_SETTINGS_MODULE': settings_module,
+                'DB_NAME': db_name,
+            }
+            runs = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                output = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.bench_profiles',
+                     '--worker', wsgi_module, '--requests', str(args.requests)],
+                    env=environ, check=True, capture_output=True, text=True,
+                ).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                result['process'] = time.perf_counter() - started
+                runs.append(result)
+
+            median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+            print(f"{name:<10} {median['process'] * 1e3:8.1f}ms {median['import'] * 1e3:8.1f}ms "
+                  f"{median['cold_start'] * 1e3:9.1f}ms {median['request'] * 1e6:8.0f}us "
+                  f"{median['max_rss_kb'] / 1024:8.1f}MB {median['modules']:8.0f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
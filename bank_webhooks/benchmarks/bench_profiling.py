@@ -0,0 +1,105 @@
+"""
+Накладные расходы ProfilingMiddleware в выключенном состоянии.
+
+Сравнивает обработку GET /api/organizations/<inn>/balance/ полным стеком
+middleware и тем же стеком без ProfilingMiddleware, а также вызов самого
+middleware с пустым обработчиком. Завершается с ошибкой, если накладные
+расходы превышают пороги.
+
+Каждый повтор (--repeats) измеряет стек без профилировщика, с ним и снова
+без него. Накладные расходы - медиана по повторам разницы с профилировщиком
+относительно среднего двух замеров без него; шум - медиана расхождения двух
+замеров без профилировщика (A/A). Проверка не проходит, только если
+накладные расходы превышают порог больше чем на шум, поэтому результат
+не меняется от запуска к запуску на шумной машине или при малом --iterations.
+
+    python -m benchmarks.bench_profiling [--iterations N] [--repeats N]
+"""
+import argparse
+import gc
+import statistics
+import sys
+
+from benchmarks import setup_django, timeit
+
+# Допустимые накладные расходы выключенного профилировщика
+MAX_CALL_OVERHEAD = 2e-6  # Секунды на вызов middleware
+MAX_REQUEST_OVERHEAD = 0.03  # Доля от времени запроса
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--repeats', type=int, default=21)
+    args = parser.parse_args()
+
+    setup_django(PROFILING_ENABLED='False')
+
+    from django.conf import settings
+    from django.http import HttpResponse
+    from django.test import Client, RequestFactory, override_settings
+
+    from api.middleware import ProfilingMiddleware
+    from api.models import Organization
+    from api.profiling import get_profiler
+
+    assert not get_profiler().enabled
+
+    # Накладные расходы самого middleware на пустом обработчике
+    response = HttpResponse()
+    request = RequestFactory().get('/api/organizations/1234567890/balance/')
+    bare = lambda: response  # noqa: E731
+    wrapped = ProfilingMiddleware(lambda request: response)
+    calls = args.iterations * 100
+    bare_time = timeit(lambda: bare(), calls)
+    wrapped_time = timeit(lambda: wrapped(request), calls)
+    call_overhead = wrapped_time - bare_time
+
+    # Накладные расходы в составе полного запроса
+    Organization.objects.create(inn='1234567890', balance=1000)
+    url = '/api/organizations/1234567890/balance/'
+    without = [name for name in settings.MIDDLEWARE if name != 'api.middleware.ProfilingMiddleware']
+
+    def measure(middleware):
+        with override_settings(MIDDLEWARE=middleware):
+            client = Client()
+            client.get(url)  # Прогрев
+            # Как модуль timeit: сборка мусора не попадает в отдельные замеры
+            gc.collect()
+            gc.disable()
+            try:
+                return timeit(lambda: client.get(url), args.iterations)
+            finally:
+                gc.enable()
+
+    # Замер с профилировщиком окружен двумя замерами без него: их среднее
+    # компенсирует дрейф, а расхождение между ними оценивает шум
+    overheads, noise, baselines, profiled = [], [], [], []
+    for _ in range(args.repeats):
+        before = measure(without)
+        with_profiler = measure(settings.MIDDLEWARE)
+        after = measure(without)
+        baseline = (before + after) / 2
+        overheads.append((with_profiler - baseline) / baseline)
+        noise.append(abs(after - before) / baseline)
+        baselines.append(baseline)
+        profiled.append(with_profiler)
+    request_overhead = statistics.median(overheads)
+    request_noise = statistics.median(noise)
+
+    print(f"middleware call overhead: {call_overhead * 1e9:8.0f} ns")
+    print(f"request without profiler: {statistics.median(baselines) * 1e6:8.1f} us")
+    print(f"request, profiler off:    {statistics.median(profiled) * 1e6:8.1f} us "
+          f"({request_overhead:+.2%}, noise {request_noise:.2%})")
+
+    failed = (
+        call_overhead > MAX_CALL_OVERHEAD
+        or request_overhead - request_noise > MAX_REQUEST_OVERHEAD
+    )
+    if failed:
+        print("FAIL: disabled profiler overhead is above the threshold")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
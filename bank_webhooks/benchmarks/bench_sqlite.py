@@ -0,0 +1,145 @@
+"""
+Встраиваемый режим SQLite под конкурентной нагрузкой.
+
+Для стандартного бэкенда django.db.backends.sqlite3 и настроенного
+api.backends.sqlite3 (WAL, PRAGMA, BEGIN IMMEDIATE) запускает в отдельном
+процессе потоки-писатели (POST /api/webhook/bank/) и потоки-читатели
+(GET /api/organizations/<inn>/balance/) и печатает пропускную способность
+вебхуков, задержку чтения баланса и число ошибок.
+
+    python -m benchmarks.bench_sqlite [--writers N] [--readers N] [--duration S]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from benchmarks import setup_django
+
+ENGINES = {
+    'stock': 'django.db.backends.sqlite3',
+    'embedded': 'api.backends.sqlite3',
+}
+
+INNS = ['1234567890', '1234567891', '1234567892', '1234567893']
+
+
+def worker(args):
+    """Нагрузка внутри процесса; результат печатается в stdout как JSON"""
+    setup_django()
+
+    from django.db import connections
+    from django.test import Client
+
+    from api.models import Organization
+
+    for inn in INNS:
+        Organization.objects.create(inn=inn, balance=0)
+    connections.close_all()
+
+    stop = threading.Event()
+    lock = threading.Lock()
+    stats = {'webhooks': 0, 'write_errors': 0, 'read_errors': 0, 'reads': []}
+
+    def writer(index):
+        client = Client()
+        try:
+            while not stop.is_set():
+                body = json.dumps({
+                    'operation_id': str(uuid.uuid4()),
+                    'amount': '10.00',
+                    'payer_inn': INNS[index % len(INNS)],
+                    'document_number': 'PAY-1',
+                    'document_date': '2024-04-27T21:00:00Z',
+                })
+                try:
+                    ok = client.post(
+                        '/api/webhook/bank/', body, content_type='application/json'
+                    ).status_code == 200
+                except Exception:
+                    ok = False
+                with lock:
+                    stats['webhooks' if ok else 'write_errors'] += 1
+        finally:
+            connections.close_all()
+
+    def reader(index):
+        client = Client()
+        url = f'/api/organizations/{INNS[index % len(INNS)]}/balance/'
+        try:
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    ok = client.get(url).status_code == 200
+                except Exception:
+                    ok = False
+                elapsed = time.perf_counter() - started
+                with lock:
+                    if ok:
+                        stats['reads'].append(elapsed)
+                    else:
+                        stats['read_errors'] += 1
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=writer, args=(index,)) for index in range(args.writers)]
+    threads += [threading.Thread(target=reader, args=(index,)) for index in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    reads = sorted(stats['reads']) or [0.0]
+    print(json.dumps({
+        'webhooks_per_second': stats['webhooks'] / args.duration,
+        'write_errors': stats['write_errors'],
+        'read_p50': statistics.median(reads),
+        'read_p99': reads[max(0, int(len(reads) * 0.99) - 1)],
+        'reads': len(stats['reads']),
+        'read_errors': stats['read_errors'],
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args)
+
+    print(f"{'backend':<10} {'webhooks/s':>11} {'w.errors':>9} {'read p50':>10} "
+          f"{'read p99':>10} {'reads':>7} {'r.errors':>9}")
+    for name, engine in ENGINES.items():
+        with tempfile.TemporaryDirectory() as directory:
+            environ = {
+                **os.environ,
+                'DB_ENGINE': engine,
+                'DB_NAME': os.path.join(directory, 'bench.sqlite3'),
+            }
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_sqlite', '--worker',
+                 '--writers', str(args.writers), '--readers', str(args.readers),
+                 '--duration', str(args.duration)],
+                env=environ, check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+        print(f"{name:<10} {result['webhooks_per_second']:11.0f} {result['write_errors']:9d} "
+              f"{result['read_p50'] * 1e3:8.2f}ms {result['read_p99'] * 1e3:8.2f}ms "
+              f"{result['reads']:7d} {result['read_errors']:9d}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,353 @@
+"""
+Набор микробенчмарков с сохраненными базовыми значениями.
+
+Для каждого сценария замеряет время одной итерации (лучший из раундов), пик
+выделенной памяти (tracemalloc) и число SQL-запросов на итерацию на
+локальной SQLite со сгенерированными данными заданного объема.
+Сравнивает результаты с benchmarks/baselines.json и завершается с
+ошибкой, если число запросов или память выросли больше допустимого порога.
+
+Время хранится не в секундах, а в долях времени калибровочного цикла,
+замеренного в том же запуске, - так базовые значения переносимы между
+машинами лишь приблизительно (I/O и кэши масштабируются иначе, чем чистый
+Python), поэтому рост времени по умолчанию только выводится как
+предупреждение. --strict-time делает его ошибкой - для запуска на той же
+машине (CI-агенте), на которой записаны базовые значения.
+
+    python -m benchmarks.suite                     # проверка против базовых значений
+    python -m benchmarks.suite --update-baseline   # перезапись базовых значений
+    python -m benchmarks.suite --size 5000 --only webhook
+    python -m benchmarks.suite --strict-time       # рост времени - тоже ошибка
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarks import setup_django
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+# Допустимый рост метрик относительно базовых значений
+DEFAULT_THRESHOLDS = {
+    'time_ratio': 0.25,  # +25% ко времени относительно калибровочного цикла
+    'memory': 0.25,  # +25% к пику памяти
+    'queries': 0,  # Число запросов не должно расти вообще
+}
+
+CASES = {}
+
+
+def case(name, number=200):
+    """Регистрирует сценарий: фабрику, возвращающую функцию одной итерации"""
+    def register(factory):
+        CASES[name] = (factory, number)
+        return factory
+    return register
+
+
+def generate_fixtures(size):
+    """
+    Создает организации, платежи и записи истории баланса.
+
+    Args:
+        size: Количество платежей (организаций - в 10 раз меньше)
+    """
+    from django.utils import timezone
+
+    from api.models import BalanceLog, Organization, Payment
+
+    organizations = [
+        Organization(inn=f"{7700000000 + index}", balance=Decimal('1000.00'))
+        for index in range(max(1, size // 10))
+    ]
+    Organization.objects.bulk_create(organizations, batch_size=1000)
+
+    now = timezone.now()
+    payments = [
+        Payment(
+            operation_id=uuid.uuid4(),
+            amount=Decimal('100.00') + index % 1000,
+            payer_inn=organizations[index % len(organizations)].inn,
+            document_number=f"PAY-{index}",
+            document_date=now - timedelta(minutes=index),
+        )
+        for index in range(size)
+    ]
+    Payment.objects.bulk_create(payments, batch_size=1000)
+    BalanceLog.objects.bulk_create(
+        [
+            BalanceLog(
+                organization_id=payment.payer_inn,
+                amount=payment.amount,
+                operation_type=BalanceLog.OperationType.DEPOSIT,
+                payment=payment,
+            )
+            for payment in Payment.objects.all()
+        ],
+        batch_size=1000,
+    )
+
+
+def webhook_payload(operation_id=None, inn='7700000000'):
+    return {
+        'operation_id': str(operation_id or uuid.uuid4()),
+        'amount': '145000.00',
+        'payer_inn': inn,
+        'document_number': 'PAY-328',
+        'document_date': '2024-04-27T21:00:00Z',
+    }
+
+
+@case('webhook_serializer.is_valid', number=2000)
+def bench_webhook_serializer():
+    from api.serializers import WebhookSerializer
+
+    payload = webhook_payload()
+    return lambda: WebhookSerializer(data=payload).is_valid(raise_exception=True)
+
+
+@case('balance_serializer.data', number=5000)
+def bench_balance_serializer():
+    from api.models import Organization
+    from api.serializers import OrganizationBalanceSerializer
+
+    organization = Organization.objects.first()
+    return lambda: OrganizationBalanceSerializer(organization).data
+
+
+@case('webhook.post_new', number=100)
+def bench_webhook_new():
+    from django.test import Client
+
+    client = Client()
+
+    def run():
+        body = json.dumps(webhook_payload())
+        response = client.post('/api/webhook/bank/', body, content_type='application/json')
+        assert response.status_code == 200, response.status_code
+    return run
+
+
+@case('webhook.post_duplicate', number=500)
+def bench_webhook_duplicate():
+    from django.test import Client
+
+    client = Client()
+    body = json.dumps(webhook_payload())
+    client.post('/api/webhook/bank/', body, content_type='application/json')
+
+    def run():
+        response = client.post('/api/webhook/bank/', body, content_type='application/json')
+        assert response.status_code == 200, response.status_code
+    return run
+
+
+@case('balance.get', number=500)
+def bench_balance_get():
+    from django.test import Client
+
+    client = Client()
+
+    def run():
+        response = client.get('/api/organizations/7700000000/balance/')
+        assert response.status_code == 200, response.status_code
+    return run
+
+
+def admin_changelist(url):
+    from django.contrib.auth import get_user_model
+    from django.test import Client
+
+    User = get_user_model()
+    user = User.objects.filter(username='bench').first() or User.objects.create_superuser(
+        'bench', 'bench@example.com', 'bench'
+    )
+    client = Client()
+    client.force_login(user)
+
+    def run():
+        response = client.get(url)
+        assert response.status_code == 200, response.status_code
+    return run
+
+
+@case('admin.payment_changelist', number=10)
+def bench_payment_changelist():
+    return admin_changelist('/admin/api/payment/')
+
+
+@case('admin.balancelog_changelist', number=10)
+def bench_balancelog_changelist():
+    return admin_changelist('/admin/api/balancelog/')
+
+
+def best_time(run, number, repeat):
+    """Время итерации в лучшем из раундов (секунды)"""
+    rounds = []
+    # Как timeit: сборщик мусора не срабатывает посреди замера
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for _ in range(number):
+                run()
+            rounds.append((time.perf_counter() - started) / number)
+    finally:
+        gc.enable()
+
+    # Лучший раунд меньше всего зависит от фонового шума машины
+    return min(rounds)
+
+
+def calibration_run():
+    """
+    Калибровочная итерация: фиксированная работа интерпретатора того же
+    рода, что и в сценариях (словари, строки, JSON), без БД и Django.
+    """
+    data = {f"key-{index}": {'amount': str(index * 100), 'inn': str(7700000000 + index)}
+            for index in range(200)}
+    json.loads(json.dumps(data, sort_keys=True))
+
+
+def calibrate(repeat):
+    """Время калибровочной итерации на этой машине (секунды)"""
+    calibration_run()
+    return best_time(calibration_run, 500, repeat)
+
+
+def measure(run, number, repeat, calibration):
+    """
+    Замеряет сценарий.
+
+    Returns:
+        dict: time - время итерации в лучшем раунде (с), time_ratio - оно же
+            в долях калибровочной итерации, memory - пик памяти итерации
+            (байты), queries - число SQL-запросов на итерацию
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    run()  # Прогрев: ленивые импорты, кэши, первое подключение
+
+    with CaptureQueriesContext(connection) as context:
+        run()
+    queries = len(context.captured_queries)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    elapsed = best_time(run, number, repeat)
+    return {
+        'time': elapsed,
+        'time_ratio': elapsed / calibration,
+        'memory': peak - before,
+        'queries': queries,
+    }
+
+
+def compare(name, result, baseline, thresholds):
+    """
+    Возвращает регрессии сценария.
+
+    Returns:
+        list: Пары (метрика, описание регрессии)
+    """
+    regressions = []
+    for metric, limit in thresholds.items():
+        if metric not in baseline:
+            continue
+        allowed = baseline[metric] * (1 + limit)
+        if result[metric] > allowed:
+            regressions.append((
+                metric,
+                f"{name}: {metric} {result[metric]:.6g} > {baseline[metric]:.6g} (+{limit:.0%} allowed)",
+            ))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=2000, help="Number of generated payments")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', help="Run only cases whose name contains this substring")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--time-threshold', type=float, default=DEFAULT_THRESHOLDS['time_ratio'])
+    parser.add_argument('--memory-threshold', type=float, default=DEFAULT_THRESHOLDS['memory'])
+    parser.add_argument('--strict-time', action='store_true',
+                        help="Fail on time regressions too (same machine as the baseline)")
+    args = parser.parse_args()
+
+    thresholds = {
+        **DEFAULT_THRESHOLDS,
+        'time_ratio': args.time_threshold,
+        'memory': args.memory_threshold,
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(DB_NAME=os.path.join(directory, 'bench.sqlite3'))
+        generate_fixtures(args.size)
+
+        baselines = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as baseline_file:
+                baselines = json.load(baseline_file)
+        size_key = str(args.size)
+        size_baselines = baselines.get(size_key, {})
+
+        calibration = calibrate(args.repeat)
+        print(f"calibration {calibration * 1e6:.1f}us")
+
+        results = {}
+        regressions = []
+        print(f"{'case':<32} {'time':>10} {'ratio':>8} {'memory':>10} {'queries':>8} {'vs baseline':>12}")
+        for name, (factory, number) in CASES.items():
+            if args.only and args.only not in name:
+                continue
+            result = measure(factory(), number, args.repeat, calibration)
+            # Абсолютное время только выводится: в базовых значениях - доля калибровки
+            results[name] = {metric: result[metric] for metric in ('time_ratio', 'memory', 'queries')}
+
+            baseline = size_baselines.get(name)
+            if baseline and 'time_ratio' in baseline:
+                delta = f"{result['time_ratio'] / baseline['time_ratio'] - 1:+.1%}"
+            else:
+                delta = 'new'
+            print(f"{name:<32} {result['time'] * 1e6:8.1f}us {result['time_ratio']:8.2f} "
+                  f"{result['memory'] / 1024:8.1f}KB {result['queries']:8d} {delta:>12}")
+            if baseline and not args.update_baseline:
+                regressions.extend(compare(name, result, baseline, thresholds))
+
+    if args.update_baseline:
+        # Прежние записи сценария заменяются целиком (в т.ч. устаревший ключ time)
+        baselines[size_key] = {**size_baselines, **results}
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print(f"Baseline for size {args.size} written to {args.baseline}")
+        return 0
+
+    failed = False
+    for metric, regression in regressions:
+        if metric == 'time_ratio' and not args.strict_time:
+            print(f"WARNING {regression}")
+        else:
+            print(f"REGRESSION {regression}")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())